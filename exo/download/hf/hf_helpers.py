@@ -2,6 +2,7 @@ import asyncio
 import aiohttp
 import json
 import os
+import struct
 from urllib.parse import urljoin
 from typing import Callable, Optional, Coroutine, Any, Dict, List, Union, Literal
 from datetime import datetime, timedelta
@@ -395,6 +396,19 @@ def extract_layer_num(tensor_name: str) -> Optional[int]:
   return None
 
 
+def is_shard_weight(name: str, shard: Shard, tied_embeddings: bool = False) -> bool:
+  # the shard's own layers, plus the embeddings on the first shard and the final norm and head on the last. Models that
+  # tie the head to the embeddings need the embeddings on the last shard too.
+  parts = name.split('.')
+  if "layers" in parts:
+    return shard.start_layer <= int(parts[parts.index("layers") + 1]) <= shard.end_layer
+  if name in ("model.embed_tokens.weight", "tok_embeddings.weight"):
+    return shard.is_first_layer() or (tied_embeddings and shard.is_last_layer())
+  if name in ("model.norm.weight", "lm_head.weight", "norm.weight", "output.weight"):
+    return shard.is_last_layer()
+  return True
+
+
 def get_allow_patterns(weight_map: Dict[str, str], shard: Shard) -> List[str]:
   default_patterns = set(["*.json","*.py","tokenizer.model","*.tiktoken","*.txt"])
   shard_specific_patterns = set()
@@ -412,3 +426,68 @@ def get_allow_patterns(weight_map: Dict[str, str], shard: Shard) -> List[str]:
     shard_specific_patterns = set("*.safetensors")
   if DEBUG >= 2: print(f"get_allow_patterns {weight_map=} {shard=} {shard_specific_patterns=}")
   return list(default_patterns | shard_specific_patterns)
+
+
+async def get_safetensors_header(session: aiohttp.ClientSession, repo_id: str, revision: str, filename: str) -> Dict[str, Any]:
+  # A safetensors file starts with the length of its JSON header (little endian u64) followed by the header itself,
+  # which lists every tensor's byte range. Read it from the local snapshot if the file is there, otherwise fetch only
+  # the header with range requests.
+  snapshot_dir = await get_local_snapshot_dir(repo_id, revision)
+  if snapshot_dir and await aios.path.exists(snapshot_dir/filename):
+    async with aiofiles.open(snapshot_dir/filename, 'rb') as f:
+      header_size = struct.unpack("<Q", await f.read(8))[0]
+      return json.loads(await f.read(header_size))
+
+  url = f"{get_hf_endpoint()}/{repo_id}/resolve/{revision}/{filename}"
+  headers = await get_auth_headers()
+  async with session.get(url, headers={**headers, "Range": "bytes=0-7"}) as response:
+    response.raise_for_status()
+    header_size = struct.unpack("<Q", await response.content.readexactly(8))[0]
+  async with session.get(url, headers={**headers, "Range": f"bytes=8-{8 + header_size - 1}"}) as response:
+    response.raise_for_status()
+    return json.loads(await response.content.readexactly(header_size))
+
+
+async def get_kv_cache_bytes_per_token(repo_id: str, revision: str = "main", dtype_size: int = 2) -> int:
+  """Bytes of KV cache one layer needs per token of context, from the model's config.json. 0 if unknown."""
+  snapshot_dir = await download_repo_files(repo_id=repo_id, revision=revision, allow_patterns="config.json")
+  config_path = snapshot_dir/"config.json"
+  if not await aios.path.exists(config_path):
+    return 0
+  async with aiofiles.open(config_path, 'r') as f:
+    config = json.loads(await f.read())
+  config = config.get("text_config", config)
+  n_heads = config.get("num_attention_heads")
+  if not n_heads or not config.get("hidden_size"):
+    return 0
+  head_dim = config.get("head_dim") or config["hidden_size"]//n_heads
+  return 2*config.get("num_key_value_heads", n_heads)*head_dim*dtype_size
+
+
+async def get_layer_sizes(repo_id: str, n_layers: int, revision: str = "main", kv_context: int = 8192) -> List[int]:
+  """
+    Bytes each layer needs on the node that runs it: its weights, read from the safetensors headers without
+    downloading them, plus a KV cache for kv_context tokens. Tensors outside the numbered layers (embeddings, final
+    norm, lm head) are counted towards the first or last layer, whichever shard loads them.
+    """
+  weight_map = await get_weight_map(repo_id, revision)
+  filenames = sorted(set(weight_map.values())) if weight_map else ["model.safetensors"]
+  async with aiohttp.ClientSession() as session:
+    headers = await asyncio.gather(*[get_safetensors_header(session, repo_id, revision, filename) for filename in filenames])
+
+  layer_sizes = [0]*n_layers
+  for header in headers:
+    for tensor_name, info in header.items():
+      if tensor_name == "__metadata__":
+        continue
+      size = info["data_offsets"][1] - info["data_offsets"][0]
+      layer_num = extract_layer_num(tensor_name)
+      if layer_num is not None and layer_num < n_layers:
+        layer_sizes[layer_num] += size
+      elif "embed" in tensor_name:
+        layer_sizes[0] += size
+      else:
+        layer_sizes[-1] += size
+
+  kv_bytes = (await get_kv_cache_bytes_per_token(repo_id, revision))*kv_context
+  return [size + kv_bytes for size in layer_sizes]
@@ -1,11 +1,11 @@
 import asyncio
 import traceback
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from exo.inference.shard import Shard
 from exo.download.shard_download import ShardDownloader
 from exo.download.download_progress import RepoProgressEvent
-from exo.download.hf.hf_helpers import download_repo_files, RepoProgressEvent, get_weight_map, get_allow_patterns, get_repo_root
+from exo.download.hf.hf_helpers import download_repo_files, RepoProgressEvent, get_weight_map, get_allow_patterns, get_repo_root, get_layer_sizes
 from exo.helpers import AsyncCallbackSystem, DEBUG
 
 
@@ -16,6 +16,7 @@ class HFShardDownloader(ShardDownloader):
     self.active_downloads: Dict[Shard, asyncio.Task] = {}
     self.completed_downloads: Dict[Shard, Path] = {}
     self._on_progress = AsyncCallbackSystem[str, Tuple[Shard, RepoProgressEvent]]()
+    self.layer_sizes: Dict[str, List[int]] = {}
 
   async def ensure_shard(self, shard: Shard) -> Path:
     if shard in self.completed_downloads:
@@ -72,6 +73,15 @@ class HFShardDownloader(ShardDownloader):
 
     return await download_repo_files(repo_id=shard.model_id, progress_callback=wrapped_progress_callback, allow_patterns=allow_patterns, max_parallel_downloads=self.max_parallel_downloads)
 
+  async def get_layer_sizes(self, shard: Shard) -> Optional[List[int]]:
+    if shard.model_id not in self.layer_sizes:
+      try:
+        self.layer_sizes[shard.model_id] = await get_layer_sizes(shard.model_id, shard.n_layers)
+      except Exception as e:
+        if DEBUG >= 1: print(f"Could not read layer sizes for {shard.model_id}: {e}")
+        return None
+    return self.layer_sizes[shard.model_id]
+
   @property
   def on_progress(self) -> AsyncCallbackSystem[str, Tuple[Shard, RepoProgressEvent]]:
     return self._on_progress
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from pathlib import Path
 from exo.inference.shard import Shard
 from exo.download.download_progress import RepoProgressEvent
@@ -20,6 +20,13 @@ class ShardDownloader(ABC):
         """
     pass
 
+  async def get_layer_sizes(self, shard: Shard) -> Optional[List[int]]:
+    """
+        Bytes each layer of the model needs in memory, used to make partitions fit each node.
+        None if the downloader can't tell without downloading the model.
+        """
+    return None
+
   @property
   @abstractmethod
   def on_progress(self) -> AsyncCallbackSystem[str, Tuple[Shard, RepoProgressEvent]]:
@@ -1,6 +1,6 @@
 import os
 import asyncio
-from typing import Callable, TypeVar, Optional, Dict, Generic, Tuple, List
+from typing import Callable, TypeVar, Optional, Dict, Generic, Tuple
 import socket
 import random
 import platform
@@ -138,28 +138,6 @@ class AsyncCallbackSystem(Generic[K, T]):
       callback.set(*args)
 
 
-K = TypeVar('K', bound=str)
-V = TypeVar('V')
-
-
-class PrefixDict(Generic[K, V]):
-  def __init__(self):
-    self.items: Dict[K, V] = {}
-
-  def add(self, key: K, value: V) -> None:
-    self.items[key] = value
-
-  def find_prefix(self, argument: str) -> List[Tuple[K, V]]:
-    return [(key, value) for key, value in self.items.items() if argument.startswith(key)]
-
-  def find_longest_prefix(self, argument: str) -> Optional[Tuple[K, V]]:
-    matches = self.find_prefix(argument)
-    if len(matches) == 0:
-      return None
-
-    return max(matches, key=lambda x: len(x[0]))
-
-
 def is_valid_uuid(val):
   try:
     uuid.UUID(str(val))
@@ -168,6 +146,10 @@ def is_valid_uuid(val):
     return False
 
 
+def get_exo_home() -> Path:
+  return Path(os.environ.get("EXO_HOME", Path.home()/".cache"/"exo"))
+
+
 def get_or_create_node_id():
   NODE_ID_FILE = Path(tempfile.gettempdir()) / ".exo_node_id"
   try:
@@ -4,6 +4,7 @@ import asyncio
 import json
 from exo.inference.inference_engine import InferenceEngine
 from exo.inference.shard import Shard
+from exo.inference.tensor_parallel import TensorParallelContext
 
 class DummyInferenceEngine(InferenceEngine):
   def __init__(self):
@@ -13,7 +14,9 @@ class DummyInferenceEngine(InferenceEngine):
     self.latency_mean = 0.1
     self.latency_stddev = 0.02
 
-  async def infer_prompt(self, request_id: str, shard: Shard, prompt: str, image_str: Optional[str] = None, inference_state: Optional[str] = None) -> Tuple[np.ndarray, str, bool]:
+  async def infer_prompt(
+    self, request_id: str, shard: Shard, prompt: str, image_str: Optional[str] = None, inference_state: Optional[str] = None, tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> Tuple[np.ndarray, str, bool]:
     try:
       await self.ensure_shard(shard)
 
@@ -36,7 +39,9 @@ class DummyInferenceEngine(InferenceEngine):
       print(f"Error in DummyInferenceEngine.infer_prompt: {str(e)}")
       return np.array([[self.eos_token_id]]), json.dumps({"error": str(e)}), True
 
-  async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[str] = None) -> Tuple[np.ndarray, str, bool]:
+  async def infer_tensor(
+    self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[str] = None, tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> Tuple[np.ndarray, str, bool]:
     await self.ensure_shard(shard)
     state = json.loads(inference_state or "{}")
     start_pos = state.get("start_pos", 0)
@@ -0,0 +1,58 @@
+from typing import Any, Dict, List, Tuple
+import numpy as np
+
+# Expert parallelism for mixture of experts layers. The nodes of a tensor parallel group each hold a share of the
+# routed experts of every MoE layer in their stage and everything else in full. Every node routes all tokens, runs the
+# ones routed to its own experts and the partial outputs are summed over the group, like a tensor parallel layer.
+# Placements map a layer (as a string, since they travel as json) to the experts each rank holds.
+Placement = Dict[str, List[List[int]]]
+
+
+def check_expert_parallel(n_experts: int, world_size: int) -> None:
+  if n_experts % world_size != 0:
+    raise ValueError(f"Can't split {n_experts} experts across {world_size} expert parallel ranks")
+
+
+def contiguous_placement(n_experts: int, world_size: int) -> List[List[int]]:
+  check_expert_parallel(n_experts, world_size)
+  per_rank = n_experts // world_size
+  return [list(range(rank*per_rank, (rank + 1)*per_rank)) for rank in range(world_size)]
+
+
+def balance_experts(load: List[int], world_size: int) -> List[List[int]]:
+  """Gives every rank the same number of experts while evening out how many tokens each rank's experts get."""
+  check_expert_parallel(len(load), world_size)
+  per_rank = len(load) // world_size
+  ranks: List[List[int]] = [[] for _ in range(world_size)]
+  totals = [0]*world_size
+  # busiest experts first, each to the least loaded rank with room left; ties go to the lower index
+  for expert in sorted(range(len(load)), key=lambda e: (-load[e], e)):
+    rank = min((r for r in range(world_size) if len(ranks[r]) < per_rank), key=lambda r: (totals[r], r))
+    ranks[rank].append(expert)
+    totals[rank] += load[expert]
+  return [sorted(experts) for experts in ranks]
+
+
+def suggest_placement(layer_loads: Dict[str, List[int]], world_size: int) -> Placement:
+  return {layer: balance_experts(load, world_size) for layer, load in layer_loads.items()}
+
+
+class ExpertRoutingStats:
+  """Counts how many tokens each MoE layer routes to each of its experts."""
+  def __init__(self, n_experts: int):
+    self.n_experts = n_experts
+    self.counts: Dict[int, np.ndarray] = {}
+    self.pending: List[Tuple[int, Any]] = []
+
+  def record(self, layer: int, expert_indices: Any) -> None:
+    # kept as is until flush, so lazily evaluated arrays aren't forced in the middle of a forward pass
+    self.pending.append((layer, expert_indices))
+
+  def flush(self) -> None:
+    pending, self.pending = self.pending, []
+    for layer, expert_indices in pending:
+      counts = self.counts.setdefault(layer, np.zeros(self.n_experts, dtype=np.int64))
+      counts += np.bincount(np.array(expert_indices).reshape(-1), minlength=self.n_experts)
+
+  def to_dict(self) -> Dict[str, List[int]]:
+    return {str(layer): counts.tolist() for layer, counts in sorted(self.counts.items())}
@@ -5,21 +5,42 @@ from exo.helpers import DEBUG  # Make sure to import DEBUG
 from typing import Tuple, Optional
 from abc import ABC, abstractmethod
 from .shard import Shard
+from .tensor_parallel import TensorParallelContext
+from .expert_parallel import ExpertRoutingStats
+from .kv_blocks import KVBlockManager
 
 
 class InferenceEngine(ABC):
+  # Engines that can run a slice of every layer set supports_tensor_parallel. When the node's pipeline stage is split
+  # across a group of nodes, each call gets the group's tensor_parallel context.
+  supports_tensor_parallel: bool = False
+  # engines running mixture of experts models count how tokens are routed, to suggest balanced expert placements
+  routing_stats: Optional[ExpertRoutingStats] = None
+  # engines admit requests' kv caches through a block manager sized to the node's memory, which reports its occupancy
+  kv_blocks: Optional[KVBlockManager] = None
+
   @abstractmethod
-  async def infer_prompt(self, request_id: str, shard: Shard, prompt: str, image_str: Optional[str] = None, inference_state: Optional[str] = None) -> Tuple[np.ndarray, str, bool]:
+  async def infer_prompt(
+    self, request_id: str, shard: Shard, prompt: str, image_str: Optional[str] = None, inference_state: Optional[str] = None, tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> Tuple[np.ndarray, str, bool]:
     pass
 
   @abstractmethod
-  async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[str] = None) -> Tuple[np.ndarray, str, bool]:
+  async def infer_tensor(
+    self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[str] = None, tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> Tuple[np.ndarray, str, bool]:
+    pass
+
+  async def finish_request(self, request_id: str) -> None:
+    # every node is told when a request is done, engines holding on to its kv cache let go of it here
     pass
 
 
-def get_inference_engine(inference_engine_name: str, shard_downloader: 'ShardDownloader'):
+def get_inference_engine(inference_engine_name: str, shard_downloader: 'ShardDownloader', kv_cache_quantize: Optional[str] = None):
   if DEBUG >= 2:
     print(f"get_inference_engine called with: {inference_engine_name}")
+  if kv_cache_quantize is not None and inference_engine_name not in ("tinygrad", "torch"):
+    raise ValueError(f"Quantized kv caches aren't supported by the {inference_engine_name} inference engine")
   if inference_engine_name == "mlx":
     from exo.inference.mlx.sharded_inference_engine import MLXDynamicShardInferenceEngine
 
@@ -29,7 +50,11 @@ def get_inference_engine(inference_engine_name: str, shard_downloader: 'ShardDow
     import tinygrad.helpers
     tinygrad.helpers.DEBUG.value = int(os.getenv("TINYGRAD_DEBUG", default="0"))
 
-    return TinygradDynamicShardInferenceEngine(shard_downloader)
+    return TinygradDynamicShardInferenceEngine(shard_downloader, kv_cache_quantize=kv_cache_quantize)
+  elif inference_engine_name == "torch":
+    from exo.inference.torch.inference import TorchDynamicShardInferenceEngine
+
+    return TorchDynamicShardInferenceEngine(shard_downloader, kv_cache_quantize=kv_cache_quantize)
   elif inference_engine_name == "dummy":
     from exo.inference.dummy_inference_engine import DummyInferenceEngine
     return DummyInferenceEngine()
@@ -0,0 +1,111 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+import psutil
+from exo.helpers import DEBUG
+
+# A node's memory for kv caches, split into blocks of BLOCK_SIZE token positions. Requests are given blocks from a free
+# list as their caches grow and give them back when they end, so a node holds as many requests as fit in its budget
+# rather than a fixed number. Engines keep each request's cache in their own layout and allocate through the manager
+# before growing it; the page tables say which blocks a request holds. Running requests keep their blocks: a new
+# request that doesn't fit is turned away, unless requests that have stopped coming back free up enough.
+BLOCK_SIZE = 16
+# share of the memory available when a shard is loaded that kv caches may use, unless KV_CACHE_MB is set
+KV_CACHE_FRACTION = 0.25
+# seconds after its last step that a request's cache counts as abandoned and may be evicted, as long as the api waits
+IDLE_TIMEOUT = float(os.getenv("KV_CACHE_IDLE_TIMEOUT", 90))
+
+
+def kv_cache_budget() -> int:
+  if os.getenv("KV_CACHE_MB"): return int(float(os.environ["KV_CACHE_MB"])*2**20)
+  return int(psutil.virtual_memory().available*KV_CACHE_FRACTION)
+
+
+class KVCacheFullError(ValueError):
+  pass
+
+
+class KVBlockManager:
+  def __init__(self, n_blocks: int, block_size: int = BLOCK_SIZE, bytes_per_token: int = 0, idle_timeout: float = IDLE_TIMEOUT, clock: Callable[[], float] = time.monotonic):
+    self.block_size = block_size
+    self.bytes_per_token = bytes_per_token
+    self.n_blocks = n_blocks
+    self.idle_timeout = idle_timeout
+    self.clock = clock
+    self.free_blocks: List[int] = list(range(n_blocks - 1, -1, -1))
+    # block ids each request holds, in position order, least recently used request first
+    self.page_tables: OrderedDict[str, List[int]] = OrderedDict()
+    self.last_used: Dict[str, float] = {}
+    # owners of blocks held for caches other than requests', like the prefix cache, which are never evicted
+    self.set_aside_for: Set[str] = set()
+
+  @classmethod
+  def from_budget(cls, bytes_per_token: int, budget: Optional[int] = None, block_size: int = BLOCK_SIZE) -> "KVBlockManager":
+    budget = kv_cache_budget() if budget is None else budget
+    n_blocks = budget // max(1, bytes_per_token*block_size)
+    if DEBUG >= 1: print(f"kv cache budget of {budget/2**20:.0f} MiB holds {n_blocks*block_size} tokens in {n_blocks} blocks")
+    return cls(n_blocks, block_size, bytes_per_token)
+
+  def blocks_for(self, n_tokens: int) -> int:
+    return -(-n_tokens // self.block_size)
+
+  def can_allocate(self, request_id: str, n_tokens: int) -> bool:
+    return self.blocks_for(n_tokens) - len(self.page_tables.get(request_id, [])) <= len(self.free_blocks)
+
+  def allocate(self, request_id: str, n_tokens: int) -> List[int]:
+    """Grows the request's page table to cover n_tokens positions and marks it the most recently used."""
+    needed = self.blocks_for(n_tokens) - len(self.page_tables.get(request_id, []))
+    if needed > len(self.free_blocks):
+      raise KVCacheFullError(
+        f"kv cache of request {request_id} needs {needed} more blocks of {self.block_size} tokens, {len(self.free_blocks)} are free and "
+        f"{len(self.page_tables) - len(self.set_aside_for)} running requests hold the rest"
+      )
+    pages = self.page_tables.setdefault(request_id, [])
+    self.page_tables.move_to_end(request_id)
+    self.last_used[request_id] = self.clock()
+    for _ in range(needed):
+      pages.append(self.free_blocks.pop())
+    return pages
+
+  def set_aside(self, owner: str, n_tokens: int) -> List[int]:
+    """Holds blocks for n_tokens positions of a cache that isn't a request's, out of reach of eviction."""
+    pages = self.allocate(owner, n_tokens)
+    self.set_aside_for.add(owner)
+    return pages
+
+  def reserve(self, request_id: str, n_tokens: int, evict: Callable[[str], None]) -> List[int]:
+    """
+    Allocates n_tokens positions for the request. While they don't fit, requests idle for idle_timeout seconds are
+    evicted, least recently used first. Running requests are never evicted, so KVCacheFullError is raised instead.
+    """
+    while not self.can_allocate(request_id, n_tokens) and (evicted := self.least_recently_used(exclude=request_id, idle=True)) is not None:
+      evict(evicted)
+      self.free(evicted)
+      if DEBUG >= 2: print(f"Evicted idle kv cache of request {evicted}, {len(self.free_blocks)} of {self.n_blocks} blocks are free")
+    return self.allocate(request_id, n_tokens)
+
+  def free(self, request_id: str) -> None:
+    self.free_blocks.extend(reversed(self.page_tables.pop(request_id, [])))
+    self.last_used.pop(request_id, None)
+
+  def least_recently_used(self, exclude: Optional[str] = None, idle: bool = False) -> Optional[str]:
+    now = self.clock()
+    for request_id in self.page_tables:
+      if request_id == exclude or request_id in self.set_aside_for: continue
+      return request_id if not idle or now - self.last_used[request_id] >= self.idle_timeout else None
+    return None
+
+  @property
+  def used_blocks(self) -> int:
+    return self.n_blocks - len(self.free_blocks)
+
+  def to_dict(self) -> Dict[str, int]:
+    return {
+      "block_size": self.block_size,
+      "total_blocks": self.n_blocks,
+      "used_blocks": self.used_blocks,
+      "set_aside_blocks": sum(len(self.page_tables[owner]) for owner in self.set_aside_for),
+      "requests": len(self.page_tables) - len(self.set_aside_for),
+      "bytes_per_token": self.bytes_per_token,
+    }
@@ -1,18 +1,25 @@
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Callable, List, Optional
 
+import numpy as np
 import mlx.core as mx
 import mlx.nn as nn
 
 from mlx_lm.models.base import KVCache
-from mlx_lm.models.deepseek_v2 import ModelArgs, DeepseekV2DecoderLayer
+from mlx_lm.models.deepseek_v2 import ModelArgs, DeepseekV2DecoderLayer, DeepseekV2MoE, DeepseekV2MLP, MoEGate
+from mlx_lm.models.switch_layers import SwitchGLU
 from .base import IdentityBlock
 from exo.inference.shard import Shard
+from exo.inference.expert_parallel import ExpertRoutingStats, Placement, contiguous_placement
 
 
 @dataclass
 class ModelArgs(ModelArgs):
   shard: Shard = field(default_factory=lambda: Shard("", 0, 0, 0))
+  # expert parallelism, see exo/inference/expert_parallel.py
+  tp_rank: int = 0
+  tp_size: int = 1
+  expert_placement: Optional[Placement] = None
 
   def __post_init__(self):
     if isinstance(self.shard, Shard):
@@ -23,6 +30,39 @@ class ModelArgs(ModelArgs):
     self.shard = Shard(**self.shard)
 
 
+class ShardedMoE(nn.Module):
+  """
+  DeepseekV2MoE holding only this rank's routed experts. Tokens routed to experts on other ranks are masked out, so
+  the outputs of all ranks sum to the full layer output. The shared experts run on rank 0 only.
+  """
+  def __init__(self, config: ModelArgs, layer_idx: int, experts: List[int], routing_stats: ExpertRoutingStats, reduce: Callable[[mx.array], mx.array]):
+    super().__init__()
+    self.config = config
+    self.layer_idx = layer_idx
+    self.routing_stats = routing_stats
+    self.reduce = reduce
+    self.switch_mlp = SwitchGLU(config.hidden_size, config.moe_intermediate_size, len(experts))
+    self.gate = MoEGate(config)
+    if config.n_shared_experts is not None and config.tp_rank == 0:
+      self.shared_experts = DeepseekV2MLP(config=config, intermediate_size=config.moe_intermediate_size*config.n_shared_experts)
+    local = np.full(config.n_routed_experts, -1, dtype=np.int32)
+    local[experts] = np.arange(len(experts), dtype=np.int32)
+    self._local_index = mx.array(local)
+
+  def __call__(self, x):
+    inds, scores = self.gate(x)
+    self.routing_stats.record(self.layer_idx, inds)
+    if self.config.tp_size > 1:
+      local_inds = self._local_index[inds]
+      scores = mx.where(local_inds >= 0, scores, 0.0)
+      inds = mx.maximum(local_inds, 0)
+    y = self.switch_mlp(x, inds)
+    y = (y*scores[..., None]).sum(axis=-2)
+    if "shared_experts" in self:
+      y = y + self.shared_experts(x)
+    return self.reduce(y) if self.config.tp_size > 1 else y
+
+
 class DeepseekV2Model(nn.Module):
   def __init__(self, config: ModelArgs):
     super().__init__()
@@ -32,10 +72,16 @@ class DeepseekV2Model(nn.Module):
     if self.args.shard.is_first_layer():
       self.embed_tokens = nn.Embedding(config.vocab_size, config.hidden_size)
 
+    # with tp_size > 1, all_reduce has to be set to this request's reduction over the group before each call
+    self.all_reduce: Optional[Callable[[np.ndarray], np.ndarray]] = None
+    self.routing_stats = ExpertRoutingStats(config.n_routed_experts or 0)
     self.layers = []
     for i in range(self.num_hidden_layers):
       if self.args.shard.start_layer <= i <= self.args.shard.end_layer:
-        self.layers.append(DeepseekV2DecoderLayer(config, i))
+        layer = DeepseekV2DecoderLayer(config, i)
+        if isinstance(layer.mlp, DeepseekV2MoE):
+          layer.mlp = ShardedMoE(config, i, local_experts(config, i), self.routing_stats, self.reduce)
+        self.layers.append(layer)
       else:
         self.layers.append(IdentityBlock())
 
@@ -46,6 +92,7 @@ class DeepseekV2Model(nn.Module):
     self,
     x: mx.array,
     cache: Optional[KVCache] = None,
+    last_only: bool = False,
   ) -> mx.array:
     if self.args.shard.is_first_layer():
       h = self.embed_tokens(x)
@@ -65,11 +112,26 @@ class DeepseekV2Model(nn.Module):
       h = layer(h, mask, c)
 
     if self.args.shard.is_last_layer():
+      if last_only:
+        h = h[:, -1:, :]
       h = self.norm(h)
     return h
 
+  def reduce(self, x: mx.array) -> mx.array:
+    # numpy has no bfloat16, so partial sums travel as float32
+    return mx.array(self.all_reduce(np.array(x.astype(mx.float32)))).astype(x.dtype)
+
+
+def local_experts(config: ModelArgs, layer: int) -> List[int]:
+  if config.tp_size == 1:
+    return list(range(config.n_routed_experts))
+  placement = (config.expert_placement or {}).get(str(layer)) or contiguous_placement(config.n_routed_experts, config.tp_size)
+  return placement[config.tp_rank]
+
 
 class Model(nn.Module):
+  supports_expert_parallel = True
+
   def __init__(self, config: ModelArgs):
     super().__init__()
     self.args = config
@@ -82,8 +144,9 @@ class Model(nn.Module):
     self,
     inputs: mx.array,
     cache: Optional[KVCache] = None,
+    last_only: bool = False,
   ):
-    out = self.model(inputs, cache)
+    out = self.model(inputs, cache, last_only)
     if self.args.shard.is_last_layer():
       return self.lm_head(out)
     return out
@@ -107,7 +170,9 @@ class Model(nn.Module):
         for k in ["weight", "scales", "biases"]:
           if f"{prefix}.mlp.experts.0.{m}.{k}" in shard_state_dict:
             to_join = [shard_state_dict.pop(f"{prefix}.mlp.experts.{e}.{m}.{k}") for e in range(self.args.n_routed_experts)]
-            shard_state_dict[f"{prefix}.mlp.switch_mlp.{m}.{k}"] = mx.stack(to_join)
+            shard_state_dict[f"{prefix}.mlp.switch_mlp.{m}.{k}"] = mx.stack([to_join[e] for e in local_experts(self.args, l)])
+      if self.args.tp_rank > 0 and f"{prefix}.mlp.gate.weight" in shard_state_dict:
+        shard_state_dict = {key: value for key, value in shard_state_dict.items() if not key.startswith(f"{prefix}.mlp.shared_experts.")}
 
     return shard_state_dict
 
@@ -47,6 +47,7 @@ class LlamaModel(nn.Module):
     self,
     inputs: mx.array,
     cache=None,
+    last_only: bool = False,
   ):
     if self.args.shard.is_first_layer():
       h = self.embed_tokens(inputs)
@@ -64,6 +65,8 @@ class LlamaModel(nn.Module):
       h = layer(h, mask, cache=c)
 
     if self.args.shard.is_last_layer():
+      if last_only:
+        h = h[:, -1:, :]
       h = self.norm(h)
     return h
 
@@ -82,8 +85,9 @@ class Model(nn.Module):
     self,
     inputs: mx.array,
     cache=None,
+    last_only: bool = False,
   ):
-    out = self.model(inputs, cache)
+    out = self.model(inputs, cache, last_only)
     if self.args.shard.is_last_layer():
       if self.args.tie_word_embeddings:
         out = self.model.embed_tokens.as_linear(out)
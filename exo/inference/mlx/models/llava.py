@@ -366,6 +366,7 @@ class Llama(nn.Module):
     inputs: mx.array,
     cache=None,
     inputs_embeds=None,
+    last_only: bool = False,
   ):
     # for passing merged input embeddings
     if inputs_embeds is None:
@@ -388,6 +389,8 @@ class Llama(nn.Module):
       h = layer(h, mask, c)
 
     if self.shard.is_last_layer():
+      if last_only:
+        h = h[:, -1:, :]
       h = self.norm(h)
     return h
 
@@ -408,8 +411,9 @@ class LanguageModel(nn.Module):
     inputs: mx.array,
     cache=None,
     inputs_embeds=None,
+    last_only: bool = False,
   ):
-    out = self.model(inputs, cache, inputs_embeds)
+    out = self.model(inputs, cache, inputs_embeds, last_only)
     if self.shard.is_last_layer():
       out = self.lm_head(out)
     return out
@@ -557,11 +561,11 @@ class Model(nn.Module):
     # (1, num_image_patches*num_images + sequence_len, embed_dim)
     return mx.concatenate(final_embeddings, axis=1)
 
-  def __call__(self, input_ids: mx.array, pixel_values: mx.array = None, cache=None):
+  def __call__(self, input_ids: mx.array, pixel_values: mx.array = None, cache=None, last_only: bool = False):
     input_embddings = None
     if pixel_values is not None:
       input_embddings = self.get_input_embeddings(input_ids, pixel_values)
-    logits = self.language_model(input_ids, cache=cache, inputs_embeds=input_embddings)
+    logits = self.language_model(input_ids, cache=cache, inputs_embeds=input_embddings, last_only=last_only)
     return logits
 
   def sanitize(self, weights):
@@ -46,6 +46,7 @@ class Qwen2Model(nn.Module):
     self,
     inputs: mx.array,
     cache=None,
+    last_only: bool = False,
   ):
     if self.args.shard.is_first_layer():
       h = self.embed_tokens(inputs)
@@ -63,6 +64,8 @@ class Qwen2Model(nn.Module):
       h = layer(h, mask, c)
 
     if self.args.shard.is_last_layer():
+      if last_only:
+        h = h[:, -1:, :]
       h = self.norm(h)
     return h
 
@@ -81,8 +84,9 @@ class Model(nn.Module):
     self,
     inputs: mx.array,
     cache=None,
+    last_only: bool = False,
   ):
-    out = self.model(inputs, cache)
+    out = self.model(inputs, cache, last_only)
     if self.args.shard.is_last_layer():
       if self.args.tie_word_embeddings:
         out = self.model.embed_tokens.as_linear(out)
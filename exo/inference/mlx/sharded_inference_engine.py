@@ -1,9 +1,13 @@
+import json
 import numpy as np
 import mlx.core as mx
 from ..inference_engine import InferenceEngine
 from .sharded_model import StatefulShardedModel
 from .sharded_utils import load_shard, get_image_from_str
 from ..shard import Shard
+from ..tensor_parallel import TensorParallelContext
+from ..expert_parallel import ExpertRoutingStats
+from ..kv_blocks import KVBlockManager
 from typing import Optional
 from exo.download.shard_download import ShardDownloader
 import asyncio
@@ -11,13 +15,35 @@ from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 class MLXDynamicShardInferenceEngine(InferenceEngine):
+  # by splitting the experts of mixture of experts models, see exo/inference/expert_parallel.py
+  supports_tensor_parallel = True
+
   def __init__(self, shard_downloader: ShardDownloader):
     self.shard = None
     self.shard_downloader = shard_downloader
     self.executor = ThreadPoolExecutor(max_workers=1)
+    self.tensor_parallel_key = (0, 1)
+
+  @property
+  def routing_stats(self) -> Optional[ExpertRoutingStats]:
+    return getattr(getattr(self.stateful_sharded_model.model, "model", None), "routing_stats", None) if self.shard else None
+
+  @property
+  def kv_blocks(self) -> Optional[KVBlockManager]:
+    return self.stateful_sharded_model.kv_blocks if self.shard else None
 
-  async def infer_prompt(self, request_id: str, shard: Shard, prompt: str, image_str: Optional[str] = None, inference_state: Optional[str] = None) -> (np.ndarray, str, bool):
-    await self.ensure_shard(shard)
+  def step(self, request_id: str, tensor_parallel: Optional[TensorParallelContext], is_prompt: bool, *args):
+    if tensor_parallel is not None:
+      self.stateful_sharded_model.model.model.all_reduce = partial(tensor_parallel.all_reduce, request_id)
+    output = np.array(self.stateful_sharded_model.step(request_id, *args, is_prompt=is_prompt))
+    # the step's expert routing is evaluated along with its output, so the counts include it when the request ends
+    if self.routing_stats is not None: self.routing_stats.flush()
+    return output
+
+  async def infer_prompt(
+    self, request_id: str, shard: Shard, prompt: str, image_str: Optional[str] = None, inference_state: Optional[str] = None, tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> (np.ndarray, str, bool):
+    await self.ensure_shard(shard, tensor_parallel)
     loop = asyncio.get_running_loop()
     if image_str:
       image = await get_image_from_str(image_str)
@@ -25,26 +51,43 @@ class MLXDynamicShardInferenceEngine(InferenceEngine):
       inputs = await loop.run_in_executor(self.executor, tokenize)
       pixel_values = mx.array(inputs["pixel_values"])
       input_ids = mx.array(inputs["input_ids"])
-      output_data: np.ndarray = np.array(await loop.run_in_executor(self.executor, self.stateful_sharded_model.step, request_id, input_ids, pixel_values))
+      output_data: np.ndarray = np.array(await loop.run_in_executor(self.executor, self.step, request_id, tensor_parallel, True, input_ids, pixel_values))
     else:
       input_ids = mx.array(await loop.run_in_executor(self.executor, self.tokenizer.encode, prompt))
-      output_data: np.ndarray = np.array(await loop.run_in_executor(self.executor, self.stateful_sharded_model.step, request_id, input_ids))
-    return output_data, "", output_data.size == 1 and output_data.item() == self.tokenizer.eos_token_id
+      output_data: np.ndarray = np.array(await loop.run_in_executor(self.executor, self.step, request_id, tensor_parallel, True, input_ids))
+    # later shards start the request's cache only on the prompt's hidden states
+    inference_state = json.dumps({"n_captured_toks": input_ids.shape[-1]})
+    return output_data, inference_state, output_data.size == 1 and output_data.item() == self.tokenizer.eos_token_id
+
+  async def infer_tensor(
+    self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[str] = None, tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> (np.ndarray, str, bool):
+    await self.ensure_shard(shard, tensor_parallel)
+    # sampled tokens reach the first shard, hidden states of the prompt say so in the state
+    is_prompt = not shard.is_first_layer() and json.loads(inference_state or "{}").get("n_captured_toks", 0) > 0
+    output_data: np.ndarray = np.array(await asyncio.get_running_loop().run_in_executor(self.executor, self.step, request_id, tensor_parallel, is_prompt, mx.array(input_data)))
+    inference_state = json.dumps({"n_captured_toks": input_data.shape[1] if is_prompt else 0})
+    return output_data, inference_state, output_data.size == 1 and output_data.item() == self.tokenizer.eos_token_id
 
-  async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[str] = None) -> (np.ndarray, str, bool):
-    await self.ensure_shard(shard)
-    output_data: np.ndarray = np.array(await asyncio.get_running_loop().run_in_executor(self.executor, self.stateful_sharded_model.step, request_id, mx.array(input_data)))
-    return output_data, "", output_data.size == 1 and output_data.item() == self.tokenizer.eos_token_id
+  async def finish_request(self, request_id: str) -> None:
+    if self.shard: self.stateful_sharded_model.evict(request_id)
 
-  async def ensure_shard(self, shard: Shard):
-    if self.shard == shard:
+  async def ensure_shard(self, shard: Shard, tensor_parallel: Optional[TensorParallelContext] = None):
+    tensor_parallel_key = tensor_parallel.key() if tensor_parallel else (0, 1)
+    if self.shard == shard and self.tensor_parallel_key == tensor_parallel_key:
       return
 
     model_path = await self.shard_downloader.ensure_shard(shard)
 
-    if self.shard != shard:
+    if self.shard != shard or self.tensor_parallel_key != tensor_parallel_key:
+      model_config = {}
+      if tensor_parallel is not None:
+        model_config = {"tp_rank": tensor_parallel.rank, "tp_size": tensor_parallel.world_size, "expert_placement": tensor_parallel.expert_placement.get(shard.model_id)}
       loop = asyncio.get_running_loop()
-      def load_shard_wrapper(): return asyncio.run(load_shard(model_path, shard))
+      def load_shard_wrapper(): return asyncio.run(load_shard(model_path, shard, model_config=model_config))
       model_shard, self.tokenizer = await loop.run_in_executor(self.executor, load_shard_wrapper)
+      if tensor_parallel is not None and not getattr(model_shard, "supports_expert_parallel", False):
+        raise ValueError(f"{model_shard.model_type} models can't be split across nodes with MLX, only mixture of experts models can")
       self.stateful_sharded_model = await loop.run_in_executor(self.executor, StatefulShardedModel, shard, model_shard)
       self.shard = shard
+      self.tensor_parallel_key = tensor_parallel_key
@@ -1,4 +1,4 @@
-from typing import Dict, Generator, Optional, Tuple
+from typing import Dict, Generator, List, Optional, Tuple
 from collections import OrderedDict
 
 import mlx.core as mx
@@ -7,15 +7,18 @@ from mlx_lm.models.base import KVCache, RotatingKVCache
 from mlx_lm.sample_utils import top_p_sampling
 
 from ..shard import Shard
+from ..kv_blocks import KVBlockManager, KVCacheFullError
 
 # TODO: support a speculative model so we can parallelise compute across devices
 class StatefulShardedModel:
-  def __init__(self, shard: Shard, model: nn.Module, max_kv_size: int = 1024, max_caches: int = 2):
+  def __init__(self, shard: Shard, model: nn.Module, max_kv_size: int = 1024, max_caches: Optional[int] = None, kv_cache_budget: Optional[int] = None):
     self.shard = shard
     self.model = model
     self.max_kv_size = max_kv_size
+    # as many request caches as the kv cache budget holds, unless max_caches is set
     self.max_caches = max_caches
     self.caches = OrderedDict()
+    self.kv_blocks = KVBlockManager.from_budget(self.kv_bytes_per_token(), kv_cache_budget)
 
   def step(
     self,
@@ -25,6 +28,7 @@ class StatefulShardedModel:
     temp: float = 0.0,
     top_p: float = 1.0,
     logit_bias: Optional[Dict[int, float]] = None,
+    is_prompt: bool = True,
   ) -> Generator[Tuple[mx.array, mx.array], None, None]:
     def sample(logits: mx.array) -> Tuple[mx.array, float]:
       if logit_bias:
@@ -44,17 +48,28 @@ class StatefulShardedModel:
 
     y = x
 
-    if request_id not in self.caches:
+    if request_id in self.caches:
+      self.caches.move_to_end(request_id)
+    elif is_prompt:
       self.init_cache(request_id)
     else:
-      self.caches.move_to_end(request_id)
+      # a fresh cache would carry on from nothing and make up the rest of the request
+      raise ValueError(f"No kv cache for request {request_id}, it was evicted or started on another shard")
 
     cache = self.caches[request_id]
+    # rotating caches stop growing at max_kv_size
+    n_tokens = (y.shape[-1] if self.shard.is_first_layer() else y.shape[1]) + self.cache_length(cache)
+    try:
+      self.kv_blocks.reserve(request_id, min(n_tokens, self.max_kv_size or n_tokens), self.evict)
+    except KVCacheFullError:
+      if self.cache_length(cache) == 0: self.evict(request_id)
+      raise
 
+    # the last shard only projects the position it samples onto the vocabulary
     if pixel_values is None:
-      output = self.model(y[None] if self.shard.is_first_layer() else y, cache=cache)
+      output = self.model(y[None] if self.shard.is_first_layer() else y, cache=cache, last_only=True)
     else:
-      output = self.model(y, pixel_values=pixel_values, cache=cache)
+      output = self.model(y, pixel_values=pixel_values, cache=cache, last_only=True)
 
     if self.shard.is_last_layer():
       logits = output[:, -1, :]
@@ -73,14 +88,30 @@ class StatefulShardedModel:
   ) -> Generator[Tuple[mx.array, mx.array], None, None]:
     return self.step(request_id, x, temp=temp, top_p=top_p, logit_bias=logit_bias)
 
+  def kv_heads(self) -> List[int]:
+    return [self.model.n_kv_heads]*len(self.model.layers) if isinstance(self.model.n_kv_heads, int) else self.model.n_kv_heads
+
+  def kv_bytes_per_token(self) -> int:
+    # keys and values of the shard's layers, in float16. DeepSeek-V2's head_dim is (key width, value width)
+    k_dim, v_dim = self.model.head_dim if isinstance(self.model.head_dim, tuple) else (self.model.head_dim, self.model.head_dim)
+    return sum(self.kv_heads()[self.shard.start_layer:self.shard.end_layer + 1])*(k_dim + v_dim)*2
+
+  def cache_length(self, cache) -> int:
+    # only the shard's layers see tokens
+    return max((c.offset for c in cache), default=0)
+
+  def evict(self, request_id: str) -> None:
+    self.caches.pop(request_id, None)
+    self.kv_blocks.free(request_id)
+
   def init_cache(self, request_id: str):
-    kv_heads = ([self.model.n_kv_heads]*len(self.model.layers) if isinstance(self.model.n_kv_heads, int) else self.model.n_kv_heads)
+    kv_heads = self.kv_heads()
     if self.max_kv_size is not None:
       cache = [RotatingKVCache(self.model.head_dim, n, max_size=self.max_kv_size, keep=4) for n in kv_heads]
     else:
       cache = [KVCache(self.model.head_dim, n) for n in kv_heads]
 
-    if len(self.caches) >= self.max_caches:
-      self.caches.popitem(last=False)
+    while self.max_caches is not None and len(self.caches) >= self.max_caches:
+      self.evict(next(iter(self.caches)))
 
     self.caches[request_id] = cache
@@ -0,0 +1,62 @@
+import threading
+import numpy as np
+import mlx.core as mx
+from mlx.utils import tree_flatten
+from exo.inference.mlx.models.deepseek_v2 import Model, ModelArgs
+from exo.inference.mlx.sharded_model import StatefulShardedModel
+from exo.inference.shard import Shard
+from exo.inference.tensor_parallel import local_all_reduce
+
+N_EXPERTS = 8
+config = dict(
+  vocab_size=64, hidden_size=32, intermediate_size=64, moe_intermediate_size=16, num_hidden_layers=3, num_attention_heads=4, num_key_value_heads=4,
+  n_shared_experts=1, n_routed_experts=N_EXPERTS, kv_lora_rank=8, q_lora_rank=16, qk_rope_head_dim=8, v_head_dim=8, qk_nope_head_dim=8,
+  num_experts_per_tok=2, first_k_dense_replace=1, rope_scaling={"factor": 1.0}, shard=Shard("deepseek", 0, 2, 4),
+)
+
+mx.random.seed(0)
+full = Model(ModelArgs(**config))
+for layer in full.model.layers[1:]:
+  layer.mlp.gate.weight = mx.random.normal(layer.mlp.gate.weight.shape)
+mx.eval(full.parameters())
+# unstack the experts again, the way they are stored on disk
+weights = {}
+for key, value in tree_flatten(full.parameters()):
+  if ".switch_mlp." in key:
+    weights.update({key.replace("switch_mlp", f"experts.{e}"): value[e] for e in range(N_EXPERTS)})
+  else:
+    weights[key] = value
+
+x = mx.array([[1, 5, 9, 3, 7]])
+expected = np.array(full(x))
+
+placement = {"1": [[0, 3, 5, 6], [1, 2, 4, 7]]}  # layer 2 is split contiguously
+for_rank = local_all_reduce(2)
+outputs = {}
+
+
+def run(rank: int):
+  model = Model(ModelArgs(**config, tp_rank=rank, tp_size=2, expert_placement=placement))
+  model.load_weights(list(model.sanitize(dict(weights)).items()), strict=True)
+  assert model.model.layers[1].mlp.switch_mlp.gate_proj.weight.shape[0] == N_EXPERTS // 2
+  assert ("shared_experts" in model.model.layers[1].mlp) == (rank == 0)
+  model.model.all_reduce = lambda partial: for_rank(rank)("request", partial)
+  outputs[rank] = np.array(model(x))
+
+
+threads = [threading.Thread(target=run, args=(rank,)) for rank in range(2)]
+for thread in threads: thread.start()
+for thread in threads: thread.join()
+for rank in range(2):
+  np.testing.assert_allclose(outputs[rank], expected, rtol=1e-4, atol=1e-5)
+
+full.model.routing_stats.flush()
+routing = full.model.routing_stats.to_dict()
+assert set(routing) == {"1", "2"}
+assert all(sum(counts) == x.size*config["num_experts_per_tok"] for counts in routing.values())
+print("expert parallel ranks match the full model", routing)
+
+# keys are qk_nope_head_dim + qk_rope_head_dim wide and values v_head_dim, for 4 heads in each of the shard's 3 layers
+sharded = StatefulShardedModel(config["shard"], full, kv_cache_budget=2**20)
+assert sharded.kv_bytes_per_token() == 3*4*(16 + 8)*2, sharded.kv_bytes_per_token()
+print("kv cache of a deepseek shard takes", sharded.kv_bytes_per_token(), "bytes per token")
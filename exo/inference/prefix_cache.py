@@ -0,0 +1,100 @@
+import itertools
+from typing import Callable, Dict, Generic, List, Optional, Sequence, Tuple, TypeVar
+from exo.helpers import DEBUG
+
+# Keys and values an engine computed for earlier requests, kept in a radix tree over their tokens so a request that
+# starts with the same tokens, like the next turn of a chat, only runs the tokens after the shared prefix. Each edge
+# holds a run of tokens and the engine's kv cache for those positions, in whatever form the engine keeps it.
+V = TypeVar("V")
+
+
+class RadixNode(Generic[V]):
+  def __init__(self, tokens: Tuple[int, ...] = (), value: Optional[V] = None, parent: Optional["RadixNode[V]"] = None):
+    self.tokens = tokens
+    self.value = value
+    self.parent = parent
+    self.children: Dict[int, "RadixNode[V]"] = {}
+    self.depth = (parent.depth if parent else 0) + len(tokens)
+    # requests using the prefix ending here, or further down, keep it from being evicted
+    self.ref_count = 0
+    self.last_access = 0
+
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+  n = 0
+  for x, y in zip(a, b):
+    if x != y: break
+    n += 1
+  return n
+
+
+class RadixCache(Generic[V]):
+  def __init__(self, max_tokens: int, slice_value: Callable[[V, int, int], V]):
+    """slice_value(value, start, end) cuts the positions start:end out of an edge's value."""
+    self.max_tokens = max_tokens
+    self.slice_value = slice_value
+    self.root: RadixNode[V] = RadixNode()
+    self.n_tokens = 0
+    self.clock = itertools.count(1)
+
+  def match(self, tokens: Sequence[int]) -> Tuple[RadixNode[V], List[V]]:
+    """The node the longest cached prefix of tokens ends at, which is node.depth tokens long, and the values along it."""
+    node, values, now = self.root, [], next(self.clock)
+    while node.depth < len(tokens) and (child := node.children.get(tokens[node.depth])) is not None:
+      n = common_prefix_length(child.tokens, tokens[node.depth:])
+      if n < len(child.tokens): child = self.split(child, n)
+      child.last_access = now
+      values.append(child.value)
+      node = child
+    return node, values
+
+  def insert(self, tokens: Sequence[int], value_of: Callable[[int, int], V]) -> RadixNode[V]:
+    """Adds tokens, taking the values of positions not cached yet from value_of(start, end). Returns the node they end at."""
+    if self.max_tokens <= 0: return self.root
+    node, _ = self.match(tokens)
+    if node.depth < len(tokens):
+      leaf = RadixNode(tuple(tokens[node.depth:]), value_of(node.depth, len(tokens)), node)
+      leaf.last_access = next(self.clock)
+      node.children[leaf.tokens[0]] = leaf
+      self.n_tokens += len(leaf.tokens)
+      node = leaf
+    self.evict()
+    return node
+
+  def split(self, node: RadixNode[V], n: int) -> RadixNode[V]:
+    # node's edge becomes its first n tokens in a new parent and the rest in node
+    parent = RadixNode(node.tokens[:n], self.slice_value(node.value, 0, n), node.parent)
+    parent.ref_count, parent.last_access = node.ref_count, node.last_access
+    node.parent.children[parent.tokens[0]] = parent
+    node.value = self.slice_value(node.value, n, len(node.tokens))
+    node.tokens, node.parent = node.tokens[n:], parent
+    parent.children[node.tokens[0]] = node
+    return parent
+
+  def lock(self, node: RadixNode[V]) -> None:
+    while node is not self.root:
+      node.ref_count += 1
+      node = node.parent
+
+  def unlock(self, node: RadixNode[V]) -> None:
+    while node is not self.root:
+      node.ref_count -= 1
+      node = node.parent
+
+  def evict(self) -> None:
+    # least recently used leaves nothing refers to go first, their parents can become leaves in turn
+    while self.n_tokens > self.max_tokens:
+      leaves = [node for node in self.nodes() if not node.children and node.ref_count == 0]
+      if not leaves: return
+      leaf = min(leaves, key=lambda node: node.last_access)
+      del leaf.parent.children[leaf.tokens[0]]
+      self.n_tokens -= len(leaf.tokens)
+      if DEBUG >= 3: print(f"Evicted {len(leaf.tokens)} cached prefix tokens at depth {leaf.depth}")
+
+  def nodes(self) -> List[RadixNode[V]]:
+    nodes, stack = [], list(self.root.children.values())
+    while stack:
+      node = stack.pop()
+      nodes.append(node)
+      stack.extend(node.children.values())
+    return nodes
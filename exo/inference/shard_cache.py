@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import re
+import struct
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+from exo.inference.shard import Shard
+from exo.helpers import get_exo_home, DEBUG
+
+# Engine ready weights of a shard, saved the first time the shard is loaded so later starts skip converting them.
+# Entries are safetensors files, which every engine can memory map, named by a hash of everything that changes the
+# converted weights. The same hash is stored in the file's metadata and checked before an entry is used, so an entry
+# for different source weights or a file that doesn't belong there is rebuilt rather than loaded.
+SHARD_CACHE = os.getenv("SHARD_CACHE", "1") != "0"
+KEEP_ENTRIES = 2  # per model and engine, least recently used are removed first
+WEIGHT_SUFFIXES = (".safetensors", ".pth", ".bin")
+
+
+def get_shard_cache_dir() -> Path:
+  return get_exo_home()/"shard_cache"
+
+
+def source_fingerprint(model_path: Path) -> Dict[str, list]:
+  # the snapshot directory of a huggingface download is named after the commit, the files pin down everything else
+  files = [model_path] if model_path.is_file() else sorted(p for p in model_path.iterdir() if p.name.endswith(WEIGHT_SUFFIXES))
+  return {"revision": [model_path.resolve().name], "files": [[p.name, p.stat().st_size, p.stat().st_mtime_ns] for p in files]}
+
+
+def shard_cache_key(model_path: Path, shard: Shard, engine: str, dtype: str, tensor_parallel: Tuple[int, int] = (0, 1)) -> str:
+  key = {"model_id": shard.model_id, "shard": shard.to_dict(), "engine": engine, "dtype": dtype, "tensor_parallel": list(tensor_parallel), **source_fingerprint(model_path)}
+  return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def shard_cache_path(model_id: str, engine: str, key: str) -> Path:
+  name = "--".join(re.sub(r"[^A-Za-z0-9._-]+", "_", part) for part in (model_id, engine, key[:16]))
+  return get_shard_cache_dir()/f"{name}.safetensors"
+
+
+def read_metadata(path: Path) -> Dict[str, str]:
+  with open(path, "rb") as f:
+    header_size = struct.unpack("<Q", f.read(8))[0]
+    return json.loads(f.read(header_size)).get("__metadata__", {})
+
+
+def find_cached_shard(model_id: str, engine: str, key: str) -> Optional[Path]:
+  if not SHARD_CACHE: return None
+  path = shard_cache_path(model_id, engine, key)
+  try:
+    if not path.exists() or read_metadata(path).get("exo_shard_cache") != key:
+      return None
+  except Exception as e:
+    if DEBUG >= 1: print(f"Ignoring unreadable shard cache {path}: {e}")
+    return None
+  os.utime(path)
+  return path
+
+
+def save_cached_shard(model_id: str, engine: str, key: str, save: Callable[[str, Dict[str, str]], None]) -> Optional[Path]:
+  """Writes an entry with save(filename, metadata) using the engine's own safetensors writer."""
+  if not SHARD_CACHE: return None
+  path = shard_cache_path(model_id, engine, key)
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp_path = path.with_suffix(".tmp")
+  try:
+    save(str(tmp_path), {"exo_shard_cache": key})
+    tmp_path.replace(path)
+  except Exception as e:
+    if DEBUG >= 1: print(f"Couldn't save shard cache {path}: {e}")
+    tmp_path.unlink(missing_ok=True)
+    return None
+  prune(path)
+  return path
+
+
+def prune(path: Path) -> None:
+  prefix = path.name.rsplit("--", 1)[0]
+  entries = sorted(path.parent.glob(f"{prefix}--*.safetensors"), key=lambda p: p.stat().st_mtime, reverse=True)
+  for stale in [p for p in entries if p != path][KEEP_ENTRIES - 1:]:
+    if DEBUG >= 2: print(f"Removing shard cache {stale}")
+    stale.unlink(missing_ok=True)
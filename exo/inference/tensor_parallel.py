@@ -0,0 +1,78 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+import numpy as np
+from .expert_parallel import Placement
+
+T = TypeVar("T")
+
+# Megatron style tensor parallelism for llama layers. Every rank holds a slice of each layer: its share of the attention
+# heads (rows of q/k/v, columns of o) and of the MLP hidden units (rows of gate/up, columns of down). The attention
+# and MLP outputs are then partial sums, which an all-reduce over the group turns into the full output on every rank.
+# Norms, embeddings and the lm head stay replicated.
+COLUMN_PARALLEL = ("q_proj.weight", "k_proj.weight", "v_proj.weight", "gate_proj.weight", "up_proj.weight")
+ROW_PARALLEL = ("o_proj.weight", "down_proj.weight")
+
+
+@dataclass(frozen=True)
+class TensorParallelContext:
+  rank: int
+  world_size: int
+  # (request_id, this rank's partial sum) -> the sum over all ranks, identical on every rank
+  all_reduce: Callable[[str, np.ndarray], np.ndarray]
+  # model id -> which experts each rank holds, for mixture of experts models split by expert rather than by head
+  expert_placement: Dict[str, Placement] = field(default_factory=dict)
+
+  def key(self) -> Tuple[int, int]:
+    return (self.rank, self.world_size)
+
+
+def check_tensor_parallel(n_heads: int, n_kv_heads: int, hidden_dim: int, world_size: int) -> None:
+  for name, value in [("attention heads", n_heads), ("kv heads", n_kv_heads), ("MLP hidden units", hidden_dim)]:
+    if value % world_size != 0:
+      raise ValueError(f"Can't split {value} {name} across {world_size} tensor parallel ranks")
+
+
+def split_range(size: int, rank: int, world_size: int) -> Tuple[int, int]:
+  return (size//world_size*rank, size//world_size*(rank + 1))
+
+
+def shard_weights(weights: Dict[str, T], rank: int, world_size: int) -> Dict[str, T]:
+  """Slices huggingface llama weights (numpy, torch or tinygrad tensors) down to what one rank holds."""
+  if world_size == 1:
+    return weights
+  sharded = {}
+  for name, weight in weights.items():
+    if name.endswith(COLUMN_PARALLEL):
+      start, end = split_range(weight.shape[0], rank, world_size)
+      weight = weight[start:end]
+    elif name.endswith(ROW_PARALLEL):
+      start, end = split_range(weight.shape[1], rank, world_size)
+      weight = weight[:, start:end]
+    sharded[name] = weight
+  return sharded
+
+
+def local_all_reduce(world_size: int, timeout: Optional[float] = 60.0) -> Callable[[int], Callable[[str, np.ndarray], np.ndarray]]:
+  """In-process all-reduce for ranks running on threads of one machine; returns a factory of per-rank functions."""
+  import threading
+  barrier = threading.Barrier(world_size, timeout=timeout)
+  parts: Dict[int, np.ndarray] = {}
+
+  def for_rank(rank: int) -> Callable[[str, np.ndarray], np.ndarray]:
+    def all_reduce(request_id: str, partial: np.ndarray) -> np.ndarray:
+      parts[rank] = partial
+      barrier.wait()
+      result = sum_partials([parts[r] for r in range(world_size)])
+      barrier.wait()
+      return result
+    return all_reduce
+
+  return for_rank
+
+
+def sum_partials(partials) -> np.ndarray:
+  # always summed in rank order and in float32, so every rank gets bit-identical results and stays in lockstep
+  result = partials[0].astype(np.float32)
+  for partial in partials[1:]:
+    result = result + partial.astype(np.float32)
+  return result.astype(partials[0].dtype)
@@ -0,0 +1,38 @@
+import unittest
+import numpy as np
+from exo.inference.expert_parallel import ExpertRoutingStats, balance_experts, contiguous_placement, suggest_placement
+
+
+class TestExpertParallel(unittest.TestCase):
+  def test_contiguous_placement(self):
+    self.assertEqual(contiguous_placement(8, 2), [[0, 1, 2, 3], [4, 5, 6, 7]])
+    with self.assertRaises(ValueError):
+      contiguous_placement(8, 3)
+
+  def test_balance_experts_spreads_hot_experts(self):
+    # experts 0-3 get nearly all tokens, a contiguous split would put them all on rank 0
+    load = [100, 90, 80, 70, 1, 1, 1, 1]
+    placement = balance_experts(load, 2)
+    self.assertEqual(sorted(sum(placement, [])), list(range(8)))
+    self.assertEqual([len(experts) for experts in placement], [4, 4])
+    totals = [sum(load[e] for e in experts) for experts in placement]
+    self.assertLessEqual(max(totals) - min(totals), 20)
+    self.assertEqual(balance_experts(load, 2), placement)
+
+  def test_suggest_placement_per_layer(self):
+    placement = suggest_placement({"1": [0, 0, 5, 5], "2": [5, 5, 0, 0]}, 2)
+    self.assertEqual(placement, {"1": [[0, 2], [1, 3]], "2": [[0, 2], [1, 3]]})
+
+  def test_routing_stats(self):
+    stats = ExpertRoutingStats(4)
+    stats.record(1, np.array([[[0, 2], [2, 3]]]))
+    stats.record(2, np.array([[[1, 1]]]))
+    self.assertEqual(stats.counts, {})
+    stats.flush()
+    stats.record(1, np.array([[[3, 0]]]))
+    stats.flush()
+    self.assertEqual(stats.to_dict(), {"1": [2, 0, 2, 2], "2": [0, 2, 0, 0]})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from exo.inference.kv_blocks import KVBlockManager, KVCacheFullError
+
+
+class TestKVBlockManager(unittest.TestCase):
+  def test_page_tables_grow_a_block_at_a_time(self):
+    blocks = KVBlockManager(4, block_size=16)
+    self.assertEqual(blocks.allocate("a", 1), [0])
+    self.assertEqual(blocks.allocate("a", 16), [0])
+    self.assertEqual(blocks.allocate("b", 20), [1, 2])
+    self.assertEqual(blocks.allocate("a", 17), [0, 3])
+    self.assertEqual(blocks.to_dict(), {"block_size": 16, "total_blocks": 4, "used_blocks": 4, "set_aside_blocks": 0, "requests": 2, "bytes_per_token": 0})
+
+  def test_freed_blocks_are_reused(self):
+    blocks = KVBlockManager(4, block_size=16)
+    blocks.allocate("a", 32)
+    blocks.allocate("b", 32)
+    self.assertFalse(blocks.can_allocate("c", 1))
+    with self.assertRaises(ValueError):
+      blocks.allocate("c", 1)
+    blocks.free("a")
+    self.assertEqual(blocks.allocate("c", 32), [0, 1])
+    self.assertEqual(list(blocks.page_tables), ["b", "c"])
+
+  def test_reserve_evicts_only_idle_requests(self):
+    now = [0.0]
+    blocks, evicted = KVBlockManager(3, block_size=16, idle_timeout=10, clock=lambda: now[0]), []
+    for request_id in ("a", "b", "c"):
+      blocks.reserve(request_id, 16, evicted.append)
+    # every request is still running, so a new one is turned away
+    with self.assertRaises(KVCacheFullError):
+      blocks.reserve("d", 16, evicted.append)
+    self.assertEqual((evicted, list(blocks.page_tables)), ([], ["a", "b", "c"]))
+    now[0] = 5
+    blocks.reserve("a", 16, evicted.append)
+    now[0] = 12
+    blocks.reserve("d", 32, evicted.append)
+    self.assertEqual(evicted, ["b", "c"])
+    self.assertEqual(list(blocks.page_tables), ["a", "d"])
+    with self.assertRaises(KVCacheFullError):
+      blocks.reserve("e", 16, evicted.append)
+
+  def test_set_aside_blocks_are_never_evicted(self):
+    now = [0.0]
+    blocks, evicted = KVBlockManager(3, block_size=16, idle_timeout=10, clock=lambda: now[0]), []
+    blocks.set_aside("prefix_cache", 20)
+    blocks.reserve("a", 16, evicted.append)
+    now[0] = 60
+    with self.assertRaises(KVCacheFullError):
+      blocks.reserve("b", 32, evicted.append)
+    self.assertEqual(evicted, ["a"])
+    self.assertEqual(blocks.to_dict()["set_aside_blocks"], 2)
+    self.assertEqual(blocks.to_dict()["requests"], 0)
+
+  def test_from_budget(self):
+    blocks = KVBlockManager.from_budget(bytes_per_token=1024, budget=10*16*1024 + 100, block_size=16)
+    self.assertEqual((blocks.n_blocks, blocks.bytes_per_token), (10, 1024))
+
+
+if __name__ == "__main__":
+  unittest.main()
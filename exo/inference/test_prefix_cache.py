@@ -0,0 +1,85 @@
+import unittest
+from exo.inference.prefix_cache import RadixCache
+
+
+def positions(start: int, end: int):
+  # stands in for an engine's kv cache: the positions it holds
+  return list(range(start, end))
+
+
+def slice_positions(value, start: int, end: int):
+  return value[start:end]
+
+
+def flatten(values):
+  return [position for value in values for position in value]
+
+
+class TestRadixCache(unittest.TestCase):
+  def test_longest_prefix(self):
+    cache = RadixCache(100, slice_positions)
+    cache.insert([1, 2, 3, 4], positions)
+    cache.insert([1, 2, 5], positions)
+    node, values = cache.match([1, 2, 3, 9])
+    self.assertEqual(node.depth, 3)
+    self.assertEqual(flatten(values), [0, 1, 2])
+    node, values = cache.match([1, 2, 5, 6])
+    self.assertEqual(node.depth, 3)
+    self.assertEqual(flatten(values), [0, 1, 2])
+    self.assertEqual(cache.match([7, 1])[0].depth, 0)
+    # shared tokens are stored once
+    self.assertEqual(cache.n_tokens, 5)
+
+  def test_partial_edge_is_split(self):
+    cache = RadixCache(100, slice_positions)
+    cache.insert([1, 2, 3, 4, 5], positions)
+    node, _ = cache.match([1, 2, 3])
+    self.assertEqual((node.tokens, node.depth, node.value), ((1, 2, 3), 3, [0, 1, 2]))
+    child, = node.children.values()
+    self.assertEqual((child.tokens, child.depth, child.value), ((4, 5), 5, [3, 4]))
+    self.assertEqual(flatten(cache.match([1, 2, 3, 4, 5])[1]), [0, 1, 2, 3, 4])
+
+  def test_insert_only_adds_new_positions(self):
+    cache = RadixCache(100, slice_positions)
+    cache.insert([1, 2], positions)
+    calls = []
+    cache.insert([1, 2, 3, 4], lambda start, end: calls.append((start, end)) or positions(start, end))
+    self.assertEqual(calls, [(2, 4)])
+    self.assertEqual(cache.n_tokens, 4)
+
+  def test_least_recently_used_leaves_are_evicted(self):
+    cache = RadixCache(6, slice_positions)
+    cache.insert([1, 2, 3], positions)
+    cache.insert([4, 5, 6], positions)
+    cache.match([1, 2, 3])
+    cache.insert([7, 8], positions)
+    self.assertEqual(cache.match([4, 5, 6])[0].depth, 0)
+    self.assertEqual(cache.match([1, 2, 3])[0].depth, 3)
+    self.assertEqual(cache.n_tokens, 5)
+    # only the part of a prefix that was used counts as used
+    cache.match([7, 8])
+    cache.match([1])
+    cache.insert([9, 10], positions)
+    self.assertEqual(cache.match([1, 2, 3])[0].depth, 1)
+
+  def test_locked_prefixes_are_kept(self):
+    cache = RadixCache(4, slice_positions)
+    node = cache.insert([1, 2, 3], positions)
+    cache.lock(node)
+    cache.insert([4, 5, 6], positions)
+    self.assertEqual(cache.match([1, 2, 3])[0].depth, 3)
+    self.assertEqual(cache.match([4, 5, 6])[0].depth, 0)
+    # a split keeps the lock on both halves
+    cache.match([1, 2])
+    cache.unlock(node)
+    cache.insert([7, 8, 9], positions)
+    self.assertEqual(cache.match([1, 2, 3])[0].depth, 0)
+
+  def test_disabled(self):
+    cache = RadixCache(0, slice_positions)
+    cache.insert([1, 2, 3], positions)
+    self.assertEqual((cache.match([1, 2, 3])[0].depth, cache.n_tokens), (0, 0))
+
+
+if __name__ == "__main__":
+  unittest.main()
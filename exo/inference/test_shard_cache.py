@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+import numpy as np
+from safetensors.numpy import save_file, load_file
+from exo.inference.shard import Shard
+from exo.inference import shard_cache
+from exo.inference.shard_cache import shard_cache_key, find_cached_shard, save_cached_shard
+
+
+class TestShardCache(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.model_path = Path(self.dir.name)/"snapshots"/"abc123"
+    self.model_path.mkdir(parents=True)
+    (self.model_path/"model.safetensors").write_bytes(b"weights")
+    patcher = mock.patch.dict(os.environ, {"EXO_HOME": str(Path(self.dir.name)/"exo")})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.addCleanup(self.dir.cleanup)
+
+  def save(self, shard: Shard, weights=None):
+    key = shard_cache_key(self.model_path, shard, "tinygrad", "float16")
+    return key, save_cached_shard(shard.model_id, "tinygrad", key, lambda fn, metadata: save_file(weights or {"w": np.ones(2, dtype=np.float16)}, fn, metadata))
+
+  def test_round_trip(self):
+    shard = Shard("model", 0, 3, 8)
+    self.assertIsNone(find_cached_shard("model", "tinygrad", shard_cache_key(self.model_path, shard, "tinygrad", "float16")))
+    key, path = self.save(shard, {"w": np.arange(3, dtype=np.float16)})
+    self.assertEqual(find_cached_shard("model", "tinygrad", key), path)
+    np.testing.assert_array_equal(load_file(str(path))["w"], np.arange(3, dtype=np.float16))
+
+  def test_key_covers_shard_dtype_and_source(self):
+    shard = Shard("model", 0, 3, 8)
+    key = shard_cache_key(self.model_path, shard, "tinygrad", "float16")
+    self.assertNotEqual(key, shard_cache_key(self.model_path, Shard("model", 4, 7, 8), "tinygrad", "float16"))
+    self.assertNotEqual(key, shard_cache_key(self.model_path, shard, "tinygrad", "float32"))
+    self.assertNotEqual(key, shard_cache_key(self.model_path, shard, "tinygrad", "float16", (1, 2)))
+    (self.model_path/"model.safetensors").write_bytes(b"new weights")
+    self.assertNotEqual(key, shard_cache_key(self.model_path, shard, "tinygrad", "float16"))
+
+  def test_entry_with_other_hash_is_ignored(self):
+    key, path = self.save(Shard("model", 0, 3, 8))
+    save_file({"w": np.ones(2, dtype=np.float16)}, str(path), {"exo_shard_cache": "something else"})
+    self.assertIsNone(find_cached_shard("model", "tinygrad", key))
+    path.write_bytes(b"truncated")
+    self.assertIsNone(find_cached_shard("model", "tinygrad", key))
+
+  def test_least_recently_used_entries_are_pruned(self):
+    paths = []
+    for i in range(shard_cache.KEEP_ENTRIES + 1):
+      paths.append(self.save(Shard("model", i, i, 8))[1])
+      os.utime(paths[-1], (i, i))
+    self.save(Shard("other", 0, 0, 8))
+    self.assertEqual(sorted(p.name for p in paths[0].parent.glob("model--*")), sorted(p.name for p in paths[-shard_cache.KEEP_ENTRIES:]))
+    self.assertEqual(len(list(paths[0].parent.glob("other--*"))), 1)
+
+  def test_disabled(self):
+    with mock.patch.object(shard_cache, "SHARD_CACHE", False):
+      key, path = self.save(Shard("model", 0, 3, 8))
+      self.assertIsNone(path)
+      self.assertIsNone(find_cached_shard("model", "tinygrad", key))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,120 @@
+import copy
+import threading
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from exo.inference.shard import Shard
+from exo.inference.tensor_parallel import check_tensor_parallel, local_all_reduce, shard_weights
+
+DIM, HIDDEN_DIM, N_HEADS, N_KV_HEADS, N_LAYERS, VOCAB_SIZE = 64, 128, 4, 2, 2, 32
+
+
+def hf_weights(seed: int = 0):
+  rng = np.random.default_rng(seed)
+  head_dim = DIM // N_HEADS
+  shapes = {"model.embed_tokens.weight": (VOCAB_SIZE, DIM), "model.norm.weight": (DIM,), "lm_head.weight": (VOCAB_SIZE, DIM)}
+  for l in range(N_LAYERS):
+    shapes.update({
+      f"model.layers.{l}.input_layernorm.weight": (DIM,),
+      f"model.layers.{l}.post_attention_layernorm.weight": (DIM,),
+      f"model.layers.{l}.self_attn.q_proj.weight": (N_HEADS*head_dim, DIM),
+      f"model.layers.{l}.self_attn.k_proj.weight": (N_KV_HEADS*head_dim, DIM),
+      f"model.layers.{l}.self_attn.v_proj.weight": (N_KV_HEADS*head_dim, DIM),
+      f"model.layers.{l}.self_attn.o_proj.weight": (DIM, N_HEADS*head_dim),
+      f"model.layers.{l}.mlp.gate_proj.weight": (HIDDEN_DIM, DIM),
+      f"model.layers.{l}.mlp.up_proj.weight": (HIDDEN_DIM, DIM),
+      f"model.layers.{l}.mlp.down_proj.weight": (DIM, HIDDEN_DIM),
+    })
+  return {name: (rng.standard_normal(shape)*0.1 + (1.0 if name.endswith("norm.weight") else 0.0)).astype(np.float32) for name, shape in shapes.items()}
+
+
+def run_ranks(world_size: int, run):
+  for_rank = local_all_reduce(world_size)
+  with ThreadPoolExecutor(world_size) as pool:
+    return list(pool.map(lambda rank: run(rank, for_rank(rank)), range(world_size)))
+
+
+class TestTensorParallel(unittest.TestCase):
+  def test_shard_weights(self):
+    weights = hf_weights()
+    sharded = [shard_weights(weights, rank, 2) for rank in range(2)]
+    self.assertEqual(sharded[0]["model.layers.0.self_attn.q_proj.weight"].shape, (DIM//2, DIM))
+    self.assertEqual(sharded[1]["model.layers.0.self_attn.o_proj.weight"].shape, (DIM, DIM//2))
+    self.assertEqual(sharded[1]["model.layers.1.mlp.down_proj.weight"].shape, (DIM, HIDDEN_DIM//2))
+    self.assertIs(sharded[1]["model.embed_tokens.weight"], weights["model.embed_tokens.weight"])
+    np.testing.assert_array_equal(
+      np.concatenate([s["model.layers.0.mlp.gate_proj.weight"] for s in sharded]), weights["model.layers.0.mlp.gate_proj.weight"]
+    )
+    self.assertIs(shard_weights(weights, 0, 1), weights)
+
+  def test_check_tensor_parallel(self):
+    check_tensor_parallel(32, 8, 14336, 4)
+    with self.assertRaises(ValueError):
+      check_tensor_parallel(32, 8, 14336, 3)
+
+  def test_torch_ranks_match_full_model(self):
+    import torch
+    from transformers import LlamaConfig
+    from transformers.models.llama.modeling_llama import LlamaModel
+    from exo.inference.torch.model.hf import apply_tensor_parallel
+
+    torch.manual_seed(0)
+    config = LlamaConfig(
+      hidden_size=DIM, intermediate_size=HIDDEN_DIM, num_attention_heads=N_HEADS, num_key_value_heads=N_KV_HEADS, num_hidden_layers=N_LAYERS, vocab_size=VOCAB_SIZE
+    )
+    model = LlamaModel(config).eval()
+    input_ids = torch.tensor([[1, 5, 9, 3, 7]])
+    with torch.no_grad():
+      expected = model(input_ids).last_hidden_state
+
+    def run(rank, all_reduce):
+      rank_model = copy.deepcopy(model)
+      apply_tensor_parallel(rank_model, rank, 2, lambda x: torch.from_numpy(all_reduce("request", x.numpy())))
+      with torch.no_grad():
+        return rank_model(input_ids).last_hidden_state
+
+    for output in run_ranks(2, run):
+      torch.testing.assert_close(output, expected, rtol=1e-4, atol=1e-5)
+
+  def test_tinygrad_ranks_match_full_model(self):
+    from tinygrad import Tensor, dtypes
+    from exo.inference.tinygrad.models.llama import Transformer, convert_from_huggingface
+    from tinygrad.nn.state import load_state_dict
+
+    weights = hf_weights()
+    shard = Shard("model", 0, N_LAYERS - 1, N_LAYERS + 1)  # not the last layer, so the model returns hidden states
+    tokens = [[1, 5, 9, 3, 7]]
+
+    def build(rank: int, world_size: int):
+      model = Transformer(DIM, HIDDEN_DIM, N_HEADS, N_LAYERS, 1e-5, VOCAB_SIZE, shard=shard, n_kv_heads=N_KV_HEADS, jit=False, tp_size=world_size)
+      sharded = {name: Tensor(w) for name, w in shard_weights(weights, rank, world_size).items()}
+      load_state_dict(model, convert_from_huggingface(sharded, model, N_HEADS // world_size, N_KV_HEADS // world_size), strict=False)
+      return model
+
+    full = build(0, 1)
+    expected = full(Tensor(tokens), 0, full.new_cache(dtypes.float32)).numpy()
+    models = [build(rank, 2) for rank in range(2)]
+
+    # tinygrad isn't thread safe, so the ranks take turns and only wait for each other concurrently
+    lock = threading.Lock()
+
+    def run(rank, all_reduce):
+      def reduce(x):
+        lock.release()
+        try:
+          return all_reduce("request", x)
+        finally:
+          lock.acquire()
+      models[rank].all_reduce = reduce
+      with lock:
+        return models[rank](Tensor(tokens), 0, models[rank].new_cache(dtypes.float32)).numpy()
+
+    # tinygrad's kernel cache is an sqlite connection that can't be shared between threads
+    with mock.patch("tinygrad.helpers.CACHELEVEL", 0):
+      for output in run_ranks(2, run):
+        np.testing.assert_allclose(output, expected, rtol=1e-4, atol=1e-5)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -4,10 +4,18 @@ import os
 from exo.inference.tinygrad.models.llama import Transformer, convert_from_huggingface, fix_bf16
 from exo.inference.shard import Shard
 from exo.inference.tokenizers import resolve_tokenizer
-from tinygrad.nn.state import load_state_dict
+from tinygrad.nn.state import load_state_dict, safe_load, safe_save
+from tinygrad.helpers import getenv
 from tinygrad import Tensor, nn, Context
 from exo.inference.inference_engine import InferenceEngine
-from typing import Optional, Tuple
+from exo.helpers import DEBUG
+from exo.inference.tensor_parallel import TensorParallelContext, check_tensor_parallel, shard_weights
+from exo.inference.shard_cache import shard_cache_key, find_cached_shard, save_cached_shard
+from exo.inference.prefix_cache import RadixCache, RadixNode
+from exo.inference.kv_blocks import KVBlockManager
+from typing import List, Optional, Tuple
+from collections import OrderedDict
+import functools
 import numpy as np
 from exo.inference.tinygrad.tinygrad_helpers import concat_weights, load
 from exo.download.shard_download import ShardDownloader
@@ -21,80 +29,244 @@ TOP_K = 25
 TOP_P = 0.9
 ALPHA_F = 0.1
 ALPHA_P = 0.0
+# the longest sequence a request can reach, kv caches grow up to it as the sequence gets longer
+MAX_CONTEXT = int(os.getenv("MAX_CONTEXT", 8192))
+# prompt lengths the jit is compiled for when a shard is loaded, the other buckets compile on first use
+WARMUP_BUCKETS = (32, 64, 128)
+# tokens of earlier requests whose kv caches are kept for requests starting with the same tokens, 0 turns it off
+PREFIX_CACHE_TOKENS = int(os.getenv("PREFIX_CACHE_TOKENS", 4096))
+# the prefix cache's blocks in the kv cache budget, and the most of the budget it takes
+PREFIX_CACHE = "prefix_cache"
+PREFIX_CACHE_SHARE = 0.25
 MODEL_PARAMS = {
   "8B": {"args": {"dim": 4096, "n_heads": 32, "n_kv_heads": 8, "n_layers": 32, "norm_eps": 1e-5, "rope_theta": 500000, "vocab_size": 128256, "hidden_dim": 14336}, "files": 1},
   "70B": {"args": {"dim": 8192, "n_heads": 64, "n_kv_heads": 8, "n_layers": 80, "norm_eps": 1e-5, "rope_theta": 500000, "vocab_size": 128256, "hidden_dim": 28672}, "files": 8}
 }
 
 
-def build_transformer(model_path: Path, shard: Shard, model_size="8B", device=None):
+def load_weights(model_path: Path, shard: Shard, model_size: str, device=None):
+  if model_path.is_dir():
+    if (model_path/"model.safetensors.index.json").exists(): return load(str(model_path/"model.safetensors.index.json"), shard)
+    if (model_path/"model.safetensors").exists(): return load(str(model_path/"model.safetensors"), shard)
+    return concat_weights([load(str(model_path/f"consolidated.{i:02d}.pth"), shard) for i in range(MODEL_PARAMS[model_size]["files"])], device[0] if isinstance(device, tuple) else device)
+  return load(str(model_path), shard)
+
+
+def build_transformer(
+  model_path: Path, shard: Shard, model_size="8B", device=None, tensor_parallel: Optional[TensorParallelContext] = None, max_context: int = MAX_CONTEXT, kv_cache_quantize: Optional[str] = None
+):
   # build model
   linear = nn.Linear
+  args = MODEL_PARAMS[model_size]["args"]
+  tp_rank, tp_size = tensor_parallel.key() if tensor_parallel else (0, 1)
+  check_tensor_parallel(args["n_heads"], args["n_kv_heads"], args["hidden_dim"], tp_size)
   with Context(THREEFRY=0):
-    model = Transformer(**MODEL_PARAMS[model_size]["args"], linear=linear, max_context=8192, jit=True, shard=shard)
+    model = Transformer(**args, linear=linear, max_context=max_context, jit=True, shard=shard, tp_size=tp_size, kv_cache_quantize=kv_cache_quantize)
 
-  # load weights
-  if model_path.is_dir():
-    if (model_path/"model.safetensors.index.json").exists(): weights = load(str(model_path/"model.safetensors.index.json"), shard)
-    elif (model_path/"model.safetensors").exists(): weights = load(str(model_path/"model.safetensors"), shard)
-    else: weights = concat_weights([load(str(model_path/f"consolidated.{i:02d}.pth"), shard) for i in range(MODEL_PARAMS[model_size]["files"])], device[0] if isinstance(device, tuple) else device)
+  # load weights, converted ones from the shard cache if an earlier run saved them
+  key = shard_cache_key(model_path, shard, "tinygrad", "float16" if getenv("SUPPORT_BF16", 1) else "llvm_bf16", (tp_rank, tp_size))
+  cached = find_cached_shard(shard.model_id, "tinygrad", key)
+  if cached is not None:
+    if DEBUG >= 2: print(f"Loading converted weights for {shard} from {cached}")
+    weights = safe_load(str(cached))
   else:
-    weights = load(str(model_path), shard)
-  weights = convert_from_huggingface(weights, model, MODEL_PARAMS[model_size]["args"]["n_heads"], MODEL_PARAMS[model_size]["args"]["n_kv_heads"])
-  weights = fix_bf16(weights)
+    weights = load_weights(model_path, shard, model_size, device)
+    if tp_size > 1 and not any(k.startswith("model.") for k in weights):
+      raise ValueError("Tensor parallelism needs huggingface safetensors weights")
+    weights = shard_weights(weights, tp_rank, tp_size)
+    weights = convert_from_huggingface(weights, model, args["n_heads"] // tp_size, args["n_kv_heads"] // tp_size)
+    weights = fix_bf16(weights)
+    if (cached := save_cached_shard(shard.model_id, "tinygrad", key, functools.partial(safe_save, weights))) is not None:
+      weights = safe_load(str(cached))
 
   with Context(BEAM=0):
-    # replace weights in model
-    load_state_dict(model, weights, strict=False, consume=False)  # consume=True
+    # replace weights in model, dropping each source tensor once it's loaded so the mapped files can be released
+    load_state_dict(model, weights, strict=False, consume=True)
   return model
 
 
+def slice_cache(cache: Tensor, start: int, end: int) -> Tensor:
+  return cache.shrink((None, None, None, (start, end), None, None)).contiguous().realize()
+
+
+class Session:
+  def __init__(self, cache: Tensor, tokens: Optional[List[int]] = None, prefix: Optional[RadixNode] = None):
+    self.cache = cache
+    # the tokens whose keys and values are in the cache, in order
+    self.tokens = tokens or []
+    # the cached prefix the request started from, locked until the session ends
+    self.prefix = prefix
+
+
 class TinygradDynamicShardInferenceEngine(InferenceEngine):
-  def __init__(self, shard_downloader: ShardDownloader):
+  supports_tensor_parallel = True
+
+  def __init__(
+    self,
+    shard_downloader: ShardDownloader,
+    max_sessions: Optional[int] = None,
+    prefix_cache_tokens: int = PREFIX_CACHE_TOKENS,
+    kv_cache_budget: Optional[int] = None,
+    kv_cache_quantize: Optional[str] = None,
+  ):
+    if kv_cache_quantize not in (None, "int8"):
+      raise ValueError(f"Unsupported kv cache quantization {kv_cache_quantize!r}, tinygrad supports int8")
     self.shard = None
     self.shard_downloader = shard_downloader
     self.executor = ThreadPoolExecutor(max_workers=1)
+    self.tensor_parallel_key = (0, 1)
+    # per request kv caches, least recently used first, as many as the kv cache budget holds unless max_sessions is set
+    self.max_sessions = max_sessions
+    self.sessions: OrderedDict[str, Session] = OrderedDict()
+    self.kv_cache_budget = kv_cache_budget
+    self.kv_cache_quantize = kv_cache_quantize
+    self.kv_blocks: Optional[KVBlockManager] = None
+    self.prefix_cache_tokens = prefix_cache_tokens
+    self.prefix_cache: RadixCache[Tensor] = RadixCache(prefix_cache_tokens, slice_cache)
 
-  async def infer_prompt(self, request_id: str, shard: Shard, prompt: str, image_str: Optional[str] = None, inference_state: Optional[str] = None) -> (np.ndarray, str, bool):
-    await self.ensure_shard(shard)
+  async def infer_prompt(
+    self, request_id: str, shard: Shard, prompt: str, image_str: Optional[str] = None, inference_state: Optional[str] = None, tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> (np.ndarray, str, bool):
+    await self.ensure_shard(shard, tensor_parallel)
     start_pos = json.loads(inference_state or "{}").get("start_pos", 0)
-    n_captured_toks = json.loads(inference_state or "{}").get("n_captured_toks", 0)
 
     toks = await asyncio.get_event_loop().run_in_executor(self.executor, self.tokenizer.encode, prompt)
-    h = await asyncio.get_event_loop().run_in_executor(self.executor, lambda: self.model(Tensor([toks]), start_pos, TEMPERATURE).realize())
+    return await self.run_prompt(request_id, toks, start_pos, tensor_parallel, reuse_prefix=start_pos == 0)
+
+  async def run_prompt(self, request_id: str, toks: List[int], start_pos: int, tensor_parallel: Optional[TensorParallelContext], reuse_prefix: bool) -> Tuple[np.ndarray, str, bool]:
+    # a prompt starting a request skips the tokens an earlier request already ran, the next shards look them up too
+    prefix_len = await asyncio.get_event_loop().run_in_executor(self.executor, self.reuse_prefix, request_id, toks) if reuse_prefix else 0
+    start_pos += prefix_len
+    state = {"start_pos": start_pos, "n_captured_toks": len(toks) - prefix_len, "tokens": toks[prefix_len:]}
+    if prefix_len > 0: state["prefix"] = toks[:prefix_len]
+    h = await asyncio.get_event_loop().run_in_executor(self.executor, lambda: self.run_model(request_id, Tensor([toks[prefix_len:]]), start_pos, toks[prefix_len:], tensor_parallel))
 
     if h.shape == (1,):
-      start_pos += len(toks)
-      start_pos += 1
-      n_captured_toks = 0
-      return np.array([[h.item()]]), json.dumps({"start_pos": start_pos, "n_captured_toks": n_captured_toks}), h.item() == self.tokenizer.eos_token_id
+      return np.array([[h.item()]]), json.dumps({"start_pos": start_pos + len(toks) - prefix_len, "n_captured_toks": 0}), h.item() == self.tokenizer.eos_token_id
     else:
-      n_captured_toks = len(toks)
-      return h.numpy(), json.dumps({"start_pos": start_pos, "n_captured_toks": n_captured_toks}), False
+      return h.numpy(), json.dumps(state), False
 
-  async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[str] = None) -> Tuple[np.ndarray, str, bool]:
-    await self.ensure_shard(shard)
-    start_pos = json.loads(inference_state or "{}").get("start_pos", 0)
-    n_captured_toks = json.loads(inference_state or "{}").get("n_captured_toks", 0)
+  async def infer_tensor(
+    self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[str] = None, tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> Tuple[np.ndarray, str, bool]:
+    await self.ensure_shard(shard, tensor_parallel)
+    state = json.loads(inference_state or "{}")
+    if state.get("prefix_miss"):
+      # a later shard no longer held the prefix this request skipped, the tokens go round to the first shard to run again
+      if not self.shard.is_first_layer(): return input_data, inference_state, False
+      await asyncio.get_event_loop().run_in_executor(self.executor, self.end_session, request_id)
+      return await self.run_prompt(request_id, input_data.reshape(-1).tolist(), 0, tensor_parallel, reuse_prefix=False)
+    start_pos = state.get("start_pos", 0)
+    n_captured_toks = state.get("n_captured_toks", 0)
+    # token ids come back around to the first shard, the other shards are told which tokens their hidden states are
+    tokens = input_data.reshape(-1).tolist() if self.shard.is_first_layer() else state.get("tokens")
+
+    def run():
+      # a prompt run again from the start replaces what the first try left in the cache
+      if start_pos == 0 and n_captured_toks > 0: self.end_session(request_id)
+      if request_id not in self.sessions and state.get("prefix"):
+        # each shard's prefix cache evicts on its own, so this one may have let go of the prefix the first shard used
+        if self.reuse_prefix(request_id, state["prefix"], exact=True) != start_pos:
+          self.end_session(request_id)
+          return None
+      return self.run_model(request_id, Tensor(input_data), start_pos, tokens, tensor_parallel)
+    h = await asyncio.get_event_loop().run_in_executor(self.executor, run)
 
-    h = await asyncio.get_event_loop().run_in_executor(self.executor, lambda: self.model(Tensor(input_data), start_pos, TEMPERATURE).realize())
+    if h is None:
+      if DEBUG >= 2: print(f"Request {request_id} misses its {start_pos} token prefix on shard {self.shard}, running the prompt again")
+      return np.array([state["prefix"] + tokens]), json.dumps({"prefix_miss": True}), False
 
     if h.shape == (1,):
-      start_pos += n_captured_toks
-      start_pos += 1
-      n_captured_toks = 0
-      return np.array([[h.item()]]), json.dumps({"start_pos": start_pos, "n_captured_toks": n_captured_toks}), h.item() == self.tokenizer.eos_token_id
+      # the prompt's tokens, or the token that was just decoded
+      start_pos += n_captured_toks or 1
+      return np.array([[h.item()]]), json.dumps({"start_pos": start_pos, "n_captured_toks": 0}), h.item() == self.tokenizer.eos_token_id
     else:
-      return h.numpy(), json.dumps({"start_pos": start_pos, "n_captured_toks": n_captured_toks}), False
+      if self.shard.is_first_layer(): state["tokens"] = tokens
+      return h.numpy(), json.dumps(state), False
+
+  def reuse_prefix(self, request_id: str, tokens: List[int], exact: bool = False) -> int:
+    """
+    Starts the request's session from the longest cached prefix of tokens, leaving at least one token to run unless
+    exact. Returns the length of the prefix.
+    """
+    if self.prefix_cache.max_tokens <= 0: return 0
+    node, values = self.prefix_cache.match(tokens if exact else tokens[:-1])
+    if node.depth == 0: return 0
+    if DEBUG >= 2: print(f"Request {request_id} reuses {node.depth} cached tokens of {len(tokens)}")
+    prefix = Tensor.cat(*values, dim=3) if len(values) > 1 else values[0]
+    cache = prefix.pad((None, None, None, (0, self.model.cache_size(node.depth + 1) - node.depth), None, None)).contiguous().realize()
+    self.add_session(request_id, Session(cache, tokens[:node.depth], node))
+    self.prefix_cache.lock(node)
+    return node.depth
+
+  def add_session(self, request_id: str, session: Session) -> None:
+    self.end_session(request_id)
+    while self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+      evicted = next(iter(self.sessions))
+      self.end_session(evicted)
+      if DEBUG >= 2: print(f"Evicted kv cache of request {evicted}")
+    self.kv_blocks.reserve(request_id, session.cache.shape[3], self.end_session)
+    self.sessions[request_id] = session
+
+  async def finish_request(self, request_id: str) -> None:
+    if request_id in self.sessions: await asyncio.get_event_loop().run_in_executor(self.executor, self.end_session, request_id)
+
+  def end_session(self, request_id: str) -> None:
+    # what the request ran stays in the prefix cache, where the next turn of a chat finds it
+    self.kv_blocks.free(request_id)
+    session = self.sessions.pop(request_id, None)
+    if session is None: return
+    if session.tokens: self.prefix_cache.insert(session.tokens, functools.partial(slice_cache, session.cache))
+    if session.prefix is not None: self.prefix_cache.unlock(session.prefix)
+
+  def get_session(self, request_id: str, x: Tensor, start_pos: int) -> Session:
+    if request_id in self.sessions:
+      self.sessions.move_to_end(request_id)
+      session = self.sessions[request_id]
+      length = start_pos + self.model.padded_length(x.shape[1], start_pos)
+      self.kv_blocks.reserve(request_id, max(session.cache.shape[3], self.model.cache_size(length)), self.end_session)
+      session.cache = self.model.grow_cache(session.cache, length)
+      return session
+    if start_pos > 0:
+      raise ValueError(f"No kv cache for request {request_id} at position {start_pos}, it was evicted or started on another shard")
+    # the cache holds what attention sees, which is in the dtype of the embeddings or the hidden states we're sent
+    dtype = self.model.tok_embeddings.weight.dtype if self.shard.is_first_layer() else x.dtype
+    self.add_session(request_id, Session(self.model.new_cache(dtype, self.model.padded_length(x.shape[1], 0))))
+    return self.sessions[request_id]
+
+  def run_model(self, request_id: str, x: Tensor, start_pos: int, tokens: Optional[List[int]] = None, tensor_parallel: Optional[TensorParallelContext] = None) -> Tensor:
+    if tensor_parallel is not None:
+      self.model.all_reduce = functools.partial(tensor_parallel.all_reduce, request_id)
+    session = self.get_session(request_id, x, start_pos)
+    out = self.model(x, start_pos, session.cache, TEMPERATURE).realize()
+    # a session only goes in the prefix cache while the tokens it holds are known
+    if tokens is not None and len(session.tokens) == start_pos: session.tokens.extend(tokens)
+    else: session.tokens = []
+    return out
+
+  def reset_kv_caches(self) -> None:
+    self.kv_blocks = KVBlockManager.from_budget(self.model.cache_bytes_per_token(), self.kv_cache_budget)
+    # the prefix cache holds copies of finished requests' caches, so its blocks come out of the same budget up front
+    prefix_cache_tokens = min(self.prefix_cache_tokens, int(self.kv_blocks.n_blocks*self.kv_blocks.block_size*PREFIX_CACHE_SHARE))
+    if prefix_cache_tokens > 0: self.kv_blocks.set_aside(PREFIX_CACHE, prefix_cache_tokens)
+    self.prefix_cache = RadixCache(prefix_cache_tokens, slice_cache)
 
-  async def ensure_shard(self, shard: Shard):
-    if self.shard == shard:
+  async def ensure_shard(self, shard: Shard, tensor_parallel: Optional[TensorParallelContext] = None):
+    tensor_parallel_key = tensor_parallel.key() if tensor_parallel else (0, 1)
+    if self.shard == shard and self.tensor_parallel_key == tensor_parallel_key:
       return
 
     model_path = await self.shard_downloader.ensure_shard(shard)
 
-    if self.shard != shard:
-      self.model = await asyncio.get_event_loop().run_in_executor(self.executor, build_transformer, model_path, shard, "8B" if "8b" in shard.model_id.lower() else "70B")
+    if self.shard != shard or self.tensor_parallel_key != tensor_parallel_key:
+      model_size = "8B" if "8b" in shard.model_id.lower() else "70B"
+      self.sessions.clear()
+      self.prefix_cache = RadixCache(self.prefix_cache_tokens, slice_cache)
+      build = functools.partial(build_transformer, model_path, shard, model_size, tensor_parallel=tensor_parallel, kv_cache_quantize=self.kv_cache_quantize)
+      self.model = await asyncio.get_event_loop().run_in_executor(self.executor, build)
+      self.reset_kv_caches()
+      await asyncio.get_event_loop().run_in_executor(self.executor, self.model.warmup, TEMPERATURE, WARMUP_BUCKETS)
+      self.tensor_parallel_key = tensor_parallel_key
 
       tokenizer_path = str((model_path if model_path.is_dir() else model_path.parent))
       self.tokenizer = await resolve_tokenizer(tokenizer_path)
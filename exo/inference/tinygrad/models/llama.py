@@ -1,4 +1,5 @@
-from typing import Tuple, Union, Optional, Dict, Any
+from typing import Tuple, Union, Optional, Dict, Any, Callable
+import numpy as np
 from tinygrad import Tensor, Variable, TinyJit, dtypes, nn, Device
 from tinygrad.helpers import getenv
 
@@ -30,6 +31,20 @@ def apply_rotary_emb(xq: Tensor, xk: Tensor, freqs_cis: Tensor) -> Tuple[Tensor,
   return xq_out.flatten(3), xk_out.flatten(3)
 
 
+# an int8 kv cache holds each head's values over a scale of 2**(e/8), with e in one more int8 after them, so the cache
+# stays a single tensor. Rounding e up keeps the values in range and costs at most 9% of the scale's resolution.
+def quantize_kv(x: Tensor) -> Tensor:
+  x = x.float()
+  e = (x.abs().max(axis=-1, keepdim=True).maximum(1e-30)/127).log2().mul(8).ceil().clip(-128, 127)
+  return (x/(e/8).exp2()).round().clip(-127, 127).cat(e, dim=-1).cast(dtypes.int8)
+
+
+def dequantize_kv(q: Tensor, dtype) -> Tensor:
+  # shrinks rather than indexing, the cache length is symbolic in the jit
+  lead, head_dim = (None,)*(q.ndim - 1), q.shape[-1] - 1
+  return (q.shrink(lead + ((0, head_dim),)).float()*(q.shrink(lead + ((head_dim, head_dim + 1),)).float()/8).exp2()).cast(dtype)
+
+
 def repeat_kv(x: Tensor, n_rep: int) -> Tensor:
   bs, seqlen, n_kv_heads, head_dim = x.shape
   if n_rep == 1: return x
@@ -38,9 +53,10 @@ def repeat_kv(x: Tensor, n_rep: int) -> Tensor:
 
 
 class Attention:
-  def __init__(self, dim, n_heads, n_kv_heads, max_context, linear=nn.Linear):
-    self.n_heads = n_heads
-    self.n_kv_heads = n_kv_heads if n_kv_heads is not None else n_heads  # n_kv_heads != n_heads implies MQA [arxiv/2307.09288, A.2.1]
+  def __init__(self, dim, n_heads, n_kv_heads, max_context, linear=nn.Linear, tp_size: int = 1):
+    # with tensor parallelism this rank only holds n_heads/tp_size of the heads
+    self.n_heads = n_heads // tp_size
+    self.n_kv_heads = (n_kv_heads if n_kv_heads is not None else n_heads) // tp_size  # n_kv_heads != n_heads implies MQA [arxiv/2307.09288, A.2.1]
     self.head_dim = dim // n_heads
     self.n_rep = self.n_heads // self.n_kv_heads
     self.max_context = max_context
@@ -50,7 +66,7 @@ class Attention:
     self.wv = linear(dim, self.n_kv_heads*self.head_dim, bias=False)
     self.wo = linear(self.n_heads*self.head_dim, dim, bias=False)
 
-  def __call__(self, x: Tensor, start_pos: Union[Variable, int], freqs_cis: Tensor, mask: Optional[Tensor]) -> Tensor:
+  def __call__(self, x: Tensor, start_pos: Union[Variable, int], freqs_cis: Tensor, mask: Optional[Tensor], cache_kv: Tensor) -> Tensor:
     if getenv("WQKV"):
       if not hasattr(self, 'wqkv'): self.wqkv = Tensor.cat(self.wq.weight, self.wk.weight, self.wv.weight)
       xqkv = x @ self.wqkv.T
@@ -65,19 +81,15 @@ class Attention:
     xq, xk = apply_rotary_emb(xq, xk, freqs_cis)
     bsz, seqlen, _, _ = xq.shape
 
-    # create kv cache
-    if not hasattr(self, "cache_kv"):
-      self.cache_kv = Tensor.zeros(2, bsz, self.max_context, self.n_kv_heads, self.head_dim, dtype=x.dtype).contiguous().realize()
-      if isinstance(x.device, tuple):
-        # TODO: instead of specifying how to shard, it can follow how xk and xv are being sharded
-        self.cache_kv.shard_((x.device), axis=3 if getenv("SHARD_KVCACHE") else None).realize()
-
     # update the cache
-    assert xk.dtype == xv.dtype == self.cache_kv.dtype, f"{xk.dtype=}, {xv.dtype=}, {self.cache_kv.dtype=}"
-    self.cache_kv.shrink((None, None, (start_pos, start_pos + seqlen), None, None)).assign(Tensor.stack(xk, xv)).realize()
+    quantized = cache_kv.dtype == dtypes.int8
+    assert xk.dtype == xv.dtype and (quantized or xk.dtype == cache_kv.dtype), f"{xk.dtype=}, {xv.dtype=}, {cache_kv.dtype=}"
+    new_kv = Tensor.stack(quantize_kv(xk), quantize_kv(xv)) if quantized else Tensor.stack(xk, xv)
+    cache_kv.shrink((None, None, (start_pos, start_pos + seqlen), None, None)).assign(new_kv).realize()
 
-    keys = self.cache_kv[0].shrink((None, (0, start_pos + seqlen), None, None)) if start_pos > 0 else xk
-    values = self.cache_kv[1].shrink((None, (0, start_pos + seqlen), None, None)) if start_pos > 0 else xv
+    keys = cache_kv[0].shrink((None, (0, start_pos + seqlen), None, None)) if start_pos > 0 else xk
+    values = cache_kv[1].shrink((None, (0, start_pos + seqlen), None, None)) if start_pos > 0 else xv
+    if quantized and start_pos > 0: keys, values = dequantize_kv(keys, xk.dtype), dequantize_kv(values, xv.dtype)
 
     keys, values = repeat_kv(keys, self.n_rep), repeat_kv(values, self.n_rep)
     xq, keys, values = xq.transpose(1, 2), keys.transpose(1, 2), values.transpose(1, 2)
@@ -97,15 +109,28 @@ class FeedForward:
 
 
 class TransformerBlock:
-  def __init__(self, dim: int, hidden_dim: int, n_heads: int, n_kv_heads: int, norm_eps: float, max_context: int, linear=nn.Linear, feed_forward=FeedForward):
-    self.attention = Attention(dim, n_heads, n_kv_heads, max_context, linear)
-    self.feed_forward = feed_forward(dim, hidden_dim, linear)
+  def __init__(
+    self,
+    dim: int,
+    hidden_dim: int,
+    n_heads: int,
+    n_kv_heads: int,
+    norm_eps: float,
+    max_context: int,
+    linear=nn.Linear,
+    feed_forward=FeedForward,
+    tp_size: int = 1,
+    all_reduce: Optional[Callable[[Tensor], Tensor]] = None,
+  ):
+    self.attention = Attention(dim, n_heads, n_kv_heads, max_context, linear, tp_size)
+    self.feed_forward = feed_forward(dim, hidden_dim // tp_size, linear)
     self.attention_norm = nn.RMSNorm(dim, norm_eps)
     self.ffn_norm = nn.RMSNorm(dim, norm_eps)
+    self.all_reduce = all_reduce if tp_size > 1 else (lambda x: x)
 
-  def __call__(self, x: Tensor, start_pos: Union[Variable, int], freqs_cis: Tensor, mask: Optional[Tensor]):
-    h = x + self.attention(self.attention_norm(x), start_pos, freqs_cis, mask)
-    return (h + self.feed_forward(self.ffn_norm(h))).contiguous()
+  def __call__(self, x: Tensor, start_pos: Union[Variable, int], freqs_cis: Tensor, mask: Optional[Tensor], cache_kv: Tensor):
+    h = x + self.all_reduce(self.attention(self.attention_norm(x), start_pos, freqs_cis, mask, cache_kv))
+    return (h + self.all_reduce(self.feed_forward(self.ffn_norm(h)))).contiguous()
 
 
 # standard openai sampling
@@ -176,18 +201,74 @@ class Transformer:
     rope_theta=10000,
     max_context=1024,
     jit=True,
-    feed_forward=FeedForward
+    feed_forward=FeedForward,
+    tp_size: int = 1,
+    cache_chunk: int = 256,
+    prefill_buckets: Tuple[int, ...] = (32, 64, 128, 256, 512),
+    kv_cache_quantize: Optional[str] = None,
   ):
-    self.layers = [TransformerBlock(dim, hidden_dim, n_heads, n_kv_heads, norm_eps, max_context, linear, feed_forward=feed_forward) for _ in range(n_layers)]
+    # with tp_size > 1, all_reduce has to be set to this request's reduction over the tensor parallel group before each
+    # call. The reductions leave the graph, so the model can't be jitted.
+    self.all_reduce: Optional[Callable[[np.ndarray], np.ndarray]] = None
+    # blocks are only built for the shard's layers, the others stay None so layers is still indexed by layer number
+    self.layers = [
+      TransformerBlock(dim, hidden_dim, n_heads, n_kv_heads, norm_eps, max_context, linear, feed_forward=feed_forward, tp_size=tp_size, all_reduce=self.reduce)
+      if shard is None or shard.start_layer <= i <= shard.end_layer else None for i in range(n_layers)
+    ]
     self.norm = nn.RMSNorm(dim, norm_eps)
     self.tok_embeddings = nn.Embedding(vocab_size, dim)
     self.output = nn.Linear(dim, vocab_size, bias=False)
     self.max_context = max_context
+    self.cache_chunk = cache_chunk
     self.freqs_cis = precompute_freqs_cis(dim // n_heads, self.max_context*2, rope_theta).contiguous()
-    self.forward_jit = TinyJit(self.forward) if jit else None
+    # the jit needs the same input shapes and dtypes on every call, so there is one for each. Prompts are padded to the
+    # next of prefill_buckets so they only need a handful.
+    self.jit = jit and tp_size == 1
+    self.prefill_buckets = prefill_buckets
+    self.forward_jits: Dict[tuple, TinyJit] = {}
     self.shard = shard
-
-  def forward(self, x: Tensor, start_pos: Union[Variable, int], temperature: float, top_k: int, top_p: float, alpha_f: float, alpha_p: float):
+    # "int8" for quantized kv caches
+    self.kv_cache_quantize = kv_cache_quantize
+
+  def reduce(self, x: Tensor) -> Tensor:
+    return Tensor(self.all_reduce(x.numpy()), device=x.device).cast(x.dtype)
+
+  def cache_size(self, length: int) -> int:
+    if length > self.max_context:
+      raise ValueError(f"Sequence of {length} tokens is longer than the max context of {self.max_context}")
+    return min(self.max_context, -(-length // self.cache_chunk)*self.cache_chunk)
+
+  def new_cache(self, dtype, length: int = 1) -> Tensor:
+    # one request's keys and values for every layer of the shard. It's a single tensor so the jit takes it as an input
+    # and swaps it between requests instead of baking it in.
+    attention = self.layers[self.shard.start_layer].attention
+    if self.kv_cache_quantize is not None:
+      shape = (self.shard.get_layer_count(), 2, 1, self.cache_size(length), attention.n_kv_heads, attention.head_dim + 1)
+      return Tensor.zeros(*shape, dtype=dtypes.int8).contiguous().realize()
+    shape = (self.shard.get_layer_count(), 2, 1, self.cache_size(length), attention.n_kv_heads, attention.head_dim)
+    return Tensor.zeros(*shape, dtype=dtype).contiguous().realize()
+
+  def cache_bytes_per_token(self) -> int:
+    attention = self.layers[self.shard.start_layer].attention
+    if self.kv_cache_quantize is not None: return self.shard.get_layer_count()*2*attention.n_kv_heads*(attention.head_dim + 1)
+    dtype = self.tok_embeddings.weight.dtype if self.shard.is_first_layer() else attention.wq.weight.dtype
+    return self.shard.get_layer_count()*2*attention.n_kv_heads*attention.head_dim*dtype.itemsize
+
+  def grow_cache(self, cache: Tensor, length: int) -> Tensor:
+    # caches grow a chunk at a time up to max_context, rather than starting out at max_context
+    if length <= cache.shape[3]: return cache
+    return cache.pad((None, None, None, (0, self.cache_size(length) - cache.shape[3]), None, None)).contiguous().realize()
+
+  def prefill_bucket(self, seqlen: int, start_pos: int) -> Optional[int]:
+    if not self.jit or seqlen == 1 or start_pos != 0: return None
+    return next((bucket for bucket in self.prefill_buckets if seqlen <= bucket <= self.max_context), None)
+
+  def padded_length(self, seqlen: int, start_pos: int) -> int:
+    return self.prefill_bucket(seqlen, start_pos) or seqlen
+
+  def forward(
+    self, x: Tensor, start_pos: Union[Variable, int], cache: Tensor, temperature: float, top_k: int, top_p: float, alpha_f: float, alpha_p: float, last: Union[Variable, int, None] = None
+  ):
     seqlen = x.shape[1]
     freqs_cis = self.freqs_cis.shrink((None, (start_pos, start_pos + seqlen), None, None, None))
     mask = Tensor.full((1, 1, seqlen, start_pos + seqlen), float("-100000000"), dtype=x.dtype, device=x.device).triu(start_pos + 1).realize() if seqlen > 1 else None
@@ -199,19 +280,47 @@ class Transformer:
 
     for i in range(self.shard.start_layer, self.shard.end_layer + 1):
       layer = self.layers[i]
-      h = layer(h, start_pos, freqs_cis, mask)
+      h = layer(h, start_pos, freqs_cis, mask, cache[i - self.shard.start_layer])
 
     if self.shard.is_last_layer():
+      # only the last position is sampled, so it's the only one normed and projected onto the vocabulary
+      # with a padded prompt, last is the position of the prompt's last token
+      h = h.shrink((None, (last, last + 1), None)) if last is not None else h[:, -1:, :]
       logits = self.output(self.norm(h)).float()[:, -1, :]
       return sample(logits.flatten(), temperature, top_k, top_p, alpha_f, alpha_p).realize()
     else:
       return h
 
-  def __call__(self, tokens: Tensor, start_pos: Variable, temperature: float = 0.0, top_k: int = 0, top_p: float = 0.8, alpha_f: float = 0.0, alpha_p: float = 0.0):
-    # TODO: better way to handle the first call v.s. the rest?
-    if tokens.shape[0:2] == (1, 1) and self.forward_jit is not None:
-      return self.forward_jit(tokens, Variable("start_pos", 0, self.max_context).bind(start_pos), temperature, top_k, top_p, alpha_f, alpha_p)
-    return self.forward(tokens, start_pos, temperature, top_k, top_p, alpha_f, alpha_p)
+  def __call__(self, tokens: Tensor, start_pos: Variable, cache: Tensor, temperature: float = 0.0, top_k: int = 0, top_p: float = 0.8, alpha_f: float = 0.0, alpha_p: float = 0.0):
+    seqlen, size = tokens.shape[1], cache.shape[3]
+    assert start_pos + self.padded_length(seqlen, start_pos) <= size, f"kv cache of {size} is too small for {start_pos=} and {seqlen} tokens"
+    if tokens.shape[0:2] == (1, 1) and self.jit:
+      return self.get_jit(tokens, cache)(tokens, Variable("start_pos", 0, size - 1).bind(start_pos), cache, temperature, top_k, top_p, alpha_f, alpha_p)
+    if (bucket := self.prefill_bucket(seqlen, start_pos)) is not None:
+      # the padding comes after the prompt, so the causal mask already keeps the prompt from attending to it. What it
+      # writes to the kv cache past the prompt is overwritten by the tokens that follow before anything reads it.
+      padded = tokens.pad((None, (0, bucket - seqlen)) + (None,)*(tokens.ndim - 2)).contiguous()
+      last = Variable("last", 0, bucket - 1).bind(seqlen - 1) if self.shard.is_last_layer() else None
+      out = self.get_jit(padded, cache)(padded, 0, cache, temperature, top_k, top_p, alpha_f, alpha_p, last)
+      return out if self.shard.is_last_layer() else out[:, :seqlen]
+    return self.forward(tokens, start_pos, cache, temperature, top_k, top_p, alpha_f, alpha_p)
+
+  def get_jit(self, x: Tensor, cache: Tensor) -> TinyJit:
+    key = (x.shape, x.dtype, cache.shape, cache.dtype)
+    if key not in self.forward_jits: self.forward_jits[key] = TinyJit(self.forward)
+    return self.forward_jits[key]
+
+  def warmup(self, temperature: float = 0.0, buckets: Optional[Tuple[int, ...]] = None):
+    # jits capture on their second call, so each prompt bucket and the first decode step after it run twice
+    if not self.jit: return
+    start = self.layers[self.shard.start_layer]
+    dtype = self.tok_embeddings.weight.dtype if self.shard.is_first_layer() else start.attention.wq.weight.dtype
+    for bucket in buckets or self.prefill_buckets:
+      if bucket > self.max_context: continue
+      cache = self.new_cache(dtype, bucket)
+      for seqlen, start_pos in ((bucket, 0), (bucket, 0), (1, bucket - 1), (1, bucket - 1)):
+        x = Tensor.zeros(1, seqlen, dtype=dtypes.default_int) if self.shard.is_first_layer() else Tensor.zeros(1, seqlen, self.tok_embeddings.weight.shape[1], dtype=dtype)
+        self(x.contiguous(), start_pos, cache, temperature).realize()
 
 
 # *** helpers ***
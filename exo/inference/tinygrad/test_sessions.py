@@ -0,0 +1,216 @@
+import asyncio
+import unittest
+from unittest import mock
+from typing import Optional
+import numpy as np
+from tinygrad import Tensor, dtypes
+from tinygrad.nn.state import load_state_dict
+from exo.inference.shard import Shard
+from exo.inference.test_tensor_parallel import DIM, HIDDEN_DIM, N_HEADS, N_KV_HEADS, N_LAYERS, VOCAB_SIZE, hf_weights
+from exo.inference.prefix_cache import RadixCache
+from exo.inference.kv_blocks import IDLE_TIMEOUT, KVCacheFullError
+from exo.inference.tinygrad.inference import TinygradDynamicShardInferenceEngine, slice_cache
+from exo.inference.tinygrad.models.llama import Transformer, convert_from_huggingface
+
+# not the last layer, so the model returns hidden states instead of sampling
+SHARD = Shard("model", 0, N_LAYERS - 1, N_LAYERS + 1)
+
+
+def build_model(shard: Shard = SHARD, **kwargs):
+  model = Transformer(DIM, HIDDEN_DIM, N_HEADS, N_LAYERS, 1e-5, VOCAB_SIZE, shard=shard, n_kv_heads=N_KV_HEADS, max_context=32, prefill_buckets=(4, 8), **kwargs)
+  load_state_dict(model, convert_from_huggingface({name: Tensor(w) for name, w in hf_weights().items()}, model, N_HEADS, N_KV_HEADS), strict=False)
+  return model
+
+
+def build_engine(max_sessions: Optional[int] = 2, shard: Shard = SHARD, prefix_cache_tokens: int = 0, kv_cache_budget: Optional[int] = None, **kwargs):
+  engine = TinygradDynamicShardInferenceEngine(mock.Mock(), max_sessions=max_sessions, prefix_cache_tokens=prefix_cache_tokens, kv_cache_budget=kv_cache_budget)
+  engine.model, engine.shard = build_model(shard, **kwargs), shard
+  engine.reset_kv_caches()
+  engine.tokenizer = mock.Mock(encode=lambda prompt: [int(token) for token in prompt.split()], eos_token_id=-1)
+  return engine
+
+
+def generate(engine, request_id: str, tokens, start_pos: int = 0):
+  # the prompt, then one token at a time through the jit
+  outputs = [engine.run_model(request_id, Tensor([tokens[:3]]), start_pos).numpy()]
+  for i, token in enumerate(tokens[3:]):
+    outputs.append(engine.run_model(request_id, Tensor([[token]]), start_pos + 3 + i).numpy())
+  return outputs
+
+
+class TestTinygradSessions(unittest.TestCase):
+  def test_interleaved_requests_match_separate_runs(self):
+    a, b = [1, 5, 9, 3, 7, 2], [4, 8, 6, 11, 12, 13]
+    expected_a, expected_b = generate(build_engine(), "a", a), generate(build_engine(), "b", b)
+
+    engine = build_engine()
+    outputs = {"a": [engine.run_model("a", Tensor([a[:3]]), 0).numpy()], "b": [engine.run_model("b", Tensor([b[:3]]), 0).numpy()]}
+    for i in range(3, len(a)):
+      for request_id, tokens in (("a", a), ("b", b)):
+        outputs[request_id].append(engine.run_model(request_id, Tensor([[tokens[i]]]), i).numpy())
+    for output, expected in zip(outputs["a"] + outputs["b"], expected_a + expected_b):
+      np.testing.assert_allclose(output, expected, rtol=1e-4, atol=1e-5)
+
+  def test_least_recently_used_session_is_evicted(self):
+    engine = build_engine(max_sessions=2)
+    for request_id in ("a", "b"):
+      engine.run_model(request_id, Tensor([[1, 2]]), 0)
+    engine.run_model("a", Tensor([[3]]), 2)
+    engine.run_model("c", Tensor([[1, 2]]), 0)
+    self.assertEqual(list(engine.sessions), ["a", "c"])
+    with self.assertRaises(ValueError):
+      engine.run_model("b", Tensor([[3]]), 2)
+
+  def test_sessions_are_admitted_by_kv_cache_budget(self):
+    # every cache is max_context long, two blocks of 16 tokens, and the budget holds five blocks
+    bytes_per_token = build_model().cache_bytes_per_token()
+    engine = build_engine(max_sessions=None, kv_cache_budget=80*bytes_per_token)
+    now = [0.0]
+    engine.kv_blocks.clock = lambda: now[0]
+    self.assertEqual(engine.kv_blocks.n_blocks, 5)
+    for request_id in ("a", "b"):
+      engine.run_model(request_id, Tensor([[1, 2]]), 0)
+    # a and b are still running, so c is turned away rather than evicting one of them
+    with self.assertRaises(KVCacheFullError):
+      engine.run_model("c", Tensor([[1, 2]]), 0)
+    self.assertEqual(list(engine.sessions), ["a", "b"])
+
+    now[0] = IDLE_TIMEOUT - 1
+    engine.run_model("a", Tensor([[3]]), 2)
+    now[0] = IDLE_TIMEOUT
+    engine.run_model("c", Tensor([[1, 2]]), 0)
+    self.assertEqual(list(engine.sessions), ["a", "c"])
+    self.assertEqual(engine.kv_blocks.to_dict()["used_blocks"], 4)
+    with self.assertRaises(ValueError):
+      engine.run_model("b", Tensor([[3]]), 2)
+
+    engine = build_engine(max_sessions=None, kv_cache_budget=20*bytes_per_token)
+    with self.assertRaises(KVCacheFullError):
+      engine.run_model("a", Tensor([[1, 2]]), 0)
+    self.assertEqual((list(engine.sessions), engine.kv_blocks.used_blocks), ([], 0))
+
+  def test_prefix_cache_is_set_aside_from_kv_cache_budget(self):
+    bytes_per_token = build_model().cache_bytes_per_token()
+    engine = build_engine(max_sessions=None, prefix_cache_tokens=64, kv_cache_budget=80*bytes_per_token)
+    self.assertEqual((engine.prefix_cache.max_tokens, engine.kv_blocks.to_dict()["set_aside_blocks"]), (20, 2))
+    engine.run_model("a", Tensor([[1, 2]]), 0)
+    with self.assertRaises(KVCacheFullError):
+      engine.run_model("b", Tensor([[1, 2]]), 0)
+
+  def test_int8_cache_keeps_perplexity(self):
+    tokens = [1, 5, 9, 3, 7, 2, 4, 8, 6, 11, 12, 13, 2, 3]
+
+    def perplexity(engine) -> float:
+      # every position's hidden state through the head, each predicting the token after it
+      logits = engine.model.output(engine.model.norm(Tensor(np.concatenate(generate(engine, "a", tokens), axis=1)))).numpy()[0, :-1]
+      logprobs = logits - logits.max(-1, keepdims=True)
+      logprobs -= np.log(np.exp(logprobs).sum(-1, keepdims=True))
+      return float(np.exp(-logprobs[np.arange(len(tokens) - 1), tokens[1:]].mean()))
+
+    engine = build_engine(kv_cache_quantize="int8")
+    self.assertLess(abs(perplexity(engine)/perplexity(build_engine()) - 1), 0.001)
+    self.assertEqual(engine.sessions["a"].cache.dtype, dtypes.int8)
+    # a byte per value and one for the scale of each head of 16 values, against float32 values
+    self.assertEqual(engine.model.cache_bytes_per_token()*64, build_model().cache_bytes_per_token()*17)
+    with self.assertRaises(ValueError):
+      TinygradDynamicShardInferenceEngine(mock.Mock(), kv_cache_quantize="fp8")
+
+  def test_cache_grows_in_chunks_up_to_max_context(self):
+    tokens = [1, 5, 9, 3, 7, 2, 4, 8, 6]
+    expected = generate(build_engine(), "a", tokens)
+    engine = build_engine(cache_chunk=4)
+    for output, expected_output in zip(generate(engine, "a", tokens), expected):
+      np.testing.assert_allclose(output, expected_output, rtol=1e-4, atol=1e-5)
+    self.assertEqual(engine.sessions["a"].cache.shape[3], 12)
+    self.assertEqual(len(engine.kv_blocks.page_tables["a"]), 1)
+    self.assertEqual(sorted(key[2][3] for key in engine.model.forward_jits), [4, 4, 8, 12])
+    with self.assertRaises(ValueError):
+      engine.run_model("a", Tensor([[1]*24]), len(tokens))
+
+  def test_bucketed_prefill_matches_unpadded(self):
+    for shard in (SHARD, Shard("model", 0, N_LAYERS - 1, N_LAYERS)):
+      model, reference = build_model(shard), build_model(shard, jit=False)
+      model.warmup(buckets=(8,))
+      jits = len(model.forward_jits)
+      for prompt in ([1, 5, 9, 3, 7], [4, 8, 6, 11, 12, 13]):
+        expected = reference(Tensor([prompt]), 0, reference.new_cache(dtypes.float32, 8)).numpy()
+        np.testing.assert_allclose(model(Tensor([prompt]), 0, model.new_cache(dtypes.float32, 8)).numpy(), expected, rtol=1e-4, atol=1e-5)
+      self.assertEqual(len(model.forward_jits), jits)
+
+  def test_last_position_logits_pick_the_same_tokens(self):
+    hidden_model, last_shard = build_model(jit=False), Shard("model", 0, N_LAYERS - 1, N_LAYERS)
+    for model in (build_model(last_shard, jit=False), build_model(last_shard)):
+      for prompt in ([1, 5, 9, 3, 7], [4, 8, 6, 11, 12, 13], [2]):
+        hidden = hidden_model(Tensor([prompt]), 0, hidden_model.new_cache(dtypes.float32, 8))
+        expected = model.output(model.norm(hidden)).float().argmax(-1).numpy()[0, -1]
+        self.assertEqual(model(Tensor([prompt]), 0, model.new_cache(dtypes.float32, 8)).item(), expected)
+
+  def test_blocks_only_for_shard_layers(self):
+    model = Transformer(DIM, HIDDEN_DIM, N_HEADS, 4, 1e-5, VOCAB_SIZE, shard=Shard("model", 1, 2, 4), n_kv_heads=N_KV_HEADS)
+    self.assertEqual([layer is not None for layer in model.layers], [False, True, True, False])
+
+
+async def chat(first, last, request_id: str, prompt, n_tokens: int):
+  # a prompt through a two shard ring, then greedy decoding. Like the node, the last token isn't sent around again.
+  h, state, _ = await first.infer_prompt(request_id, first.shard, " ".join(map(str, prompt)))
+  tokens = []
+  while True:
+    out, state, _ = await last.infer_tensor(request_id, last.shard, h, state)
+    if out.size == 1:
+      tokens.append(out.item())
+      if len(tokens) == n_tokens: return tokens
+    h, state, _ = await first.infer_tensor(request_id, first.shard, out, state)
+
+
+def finish(engines, request_id: str) -> None:
+  # the node tells every shard when a request is done
+  for engine in engines: asyncio.run(engine.finish_request(request_id))
+
+
+class TestTinygradPrefixCache(unittest.TestCase):
+  def setUp(self):
+    # the engines compile on their executor threads, which can't share the main thread's sqlite connection
+    patcher = mock.patch("tinygrad.helpers.CACHELEVEL", 0)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def pipeline(self, prefix_cache_tokens: int):
+    return [build_engine(shard=Shard("model", i, i, N_LAYERS), prefix_cache_tokens=prefix_cache_tokens, jit=False) for i in range(N_LAYERS)]
+
+  def test_follow_up_turn_only_runs_new_tokens(self):
+    first_turn = [1, 5, 9, 3, 7]
+    uncached = self.pipeline(0)
+    reply = asyncio.run(chat(*uncached, "1", first_turn, 4))
+    second_turn = first_turn + reply + [4, 8]
+    expected = asyncio.run(chat(*uncached, "2", second_turn, 4))
+
+    cached = self.pipeline(64)
+    self.assertEqual(asyncio.run(chat(*cached, "1", first_turn, 4)), reply)
+    # a request's kv cache goes in the prefix cache once, when it's done
+    self.assertEqual(cached[0].prefix_cache.n_tokens, 0)
+    finish(cached, "1")
+    self.assertEqual(cached[0].prefix_cache.n_tokens, len(first_turn) + len(reply) - 1)
+    with mock.patch.object(cached[0].model, "forward", wraps=cached[0].model.forward) as forward:
+      self.assertEqual(asyncio.run(chat(*cached, "2", second_turn, 4)), expected)
+    # the last token of the reply was never run
+    self.assertEqual(forward.call_args_list[0].args[0].shape, (1, 3))
+    for engine in cached:
+      self.assertEqual(engine.sessions["2"].prefix.depth, len(first_turn) + len(reply) - 1)
+      self.assertEqual(engine.sessions["2"].tokens, second_turn + expected[:-1])
+
+  def test_shard_missing_the_prefix_runs_the_prompt_again(self):
+    expected = asyncio.run(chat(*self.pipeline(0), "2", [1, 5, 9, 3, 7], 2))
+    first, last = self.pipeline(64)
+    asyncio.run(chat(first, last, "1", [1, 5, 9, 3], 2))
+    finish((first, last), "1")
+    last.prefix_cache = RadixCache(64, slice_cache)
+    with mock.patch.object(first.model, "forward", wraps=first.model.forward) as forward:
+      self.assertEqual(asyncio.run(chat(first, last, "2", [1, 5, 9, 3, 7], 2)), expected)
+    # the first try skipped the four cached tokens, the second ran all five
+    self.assertEqual([call.args[0].shape for call in forward.call_args_list[:2]], [(1, 1), (1, 5)])
+    self.assertIsNone(first.sessions["2"].prefix)
+    self.assertEqual(first.sessions["2"].tokens, [1, 5, 9, 3, 7, expected[0]])
+
+
+if __name__ == "__main__":
+  unittest.main()
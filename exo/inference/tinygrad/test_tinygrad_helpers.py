@@ -0,0 +1,46 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from tinygrad import Tensor
+from tinygrad.nn.state import safe_save
+from exo.inference.shard import Shard
+from exo.inference.tinygrad.tinygrad_helpers import load
+
+N_LAYERS = 3
+
+
+def names(layer: int):
+  return [f"model.layers.{layer}.self_attn.q_proj.weight", f"model.layers.{layer}.mlp.down_proj.weight"]
+
+
+class TestLoad(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.path = Path(self.dir.name)
+    files = {
+      "model-00001-of-00002.safetensors": ["model.embed_tokens.weight", *names(0), *names(1)],
+      "model-00002-of-00002.safetensors": [*names(2), "model.norm.weight", "lm_head.weight"],
+    }
+    for filename, tensors in files.items():
+      safe_save({name: Tensor.ones(2, 2).contiguous() for name in tensors}, str(self.path/filename))
+    weight_map = {name: filename for filename, tensors in files.items() for name in tensors}
+    (self.path/"model.safetensors.index.json").write_text(json.dumps({"weight_map": weight_map}))
+    safe_save({name: Tensor.ones(2, 2).contiguous() for name in weight_map}, str(self.path/"model.safetensors"))
+
+  def tearDown(self):
+    self.dir.cleanup()
+
+  def test_only_shard_weights_are_loaded(self):
+    for fn in ("model.safetensors.index.json", "model.safetensors"):
+      self.assertEqual(sorted(load(str(self.path/fn), Shard("model", 1, 1, N_LAYERS))), sorted(names(1)))
+      self.assertEqual(sorted(load(str(self.path/fn), Shard("model", 0, 0, N_LAYERS))), sorted(["model.embed_tokens.weight", *names(0)]))
+      self.assertEqual(sorted(load(str(self.path/fn), Shard("model", 1, 2, N_LAYERS))), sorted([*names(1), *names(2), "model.norm.weight", "lm_head.weight"]))
+
+  def test_loaded_weights_match_file(self):
+    weights = load(str(self.path/"model.safetensors.index.json"), Shard("model", 0, 2, N_LAYERS))
+    self.assertEqual(weights["lm_head.weight"].numpy().tolist(), [[1.0, 1.0], [1.0, 1.0]])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -5,7 +5,7 @@ import json
 from typing import List
 from exo.inference.shard import Shard
 from exo.helpers import DEBUG
-from exo.download.hf.hf_helpers import get_allow_patterns
+from exo.download.hf.hf_helpers import get_allow_patterns, is_shard_weight
 from fnmatch import fnmatch
 
 
@@ -32,16 +32,13 @@ def load(fn: str, shard: Shard):
     for k, n in weight_map.items():
       if allow_patterns is not None and not any(fnmatch(n, r) for r in allow_patterns):
         continue
-      if k.startswith("model.layers."):
-        layer_num = int(k.split('.')[2])
-        if layer_num < shard.start_layer or layer_num > shard.end_layer:
-          continue
+      if not is_shard_weight(k, shard):
+        continue
 
-      parts[n] = load(str(Path(fn).parent/Path(n).name), shard)
+      if n not in parts: parts[n] = load(str(Path(fn).parent/Path(n).name), shard)
       filtered_weight_map[k] = n
     if DEBUG >= 2: print(f"Excluded model param keys for {shard=}: {sorted(set(weight_map.keys()) - set(filtered_weight_map.keys()))}")
     return {k: parts[n][k] for k, n in filtered_weight_map.items()}
-  elif fn.endswith(".safetensors"):
-    return safe_load(fn)
-  else:
-    return torch_load(fn)
+  # safetensors are memory mapped, so only the tensors kept here are ever read from disk
+  weights = safe_load(fn) if fn.endswith(".safetensors") else torch_load(fn)
+  return {k: v for k, v in weights.items() if is_shard_weight(k, shard)}
@@ -1,49 +1,84 @@
 # experimental, based off of tinygrad/inference.py
 import asyncio
-import os
 import json
+import os
 import functools
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
 import torch
 
-from typing import Optional, Tuple, Union, List
+from typing import Optional, Tuple
 from exo.inference.shard import Shard
 from exo.inference.inference_engine import InferenceEngine
+from exo.inference.kv_blocks import KVBlockManager, KVCacheFullError
+from exo.inference.tensor_parallel import TensorParallelContext
 from exo.inference.torch.model.hf import ShardedHuggingFaceModel
+from exo.inference.torch.model.quantized_cache import KV_CACHE_QUANTIZE_MODES, QuantizedDynamicCache
+from exo.inference.torch.utils import parse_cpu_list, setup_compute_thread
 from exo.inference.tokenizers import resolve_tokenizer
 from exo.helpers import DEBUG
 from exo.download.hf.hf_shard_download import HFShardDownloader
 from exo.download.hf.hf_helpers import get_weight_map
 
-from transformers import Cache
+from transformers import Cache, DynamicCache
 
 # model value options
 TOP_K = 20
 TEMP = 0.6
 TOP_P = 0.9
 
+# compute thread options, torch's defaults oversubscribe the host when several nodes share it
+# e.g. TORCH_NUM_THREADS=8 TORCH_CPU_AFFINITY=0-7 for one node and =8-15 for another
+TORCH_NUM_THREADS = int(os.environ["TORCH_NUM_THREADS"]) if os.environ.get("TORCH_NUM_THREADS") else None
+TORCH_INTEROP_THREADS = int(os.environ["TORCH_INTEROP_THREADS"]) if os.environ.get("TORCH_INTEROP_THREADS") else None
+TORCH_CPU_AFFINITY = parse_cpu_list(os.environ["TORCH_CPU_AFFINITY"]) if os.environ.get("TORCH_CPU_AFFINITY") else None
+# opt in quantization of the shard's linear layers on CPU, int8 (dynamic) or int4 (weight only)
+TORCH_QUANTIZE = os.environ.get("TORCH_QUANTIZE") or None
+
 class TorchDynamicShardInferenceEngine(InferenceEngine):
   """
   Torch Dynamic Shard Inference Engine for performing model inference with sharded Pytorch/HF based models.
   """
+  supports_tensor_parallel = True
 
-  def __init__(self, shard_downloader: HFShardDownloader):
+  def __init__(
+    self,
+    shard_downloader: HFShardDownloader,
+    max_sessions: Optional[int] = None,
+    kv_cache_budget: Optional[int] = None,
+    kv_cache_quantize: Optional[str] = None
+  ):
     """
     Initialize the inference engine.
 
     Args:
       shard_downloader: Model and weights sharding download
+      max_sessions: Most requests whose kv caches are kept, by default as many as fit in the kv cache budget
+      kv_cache_budget: Bytes the kv caches may take, by default from KV_CACHE_MB or the memory available
+      kv_cache_quantize: Store kv caches in "int8" or "fp8" instead of the model dtype
     """
+    if kv_cache_quantize is not None and kv_cache_quantize not in KV_CACHE_QUANTIZE_MODES:
+      raise ValueError(f"Unsupported kv cache quantization {kv_cache_quantize!r}, expected one of {', '.join(KV_CACHE_QUANTIZE_MODES)}")
     self.shard = None
     self.shard_downloader = shard_downloader
+    self.tensor_parallel_key = (0, 1)
 
-    # the whole history with new logits need to
-    # be passed to the model to reach the end token
-    # even with caching
-    self.past_input_ids = None
+    # every forward pass and sample runs on this one long lived thread
+    self.executor = ThreadPoolExecutor(
+      max_workers=1,
+      thread_name_prefix="torch-compute",
+      initializer=functools.partial(setup_compute_thread, TORCH_NUM_THREADS, TORCH_INTEROP_THREADS, TORCH_CPU_AFFINITY)
+    )
+
+    # per request kv caches of the shard's layers, least recently used first
+    self.max_sessions = max_sessions
+    self.sessions: OrderedDict[str, DynamicCache] = OrderedDict()
+    self.kv_cache_budget = kv_cache_budget
+    self.kv_cache_quantize = kv_cache_quantize
+    self.kv_blocks: Optional[KVBlockManager] = None
 
     # setup cuda device
     if os.environ.get("TORCH_DEVICE"):
@@ -66,66 +101,71 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
     else:
       self.device_map = str(self.device)
 
-  def infer_caching(
-    self,
-    inference_state: Optional[str] = None
-  ) -> Tuple[Optional[torch.Tensor], Optional[dict]]:
+  def get_session(self, request_id: str, is_prompt: bool) -> DynamicCache:
     """
-    inference caching from inference_state json
-    """
-    # setup cache and cached input_ids
-    past_iids = None
-    cached_iids = None
-    if inference_state is not None:
-      try:
-        infer_state = json.loads(inference_state)
-      except ValueError:
-        infer_state = None
-
-      if infer_state is not None:
-        cached_iids = infer_state["cached_iids"]
-        if cached_iids is not None:
-          past_iids = None
-          if len(cached_iids) > 0:
-            past_iids = torch.tensor(cached_iids["input_ids"]).to(self.device)
-            cached_iids = {"input_ids": past_iids.tolist()}
-
-      if DEBUG >= 4:
-        print(f"cached_iids len: {len(cached_iids)}")
-        print(f"cached_iids: {cached_iids}")
+    Returns the kv cache of a request, a new one for a prompt
 
-    return (past_iids, cached_iids)
+    Args:
+      request_id (str): The request being served
+      is_prompt (bool): The request starts here, so it gets an empty cache
+    """
+    if not is_prompt and request_id in self.sessions:
+      self.sessions.move_to_end(request_id)
+      return self.sessions[request_id]
+    if not is_prompt:
+      raise ValueError(f"No kv cache for request {request_id}, it was evicted or started on another shard")
+    self.end_session(request_id)
+    while self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+      evicted = next(iter(self.sessions))
+      self.end_session(evicted)
+      if DEBUG >= 2:
+        print(f"Evicted kv cache of request {evicted}")
+    self.sessions[request_id] = QuantizedDynamicCache(self.kv_cache_quantize) if self.kv_cache_quantize is not None else DynamicCache()
+    return self.sessions[request_id]
+
+  async def finish_request(self, request_id: str) -> None:
+    if request_id in self.sessions: self.end_session(request_id)
+
+  def end_session(self, request_id: str) -> None:
+    self.sessions.pop(request_id, None)
+    self.kv_blocks.free(request_id)
 
   async def async_forward(
     self,
+    request_id: str,
     input_ids: Optional[torch.Tensor] = None,
     hidden_states: Optional[torch.Tensor] = None,
-    attention_mask: Optional[torch.Tensor] = None
-  ) -> Tuple[Optional[torch.Tensor], Optional[Union[Cache, List[torch.FloatTensor]]], Optional[torch.Tensor]]:
+    past_key_values: Optional[Cache] = None,
+    tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> Tuple[Optional[torch.Tensor], Optional[Cache], Optional[torch.Tensor]]:
     """
     Asynchronously performs the forward pass using a stateful sharded model.
 
     Args:
+        request_id (str): The request being served, for tensor parallel all-reduces.
         input_ids (torch.Tensor, optional): Input token IDs for the model. If not provided, `hidden_states` must be used.
         hidden_states (torch.Tensor, optional): Precomputed hidden states to be used instead of `input_ids`.
-        attention_mask (torch.Tensor, optional): Mask to prevent attention on padding token indices.
+        past_key_values (Cache, optional): The request's kv cache, updated with the new tokens.
+        tensor_parallel (TensorParallelContext, optional): The group this node's stage is split across.
 
     Returns:
         A tuple containing:
 
         - shard_hidden_states (torch.Tensor, optional): Hidden states resulting from the forward pass.
-        - shard_past_kvs (list(torch.FloatTensor), optional): List of past key-value tensors (cache) used in the model.
+        - shard_past_kvs (Cache, optional): The updated kv cache.
         - shard_logits (torch.Tensor, optional): The logits computed during the forward pass.
     """
     loop = asyncio.get_running_loop()
 
-    with ThreadPoolExecutor() as pool:
-      result = await loop.run_in_executor(pool, functools.partial(
-        self.stateful_sharded_model.forward,
-        input_ids=input_ids,
-        hidden_states=hidden_states,
-        attention_mask=attention_mask
-      ))
+    if tensor_parallel is not None:
+      self.stateful_sharded_model.all_reduce = functools.partial(tensor_parallel.all_reduce, request_id)
+
+    result = await loop.run_in_executor(self.executor, functools.partial(
+      self.stateful_sharded_model.forward,
+      input_ids=input_ids,
+      hidden_states=hidden_states,
+      past_key_values=past_key_values
+    ))
 
     if DEBUG >=4:
       print("async_forward")
@@ -148,11 +188,10 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
     """
     loop = asyncio.get_running_loop()
 
-    with ThreadPoolExecutor() as pool:
-      result = await loop.run_in_executor(pool, functools.partial(
-        self.stateful_sharded_model.logits_sample,
-        logits=logits
-      ))
+    result = await loop.run_in_executor(self.executor, functools.partial(
+      self.stateful_sharded_model.logits_sample,
+      logits=logits
+    ))
 
     return result
 
@@ -162,7 +201,8 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
     shard: Shard,
     prompt: str,
     image_str: Optional[str] = None,
-    inference_state: Optional[str] = None
+    inference_state: Optional[str] = None,
+    tensor_parallel: Optional[TensorParallelContext] = None
   ) -> Tuple[np.ndarray, str, bool]:
     """
     Asynchronously processes a prompt using the specified shard and returns the inference result.
@@ -172,81 +212,35 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
         shard (Shard): The model shard used for inference.
         prompt (str): The text prompt to be processed by the model.
         image_str (str, optional): A base64 encoded image string to be optionally used in the inference. Defaults to None.
-        inference_state (str, optional): The cached inference state for resuming or continuing inference. Defaults to None.
+        inference_state (str, optional): Unused, the request's kv cache is kept by the engine. Defaults to None.
+        tensor_parallel (TensorParallelContext, optional): The group this node's stage is split across. Defaults to None.
 
     Returns:
         A tuple containing:
 
         - input_ids (np.ndarray): The processed token IDs as a NumPy array if logits were generated. Otherwise, it returns hidden states.
-        - cache_json (str): A JSON string containing the cached input IDs for further inference steps.
+        - inference_state (str): JSON with n_captured_toks, the number of prompt tokens in the hidden states.
         - is_finished (bool): A boolean indicating whether the model has reached the end-of-sequence (EOS) token.
     """
     if DEBUG >= 4:
       print("infer_prompt called")
       print(f"prompt: {prompt}")
       print(f"shard: {shard}")
-      print(f"inference_state: {inference_state}")
 
-    await self.ensure_shard(shard)
+    await self.ensure_shard(shard, tensor_parallel)
 
     inputs = self.tokenizer([prompt], return_tensors="pt")
     input_ids = inputs.input_ids.to(self.device)
-    input_attention_mask = inputs.attention_mask.to(self.device)
-
-    # get cache from inference_state
-    past_iids, cached_iids = self.infer_caching(inference_state)
-
-    if past_iids is not None:
-      self.past_input_ids = past_iids
-    else:
-      self.past_input_ids = input_ids
-
-    if DEBUG >= 4:
-      print(f"past_input_ids: {self.past_input_ids}\n")
 
-    shard_hidden_states, shard_past_kvs, shard_logits = await self.async_forward(
-      input_ids=self.past_input_ids,
-      attention_mask=input_attention_mask
-    )
-
-    if DEBUG >= 4:
-      print(f"\nshard_hidden_states: {shard_hidden_states}\n")
-      print(f"\nshard_past_kvs {shard_past_kvs}\n")
-      print(f"\nshard_logits: {shard_logits}")
-
-    next_token = None
-    if shard_logits is not None:
-      next_token = await self.async_logit_sample(shard_logits)
-      self.past_input_ids = torch.cat([input_ids, next_token[:, None].squeeze(-1)], dim=-1)
-      input_ids = next_token
-
-      if DEBUG >= 4:
-        print(f"\nnext_token: {next_token}")
-
-    if self.past_input_ids is not None:
-      cached_iids = {"input_ids": self.past_input_ids.tolist()}
-
-    is_finished = False
-    if next_token is not None:
-      is_finished = next_token.item() == self.tokenizer.eos_token_id
-
-    return_values = (
-      input_ids.numpy(force=True) if shard_logits is not None else shard_hidden_states.numpy(force=True),
-      json.dumps({"cached_iids": cached_iids}),
-      is_finished
-    )
-
-    if DEBUG >= 4:
-      print(f"return_values: {return_values}")
-
-    return return_values
+    return await self.infer_step(request_id, self.get_session(request_id, True), True, input_ids=input_ids, tensor_parallel=tensor_parallel)
 
   async def infer_tensor(
    self,
    request_id: str,
    shard: Shard,
    input_data: np.ndarray,
-   inference_state: Optional[str] = None
+   inference_state: Optional[str] = None,
+   tensor_parallel: Optional[TensorParallelContext] = None
   ) -> Tuple[np.ndarray, str, bool]:
     """
     Asynchronously processes input tensor data using the specified shard and returns the inference result.
@@ -254,101 +248,92 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
     Args:
         request_id (str): The unique identifier for the request.
         shard (Shard): The model shard used for inference.
-        input_data (np.ndarray): The input data in NumPy array format to be processed by the model.
-        inference_state (str, optional): The cached inference state for resuming or continuing inference. Defaults to None.
+        input_data (np.ndarray): The hidden states of the prompt from the previous shard, or the hidden states or id of the latest token.
+        inference_state (str, optional): The previous shard's state, whose n_captured_toks marks the prompt's hidden states. Defaults to None.
+        tensor_parallel (TensorParallelContext, optional): The group this node's stage is split across. Defaults to None.
 
     Returns:
         A tuple containing:
 
         - input_ids (np.ndarray): The processed token IDs as a NumPy array if logits were generated. Otherwise, it returns hidden states.
-        - cache_json (str): A JSON string containing the cached input IDs for further inference steps.
+        - inference_state (str): JSON with n_captured_toks, the number of prompt tokens in the hidden states.
         - is_finished (bool): A boolean indicating whether the model has reached the end-of-sequence (EOS) token.
     """
     if DEBUG >= 4:
       print("infer_tensor called")
       print(f"input_data: {input_data}")
       print(f"shard: {shard}")
-      print(f"inference_state: {inference_state}")
-
-    await self.ensure_shard(shard)
 
-    input_ids = torch.tensor(input_data).to(self.device)
+    await self.ensure_shard(shard, tensor_parallel)
 
-    # get cache from inference_state
-    past_iids, cached_iids = self.infer_caching(inference_state)
+    input_tensor = torch.tensor(input_data).to(self.device)
 
-    # detect if hidden_states or not
-    hidden_states = None
-    self.past_input_ids = None
-    if input_ids.size()[-1] > 1:
-      hidden_states = input_ids
-      self.past_input_ids = past_iids
-    else:
-      if past_iids is not None:
-        self.past_input_ids = past_iids
-      else:
-        self.past_input_ids = input_ids
+    # token ids come back around to the first shard, the other shards get hidden states
+    if input_tensor.ndim == 3:
+      # a shard past the first one starts a request when the prompt's hidden states arrive, any other step needs the
+      # request's cache and fails rather than running without it
+      is_prompt = json.loads(inference_state or "{}").get("n_captured_toks", 0) > 0
+      past_key_values = self.get_session(request_id, is_prompt)
+      return await self.infer_step(request_id, past_key_values, is_prompt, hidden_states=input_tensor.to(self.dtype), tensor_parallel=tensor_parallel)
 
-    if DEBUG >= 4:
-      print(f"\npast_input_ids: {self.past_input_ids}")
-      print(f"\nhidden_state: {hidden_states}")
-      print(f"\ninference_state: {inference_state}")
+    return await self.infer_step(request_id, self.get_session(request_id, False), False, input_ids=input_tensor, tensor_parallel=tensor_parallel)
 
-    shard_hidden_states, shard_past_kvs, shard_logits = await self.async_forward(
-      input_ids=self.past_input_ids,
-      hidden_states=hidden_states
+  async def infer_step(
+    self,
+    request_id: str,
+    past_key_values: DynamicCache,
+    is_prompt: bool,
+    input_ids: Optional[torch.Tensor] = None,
+    hidden_states: Optional[torch.Tensor] = None,
+    tensor_parallel: Optional[TensorParallelContext] = None
+  ) -> Tuple[np.ndarray, str, bool]:
+    """
+    Runs the new tokens through the shard with the request's kv cache and samples
+    the next token on the last shard
+    """
+    # the cache grows by the new tokens, idle requests' caches make room for them if the budget is spent
+    n_tokens = (input_ids if input_ids is not None else hidden_states).shape[1]
+    inference_state = json.dumps({"n_captured_toks": n_tokens if is_prompt else 0})
+    try:
+      self.kv_blocks.reserve(request_id, past_key_values.get_seq_length() + n_tokens, self.end_session)
+    except KVCacheFullError:
+      # a request turned away doesn't leave its empty cache behind
+      if past_key_values.get_seq_length() == 0: self.end_session(request_id)
+      raise
+
+    shard_hidden_states, _, shard_logits = await self.async_forward(
+      request_id=request_id,
+      input_ids=input_ids,
+      hidden_states=hidden_states,
+      past_key_values=past_key_values,
+      tensor_parallel=tensor_parallel
     )
 
-    next_token = None
-    if shard_logits is not None:
-      next_token = await self.async_logit_sample(shard_logits)
-      input_ids = next_token
-
-    #cache
-    next_cached_logits = None
-    if next_token is not None:
-      if self.past_input_ids is not None:
-        next_cached_logits = torch.cat([self.past_input_ids, next_token], dim=-1).to(self.device)
-      elif past_iids is not None:
-        next_cached_logits = torch.cat([past_iids, next_token], dim=-1).to(self.device)
-
-      cached_iids = {
-        "input_ids": next_cached_logits.tolist() if next_cached_logits is not None else []
-      }
-
-    is_finished = False
-    if next_token is not None:
-      is_finished = next_token.item() == self.tokenizer.eos_token_id
+    if shard_logits is None:
+      if DEBUG >= 4:
+        print(f"\nshard_hidden_states: {shard_hidden_states}\n")
+      return shard_hidden_states.numpy(force=True), inference_state, False
 
+    next_token = await self.async_logit_sample(shard_logits)
+    is_finished = next_token.item() == self.tokenizer.eos_token_id
     if is_finished:
-      # clear cache
-      cached_iids = {"input_ids": []}
-
-    if DEBUG >= 4:
-      print(f"\ninput_ids: {input_ids}")
-      print(f"\nshard_hidden_states: {shard_hidden_states}\n")
-      print(f"\nshard_past_kvs {shard_past_kvs}\n")
-      print(f"\nshard_logits: {shard_logits}")
-
-    return_values = (
-      input_ids.numpy(force=True) if shard_logits is not None else shard_hidden_states.numpy(force=True),
-      json.dumps({"cached_iids": cached_iids}),
-      is_finished
-    )
+      self.end_session(request_id)
 
     if DEBUG >= 4:
-      print(f"return_values: {return_values}")
+      print(f"\nnext_token: {next_token}")
 
-    return return_values
+    return next_token.numpy(force=True), inference_state, is_finished
 
-  async def ensure_shard(self, shard: Shard):
+  async def ensure_shard(self, shard: Shard, tensor_parallel: Optional[TensorParallelContext] = None):
     """
     Ensure the model shard is loaded and ready for inference.
 
     Args:
       shard (Optional[Shard]): Shard information for the model.
+      tensor_parallel (TensorParallelContext, optional): Load only this rank's slice of every layer.
     """
-    if self.shard == shard:
+    tensor_parallel_key = tensor_parallel.key() if tensor_parallel else (0, 1)
+    if self.shard == shard and self.tensor_parallel_key == tensor_parallel_key:
       return
 
     if DEBUG >= 4:
@@ -359,6 +344,7 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
     # get model weight map
     model_wm = await get_weight_map(repo_id=shard.model_id)
 
+    self.sessions.clear()
     self.stateful_sharded_model = ShardedHuggingFaceModel(
       shard=shard,
       local_model_path=model_path,
@@ -368,9 +354,13 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
       device_map=self.device_map,
       top_k=TOP_K,
       temp=TEMP,
-      top_p=TOP_P
+      top_p=TOP_P,
+      tensor_parallel=tensor_parallel,
+      quantize=TORCH_QUANTIZE
     )
+    self.kv_blocks = KVBlockManager.from_budget(self.stateful_sharded_model.kv_bytes_per_token(self.kv_cache_quantize), self.kv_cache_budget)
     self.shard = shard
+    self.tensor_parallel_key = tensor_parallel_key
 
     self.tokenizer = await resolve_tokenizer(shard.model_id)
 
@@ -1,19 +1,26 @@
 import os
 import json
-from typing import Tuple, Optional, Union, List
+import functools
+from typing import Tuple, Optional, Callable
 from pathlib import Path
 
+import numpy as np
 import torch
 import torch.nn as nn
 
 from exo.inference.shard import Shard
+from exo.inference.tensor_parallel import TensorParallelContext, check_tensor_parallel, split_range
+from exo.inference.torch.model.quantize import quantize_model
 from exo.helpers import DEBUG
-from exo.inference.torch.utils import extract_layers
-from exo.inference.torch.model.hf_safe_tensor_shard import HFSafeTensorShard
+from exo.inference.shard_cache import shard_cache_key, find_cached_shard, save_cached_shard
+from exo.download.hf.hf_helpers import is_shard_weight
 
+from accelerate import init_empty_weights, dispatch_model, infer_auto_device_map
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
 from transformers import (
+  AutoConfig,
   AutoModelForCausalLM,
-  DynamicCache,
   Cache,
   LogitsProcessorList,
   TopKLogitsWarper,
@@ -21,9 +28,6 @@ from transformers import (
   TemperatureLogitsWarper
 )
 
-# llama
-from transformers.models.llama.modeling_llama import LlamaModel
-
 class ShardedHuggingFaceModel:
   def __init__(
     self,
@@ -36,7 +40,9 @@ class ShardedHuggingFaceModel:
     top_k: int = 25,
     temp: float = 0.7,
     top_p: float = 0.9,
-    offload_buffers: bool = True
+    offload_buffers: bool = True,
+    tensor_parallel: Optional[TensorParallelContext] = None,
+    quantize: Optional[str] = None
   ):
     """
     Initializes the ShardedHuggingFaceModel with a specified shard, model path, and device.
@@ -49,6 +55,8 @@ class ShardedHuggingFaceModel:
         top_k (int, optional): The number of top tokens to consider for sampling. Defaults to 25.
         temp (float, optional): The temperature for softmax sampling. Defaults to 0.7.
         top_p (float, optional): The cumulative probability threshold for nucleus sampling. Defaults to 0.9.
+        tensor_parallel (TensorParallelContext, optional): Keep only this rank's slice of every layer.
+        quantize (str, optional): Quantize the shard's linear layers after loading, "int8" or "int4". CPU only. Defaults to None.
     """
 
     # class vars
@@ -59,11 +67,7 @@ class ShardedHuggingFaceModel:
     self.dtype = dtype
     self.device_map = device_map
     self.offload_buffers = offload_buffers
-    self.model_safetensors_path = self.local_model_path/"model.safetensors.index.json"
-    self.safetensor_sharder = HFSafeTensorShard(
-      self.local_model_path,
-      self.shard
-    )
+    self.quantize = quantize
     # setup logit processors
     self.logits_processor = LogitsProcessorList([
       TopKLogitsWarper(top_k),
@@ -71,32 +75,46 @@ class ShardedHuggingFaceModel:
       TopPLogitsWarper(top_p)
     ])
 
+    if quantize is not None and device.type != "cpu":
+      raise ValueError(f"{quantize} quantization is only supported on the CPU, not {device}")
+
     # setup sharded llm
     try:
       self.llm_model = self.load_sharded_model()
       self.model = self.llm_model.model.to(self.device)
-
-      # restore originals for next run, if one
-      self.safetensor_sharder.restore_backups()
+      if tensor_parallel is not None and tensor_parallel.world_size > 1:
+        apply_tensor_parallel(self.model, tensor_parallel.rank, tensor_parallel.world_size, self.reduce)
+      if quantize is not None:
+        quantize_model(self.llm_model, quantize, self.shard.is_last_layer())
     except Exception as err:
       print(f"error loading and sharding model: {err}")
       raise
 
-    # forward variables
-    self.hidden_states = None
-    self.input_ids = None
-    self.inputs_embeds = None
-    self.attention_mask = None
-    self.position_embeddings = None
-    self.past_key_values = None
-    self.cache_position = None
-    self.position_ids = None
-    self.causal_mask = None
+    # set to this request's reduction over the tensor parallel group before each forward
+    self.all_reduce: Optional[Callable[[np.ndarray], np.ndarray]] = None
+
+  def kv_bytes_per_token(self, kv_cache_quantize: Optional[str] = None) -> int:
+    """
+    Bytes of keys and values a token takes in the kv cache of the shard's layers
+
+    Args:
+      kv_cache_quantize (str, optional): The cache stores a byte per value and a float32 scale per head
+    """
+    attn = self.model.layers[0].self_attn
+    head_bytes = attn.head_dim + 4 if kv_cache_quantize is not None else attn.head_dim*self.dtype.itemsize
+    return len(self.model.layers)*2*attn.num_key_value_heads*head_bytes
+
+  def reduce(self, x: torch.Tensor) -> torch.Tensor:
+    # numpy has no bfloat16, so partial sums travel as float32
+    reduced = self.all_reduce(x.detach().to(torch.float32).cpu().numpy())
+    return torch.from_numpy(reduced).to(device=x.device, dtype=x.dtype)
 
   def load_sharded_model(self) -> AutoModelForCausalLM:
     """
     Loads sharded version of model where only needed
-    weights are loaded for necessary layers
+    weights are loaded for necessary layers. The model is built
+    empty with only the shard's layers and filled with tensors read
+    from the safetensors files, which are never modified
 
     Returns:
       llm_model (AutoModelForCausalLM) - sharded llm model with only needed layers loaded
@@ -104,206 +122,157 @@ class ShardedHuggingFaceModel:
     if DEBUG >= 4:
       print("load_sharded_model called")
 
-    # modify safetensor
-    self.safetensor_sharder.modify_safetensor()
-    self.safetensor_sharder.create_safetensor_index()
-    self.safetensor_sharder.shard_safetensor_index(self.weight_map)
+    config = AutoConfig.from_pretrained(self.local_model_path, local_files_only=True)
+    config.num_hidden_layers = self.shard.get_layer_count()
+    if DEBUG >= 4:
+      print(f"config with {config.num_hidden_layers} layers")
 
-    # load model
-    try:
-      shard_num_hidden_layers = (self.shard.end_layer - self.shard.start_layer) + 1
-      if DEBUG >= 4:
-        print(f"config with {shard_num_hidden_layers} layers")
-
-      llm_model = AutoModelForCausalLM.from_pretrained(
-        pretrained_model_name_or_path=self.local_model_path,
-        device_map=self.device_map,
-        torch_dtype=self.dtype,
-        offload_buffers=self.offload_buffers,
-        local_files_only=True,
-        num_hidden_layers=shard_num_hidden_layers,
-        use_safetensors=True,
-        low_cpu_mem_usage=True
-      )
+    # parameters are left on the meta device until the shard's weights are assigned
+    with init_empty_weights():
+      llm_model = AutoModelForCausalLM.from_config(config, torch_dtype=self.dtype)
 
-      # restore backup for next run
-      self.safetensor_sharder.restore_backups()
+    state_dict = self.load_shard_weights(config.tie_word_embeddings)
 
-      if self.device_map == "auto":
-        return llm_model
-      else:
-        return llm_model.to(self.device)
+    # the embeddings or head of other shards aren't read, they only need to exist
+    for name, param in llm_model.named_parameters():
+      if name not in state_dict:
+        state_dict[name] = torch.empty(param.shape, dtype=self.dtype)
 
-    except Exception as err:
-      print(f"err: {err}")
-      raise
+    llm_model.load_state_dict(state_dict, strict=False, assign=True)
+    llm_model.tie_weights()
+    llm_model.eval()
+
+    if self.device_map == "auto":
+      return dispatch_model(llm_model, device_map=infer_auto_device_map(llm_model))
+    else:
+      return llm_model.to(self.device)
+
+  def load_shard_weights(self, tied_embeddings: bool = False) -> dict:
+    """
+    Reads the shard's tensors, renumbered from the shard's first layer and
+    cast to the model dtype, from the shard cache or else from the model's
+    safetensors files
+
+    Args:
+      tied_embeddings (bool): The head shares the embedding weights, so the last shard needs them
+
+    Returns:
+      state_dict (dict) - tensors of the shard by name in the sharded model
+    """
+    key = shard_cache_key(self.local_model_path, self.shard, "torch", str(self.dtype))
+    cached = find_cached_shard(self.shard.model_id, "torch", key)
+    if cached is not None:
+      if DEBUG >= 2:
+        print(f"Loading weights for {self.shard} from {cached}")
+      return load_file(cached)
+
+    state_dict = {}
+    for safetensors_path in sorted(self.local_model_path.glob("*.safetensors")):
+      with safe_open(safetensors_path, framework="pt") as f:
+        for name in f.keys():
+          if not is_shard_weight(name, self.shard, tied_embeddings):
+            continue
+
+          parts = name.split(".")
+          if "layers" in parts:
+            layer_idx = parts.index("layers") + 1
+            parts[layer_idx] = str(int(parts[layer_idx]) - self.shard.start_layer)
+
+          state_dict[".".join(parts)] = f.get_tensor(name).to(self.dtype)
+
+    save_cached_shard(self.shard.model_id, "torch", key, functools.partial(save_file, state_dict))
+    return state_dict
 
   def forward(
     self,
     input_ids: Optional[torch.Tensor] = None,
     hidden_states: Optional[torch.Tensor] = None,
-    attention_mask: Optional[torch.Tensor] = None,
-    past_key_values: Optional[Union[Cache, List[torch.FloatTensor]]] = None,
-    use_legacy_cache: bool = False
-  ) -> Tuple[Optional[torch.Tensor], Optional[Union[Cache, List[torch.FloatTensor]]], Optional[torch.Tensor]]:
+    past_key_values: Optional[Cache] = None,
+    all_logits: bool = False
+  ) -> Tuple[Optional[torch.Tensor], Optional[Cache], Optional[torch.Tensor]]:
     """
-    Performs a forward pass through the model shard, computing hidden states, past key values, and logits.
+    Performs a forward pass through the model shard for the tokens or hidden states
+    not seen yet, attending to earlier ones through past_key_values
 
     Args:
-        input_ids (torch.Tensor, optional): The input token IDs for the model. Either input_ids or hidden_states must be provided.
-        hidden_states (torch.Tensor, optional): The hidden states of the model at the current layer.
-        attention_mask (torch.Tensor, optional): The attention mask to prevent attending to padding tokens.
-        past_key_values (Union[Cache, List[torch.FloatTensor]], optional): Cached past key values for fast autoregressive generation.
-        use_legacy_cache (bool, optional): Whether to use the legacy cache format for past key values. Defaults to False.
+        input_ids (torch.Tensor, optional): The new token IDs, on the first shard. Either input_ids or hidden_states must be provided.
+        hidden_states (torch.Tensor, optional): The hidden states of the new tokens from the previous shard.
+        past_key_values (Cache, optional): This request's keys and values for the shard's layers, updated in place.
+        all_logits (bool, optional): Return the logits of every position, instead of only the last one that is sampled. Defaults to False.
 
     Returns:
         Tuple:
-            - hidden_states (torch.Tensor, optional): The hidden states after the forward pass.
-            - past_key_values (Union[Cache, List[torch.FloatTensor]], optional): The updated past key values.
-            - logits (torch.Tensor, optional): The logits produced by the model if the last layer is processed.
+            - hidden_states (torch.Tensor, optional): The hidden states after the forward pass, if this isn't the last shard.
+            - past_key_values (Cache, optional): The updated past key values.
+            - logits (torch.Tensor, optional): The logits produced by the model if the last layer is processed, of shape (batch, 1, vocab) unless all_logits.
     """
-    model_inputs = None
-    self.hidden_states = hidden_states
-    self.input_ids = input_ids
-
-    # if there is hidden states and no position_ids, will need to be calculated
-    # this is not needed for Qwen model but Llama requires it
-
-    # embed input_ids
-    self.inputs_embeds = self.model.embed_tokens(self.input_ids)
-
-    # cache
-    if past_key_values and not isinstance(past_key_values, Cache):
-      use_legacy_cache = True
-      past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+    if hidden_states is None:
+      hidden_states = self.model.embed_tokens(input_ids)
 
     past_seen_tokens = past_key_values.get_seq_length() if past_key_values is not None else 0
     cache_position = torch.arange(
       past_seen_tokens,
-      past_seen_tokens + self.inputs_embeds.shape[1],
-      device=self.inputs_embeds.device
+      past_seen_tokens + hidden_states.shape[1],
+      device=hidden_states.device
+    )
+    position_ids = cache_position.unsqueeze(0)
+
+    causal_mask = self.model._update_causal_mask(
+      None,
+      hidden_states,
+      cache_position,
+      past_key_values,
+      False # dont out attentions
     )
 
-    # position id
-    self.position_ids = cache_position.unsqueeze(0)
+    # embed positions, some models require and some dont
+    layer_kwargs = {}
+    if hasattr(self.model, "rotary_emb"):
+      layer_kwargs["position_embeddings"] = self.model.rotary_emb(hidden_states, position_ids)
 
     if DEBUG >= 4:
       print("hf forward called")
-      print(f"hidden_states: {self.hidden_states}")
-      print(f"input_ids: {self.input_ids}")
-      print(f"input_embeds: {self.inputs_embeds}")
-      print(f"position_ids: {self.position_ids}")
-      print(f"past_key_values: {past_key_values}")
-
-    if self.hidden_states is None:
-      # casual mask and attention_mask
-      self.attention_mask = attention_mask
-      self.causal_mask = self.model._update_causal_mask(
-        None,
-        self.inputs_embeds,
-        cache_position,
-        past_key_values,
-        False # dont out attentions
-      )
-
-      # embed positions, some models require and some dont
-      if isinstance(self.model, LlamaModel):
-        self.position_embeddings = self.model.rotary_emb(
-          self.inputs_embeds,
-          self.position_ids
-        )
-
-      # prepare inputs for decoder layers
-      model_inputs = self.llm_model.prepare_inputs_for_generation(
-        self.input_ids,
-        past_key_values=past_key_values,
-        attention_mask=self.attention_mask,
-        inputs_embeds=self.inputs_embeds,
-        position_ids=self.position_ids,
-        cache_position=cache_position
-      )
-
-      self.hidden_states = self.inputs_embeds
-      self.position_ids = model_inputs["position_ids"]
-      self.cache_position = model_inputs["cache_position"]
-      self.past_key_values = model_inputs["past_key_values"]
+      print(f"hidden_states: {hidden_states}")
+      print(f"input_ids: {input_ids}")
+      print(f"position_ids: {position_ids}")
+      print(f"past_seen_tokens: {past_seen_tokens}")
 
-      if DEBUG >= 4:
-        print(f"model_inputs: {model_inputs}")
-
-    # run through decoder layers
-    layer_amt = range(self.shard.end_layer - self.shard.start_layer)
-
-    if DEBUG >= 4:
-      print(f"hidden_states: {self.hidden_states}")
-      print(f"model layer amt: {len(self.model.layers)}")
-      print(f"layer_amt: {layer_amt}")
-
-    for i in layer_amt:
-      decoder_layer = self.model.layers[i]
-      if DEBUG >= 5:
-        print(f"layer #{i}")
-        print("decoder_layer before")
-        print(f"decoder_layer: {decoder_layer}")
-        print(f"hidden_states: {self.hidden_states}")
-        print(f"position_ids: {self.position_ids}")
-        print(f"position_embeddings: {self.position_embeddings}")
-
-      # TODO: fix caching as decoder layer is not returning
-      # present_key_value from attention layer on models
-      # might have some other generation functions needed to do it
-      # see https://github.com/huggingface/transformers/blob/main/src/transformers/generation/utils.py#L2917
-      # for qwen2 exhttps://github.com/huggingface/transformers/blob/main/src/transformers/models/qwen2/modeling_qwen2.py#L291
+    # the sharded model only holds the shard's layers
+    for decoder_layer in self.model.layers:
       layer_outputs = decoder_layer(
-        self.hidden_states,
-        attention_mask=self.causal_mask,
-        position_ids=self.position_ids,
-        past_key_values=self.past_key_values,
-        use_cache=True,
-        cache_position=self.cache_position
+        hidden_states,
+        attention_mask=causal_mask,
+        position_ids=position_ids,
+        past_key_value=past_key_values,
+        use_cache=past_key_values is not None,
+        cache_position=cache_position,
+        **layer_kwargs
       )
+      hidden_states = layer_outputs[0]
 
-      self.hidden_states = layer_outputs[0]
-      self.next_decoder_cache = layer_outputs[1]
-
-      if DEBUG >= 5:
-        print("decoder_layer after")
-        print(f"layer_outputs: {layer_outputs}\n")
-        print(f"self.next_decoder_cache: {self.next_decoder_cache}")
-        print(f"hidden_states: {self.hidden_states}")
-        print(f"next_decoder_cache: {self.next_decoder_cache}")
-
-    # handle last layer to get logits
-    # shard is last layer says true at the start and not detecting last layer correctly
     if self.shard.is_last_layer():
-      self.hidden_states = self.model.norm(self.hidden_states)
-      if use_legacy_cache:
-        self.past_key_values = self.next_decoder_cache.to_legacy_cache()
-      else:
-        self.past_key_values = self.next_decoder_cache
-
-      # lm_head
-      logits = self.llm_model.lm_head(self.hidden_states).to(self.device)
+      # a prompt's other positions would only be projected onto the vocabulary to be thrown away
+      if not all_logits:
+        hidden_states = hidden_states[:, -1:, :]
+      hidden_states = self.model.norm(hidden_states)
+      logits = self.llm_model.lm_head(hidden_states).to(self.device)
 
       if DEBUG >= 4:
         print(f"logits: {logits}")
 
       return (
         None,
-        None,
+        past_key_values,
         logits
       )
 
     if DEBUG >= 4:
       print("hf out [no logit]")
-      print(f"hidden_states: {self.hidden_states}")
-      print(f"past_key_values: {self.past_key_values}")
-      print(f"position_ids: {self.position_ids}")
-      print(f"input_ids: {self.input_ids}")
+      print(f"hidden_states: {hidden_states}")
 
     return (
-      self.hidden_states,
-      self.past_key_values,
+      hidden_states,
+      past_key_values,
       None
     )
 
@@ -326,7 +295,7 @@ class ShardedHuggingFaceModel:
     # get a single cloned logit
     logits = logits[:, -1, :].clone().float()
 
-    next_token_scores = self.logits_processor(self.input_ids, logits)
+    next_token_scores = self.logits_processor(None, logits)
 
     if not use_max:
       probs = nn.functional.softmax(next_token_scores, dim=-1)
@@ -335,7 +304,42 @@ class ShardedHuggingFaceModel:
       next_token = torch.argmax(next_token_scores, dim=-1)
 
     if DEBUG >= 4:
-      print(f"input_ids: {self.input_ids}")
       print(f"next_token: {next_token}")
 
     return next_token[:, None].squeeze(-1)
+
+
+def apply_tensor_parallel(model: nn.Module, rank: int, world_size: int, all_reduce: Callable[[torch.Tensor], torch.Tensor]) -> None:
+  """
+  Cuts every decoder layer of a llama style model down to this rank's attention heads and MLP columns, and sums the
+  partial attention and MLP outputs over the tensor parallel group. See exo/inference/tensor_parallel.py.
+  """
+  def keep_rows(linear: nn.Linear, start: int, end: int):
+    linear.weight = nn.Parameter(linear.weight.data[start:end].clone(), requires_grad=False)
+    linear.out_features = end - start
+
+  def keep_columns(linear: nn.Linear, start: int, end: int):
+    linear.weight = nn.Parameter(linear.weight.data[:, start:end].clone(), requires_grad=False)
+    linear.in_features = end - start
+
+  def reduce_output(module, inputs, output):
+    return all_reduce(output)
+
+  for layer in model.layers:
+    attn, mlp = layer.self_attn, layer.mlp
+    check_tensor_parallel(attn.num_heads, attn.num_key_value_heads, mlp.gate_proj.out_features, world_size)
+    q_start, q_end = split_range(attn.num_heads*attn.head_dim, rank, world_size)
+    kv_start, kv_end = split_range(attn.num_key_value_heads*attn.head_dim, rank, world_size)
+    keep_rows(attn.q_proj, q_start, q_end)
+    keep_rows(attn.k_proj, kv_start, kv_end)
+    keep_rows(attn.v_proj, kv_start, kv_end)
+    keep_columns(attn.o_proj, q_start, q_end)
+    attn.num_heads //= world_size
+    attn.num_key_value_heads //= world_size
+    attn.o_proj.register_forward_hook(reduce_output)
+
+    mlp_start, mlp_end = split_range(mlp.gate_proj.out_features, rank, world_size)
+    keep_rows(mlp.gate_proj, mlp_start, mlp_end)
+    keep_rows(mlp.up_proj, mlp_start, mlp_end)
+    keep_columns(mlp.down_proj, mlp_start, mlp_end)
+    mlp.down_proj.register_forward_hook(reduce_output)
@@ -0,0 +1,100 @@
+"""
+Quantized linear layers for the torch engine on CPU, applied to a shard's
+layers once its weights are loaded
+"""
+from typing import Iterator, Tuple
+
+import torch
+import torch.nn as nn
+
+from exo.helpers import DEBUG
+
+QUANTIZE_MODES = ("int8", "int4")
+
+class Int4Linear(nn.Module):
+  """
+  Weight only int4 linear layer. Every group_size weights along a row share a
+  scale and offset. The CPU kernel is only fast for bfloat16 activations, so
+  inputs are cast to bfloat16 and outputs back to the model dtype
+  """
+  def __init__(self, linear: nn.Linear, group_size: int = 32):
+    super().__init__()
+    self.in_features = linear.in_features
+    self.out_features = linear.out_features
+    self.group_size = group_size
+    self.bias = linear.bias
+
+    weight = linear.weight.detach().float().reshape(self.out_features, -1, group_size)
+    min_val, max_val = weight.amin(-1, keepdim=True), weight.amax(-1, keepdim=True)
+    scales = (max_val - min_val).clamp(min=1e-6)/15
+    q = ((weight - min_val)/scales).round().clamp(0, 15).to(torch.int32).reshape(self.out_features, -1)
+    # the kernel dequantizes (q - 8)*scale + zero
+    zeros = min_val + 8*scales
+    self.register_buffer("weight_packed", torch._convert_weight_to_int4pack(q, inner_k_tiles(self.in_features)))
+    self.register_buffer("scales_and_zeros", torch.cat([scales, zeros], -1).transpose(0, 1).contiguous().to(torch.bfloat16))
+
+  @staticmethod
+  def supports(linear: nn.Linear, group_size: int = 32) -> bool:
+    return linear.out_features % 16 == 0 and linear.in_features % group_size == 0 and inner_k_tiles(linear.in_features) > 0
+
+  def forward(self, x: torch.Tensor) -> torch.Tensor:
+    out = torch._weight_int4pack_mm(
+      x.reshape(-1, self.in_features).to(self.scales_and_zeros.dtype),
+      self.weight_packed,
+      self.group_size,
+      self.scales_and_zeros
+    ).reshape(*x.shape[:-1], self.out_features).to(x.dtype)
+    if self.bias is not None:
+      out = out + self.bias
+    return out
+
+  def extra_repr(self) -> str:
+    return f"in_features={self.in_features}, out_features={self.out_features}, group_size={self.group_size}, bias={self.bias is not None}"
+
+def inner_k_tiles(in_features: int) -> int:
+  # the packed layout tiles the input dimension in multiples of 16, the more tiles the faster
+  return next((tiles for tiles in (8, 4, 2) if in_features % (tiles*16) == 0), 0)
+
+def shard_linears(llm_model: nn.Module, include_head: bool) -> Iterator[Tuple[str, nn.Linear]]:
+  """
+  The linear layers of the shard's decoder layers, and the head on the last shard.
+  The other shards' head only exists for its shape and isn't quantized
+  """
+  for name, module in llm_model.named_modules():
+    if isinstance(module, nn.Linear) and (name.startswith("model.layers.") or (include_head and name == "lm_head")):
+      yield name, module
+
+def quantize_model(llm_model: nn.Module, mode: str, include_head: bool, group_size: int = 32) -> nn.Module:
+  """
+  Swaps the shard's linear layers for quantized ones in place
+
+  Args:
+    llm_model (nn.Module): The loaded causal lm, on the CPU
+    mode (str): "int8" for dynamically quantized int8 matmuls, "int4" for int4 weights with group scales
+    include_head (bool): Quantize lm_head too, on the last shard
+    group_size (int): Weights along a row sharing an int4 scale
+
+  Returns:
+    llm_model (nn.Module) - the same model with quantized layers
+  """
+  if mode not in QUANTIZE_MODES:
+    raise ValueError(f"Unsupported quantization {mode!r}, expected one of {', '.join(QUANTIZE_MODES)}")
+
+  linears = list(shard_linears(llm_model, include_head))
+  if mode == "int8":
+    # activations are quantized on the fly per call, only float32 linears are supported
+    if any(linear.weight.dtype != torch.float32 for _, linear in linears):
+      raise ValueError("int8 quantization needs a float32 model")
+    return torch.ao.quantization.quantize_dynamic(llm_model, {name: torch.ao.quantization.default_dynamic_qconfig for name, _ in linears}, dtype=torch.qint8, inplace=True)
+
+  for name, linear in linears:
+    if not Int4Linear.supports(linear, group_size):
+      if DEBUG >= 2:
+        print(f"Keeping {name} unquantized, its shape {tuple(linear.weight.shape)} doesn't fit int4 groups of {group_size}")
+      continue
+    quantized = Int4Linear(linear, group_size)
+    # keep tensor parallel reductions hooked to the layer
+    quantized._forward_hooks.update(linear._forward_hooks)
+    parent_name, _, child_name = name.rpartition(".")
+    setattr(llm_model.get_submodule(parent_name), child_name, quantized)
+  return llm_model
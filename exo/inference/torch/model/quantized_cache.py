@@ -0,0 +1,72 @@
+"""
+Quantized kv cache for the torch engine. Keys and values are stored in
+int8 or fp8 with a float32 scale per token and head, and dequantized to
+the model dtype for attention
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+KV_CACHE_QUANTIZE_MODES = ("int8", "fp8")
+
+def quantize_kv(x: torch.Tensor, mode: str) -> Tuple[torch.Tensor, torch.Tensor]:
+  """
+  Quantizes keys or values of shape (batch, heads, seq, head_dim) along head_dim
+
+  Returns:
+    values (torch.Tensor) - int8, or fp8 viewed as uint8 since the CPU can't concatenate fp8
+    scales (torch.Tensor) - float32 of shape (batch, heads, seq, 1)
+  """
+  x = x.float()
+  max_val = 127 if mode == "int8" else torch.finfo(torch.float8_e4m3fn).max
+  scales = x.abs().amax(-1, keepdim=True).clamp(min=1e-8)/max_val
+  if mode == "int8":
+    return (x/scales).round().clamp(-127, 127).to(torch.int8), scales
+  return (x/scales).to(torch.float8_e4m3fn).view(torch.uint8), scales
+
+def dequantize_kv(values: torch.Tensor, scales: torch.Tensor, mode: str, dtype: torch.dtype) -> torch.Tensor:
+  if mode == "fp8":
+    values = values.view(torch.float8_e4m3fn)
+  return (values.float()*scales).to(dtype)
+
+class QuantizedDynamicCache(DynamicCache):
+  """
+  A DynamicCache holding quantized keys and values. Each update returns the
+  layer's whole cache dequantized, the new tokens included
+  """
+  def __init__(self, mode: str = "int8"):
+    if mode not in KV_CACHE_QUANTIZE_MODES:
+      raise ValueError(f"Unsupported kv cache quantization {mode!r}, expected one of {', '.join(KV_CACHE_QUANTIZE_MODES)}")
+    super().__init__()
+    self.mode = mode
+    self.key_scales: List[torch.Tensor] = []
+    self.value_scales: List[torch.Tensor] = []
+
+  def update(
+    self,
+    key_states: torch.Tensor,
+    value_states: torch.Tensor,
+    layer_idx: int,
+    cache_kwargs: Optional[Dict[str, Any]] = None
+  ) -> Tuple[torch.Tensor, torch.Tensor]:
+    if layer_idx == 0:
+      self._seen_tokens += key_states.shape[-2]
+
+    keys, key_scales = quantize_kv(key_states, self.mode)
+    values, value_scales = quantize_kv(value_states, self.mode)
+    if len(self.key_cache) <= layer_idx:
+      self.key_cache.append(keys)
+      self.value_cache.append(values)
+      self.key_scales.append(key_scales)
+      self.value_scales.append(value_scales)
+    else:
+      self.key_cache[layer_idx] = torch.cat([self.key_cache[layer_idx], keys], dim=-2)
+      self.value_cache[layer_idx] = torch.cat([self.value_cache[layer_idx], values], dim=-2)
+      self.key_scales[layer_idx] = torch.cat([self.key_scales[layer_idx], key_scales], dim=-2)
+      self.value_scales[layer_idx] = torch.cat([self.value_scales[layer_idx], value_scales], dim=-2)
+
+    return (
+      dequantize_kv(self.key_cache[layer_idx], self.key_scales[layer_idx], self.mode, key_states.dtype),
+      dequantize_kv(self.value_cache[layer_idx], self.value_scales[layer_idx], self.mode, value_states.dtype)
+    )
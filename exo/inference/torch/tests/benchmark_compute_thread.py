@@ -0,0 +1,73 @@
+"""
+Per token overhead of running the forward pass and sampling on a new thread pool
+for every call, as the engine used to, against its one long lived compute thread
+
+  python -m exo.inference.torch.tests.benchmark_compute_thread [--tokens 200] [--threads 4] [--cpus 0-3]
+"""
+import argparse
+import asyncio
+import functools
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import torch
+from transformers import DynamicCache, LlamaConfig, LlamaForCausalLM
+
+from exo.inference.shard import Shard
+from exo.inference.torch.model.hf import ShardedHuggingFaceModel
+from exo.inference.torch.utils import parse_cpu_list, setup_compute_thread
+
+N_LAYERS = 4
+
+async def decode(model: ShardedHuggingFaceModel, n_tokens: int, run) -> float:
+  """
+  Returns seconds per token of greedy decoding, with run(fn) doing the work off the event loop
+  """
+  cache = DynamicCache()
+  _, _, logits = await run(functools.partial(model.forward, input_ids=torch.tensor([[1, 2, 3, 4]]), past_key_values=cache))
+  times = []
+  for _ in range(n_tokens):
+    start = time.perf_counter()
+    token = await run(functools.partial(model.logits_sample, logits, use_max=True))
+    _, _, logits = await run(functools.partial(model.forward, input_ids=token[:, None], past_key_values=cache))
+    times.append(time.perf_counter() - start)
+  return statistics.median(times)
+
+async def main(args):
+  torch.manual_seed(0)
+  config = LlamaConfig(hidden_size=256, intermediate_size=688, num_attention_heads=8, num_key_value_heads=4, num_hidden_layers=N_LAYERS, vocab_size=1000)
+  with tempfile.TemporaryDirectory() as model_dir:
+    LlamaForCausalLM(config).save_pretrained(model_dir)
+    model = ShardedHuggingFaceModel(Shard("bench", 0, N_LAYERS - 1, N_LAYERS), Path(model_dir), None, torch.device("cpu"), torch.float32, "cpu")
+  loop = asyncio.get_running_loop()
+
+  async def per_call_pool(fn):
+    with ThreadPoolExecutor() as pool:
+      return await loop.run_in_executor(pool, fn)
+
+  executor = ThreadPoolExecutor(max_workers=1, initializer=functools.partial(setup_compute_thread, args.threads, None, parse_cpu_list(args.cpus) if args.cpus else None))
+  async def compute_thread(fn):
+    return await loop.run_in_executor(executor, fn)
+
+  # alternate so neither side gets a warmer cache or a quieter host
+  before, after = [], []
+  for _ in range(args.rounds):
+    before.append(await decode(model, args.tokens, per_call_pool))
+    after.append(await decode(model, args.tokens, compute_thread))
+  executor.shutdown()
+
+  before, after = statistics.median(before)*1e3, statistics.median(after)*1e3
+  print(f"new pool per call:   {before:.3f} ms/token")
+  print(f"long lived thread:   {after:.3f} ms/token")
+  print(f"saved:               {before - after:.3f} ms/token ({(before - after)/before:.1%})")
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--tokens", type=int, default=200)
+  parser.add_argument("--rounds", type=int, default=3)
+  parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads of the compute thread")
+  parser.add_argument("--cpus", type=str, default=None, help="CPUs to pin the compute thread to, e.g. 0-3")
+  asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+"""
+Decode throughput and weight memory of a llama shard in float32 and with each
+quantization mode of the torch engine
+
+  python -m exo.inference.torch.tests.benchmark_quantize [--tokens 64] [--hidden 1024] [--layers 8]
+"""
+import argparse
+import io
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+from transformers import DynamicCache, LlamaConfig, LlamaForCausalLM
+
+from exo.inference.shard import Shard
+from exo.inference.torch.model.hf import ShardedHuggingFaceModel
+from exo.inference.torch.model.quantize import QUANTIZE_MODES
+
+def weight_bytes(model: torch.nn.Module) -> int:
+  # packed quantized weights only show up in the serialized state dict
+  buffer = io.BytesIO()
+  torch.save(model.model.layers.state_dict(), buffer)
+  return buffer.tell()
+
+def decode(model: ShardedHuggingFaceModel, n_tokens: int) -> float:
+  """
+  Returns seconds per token of greedy decoding after a short prompt
+  """
+  cache = DynamicCache()
+  _, _, logits = model.forward(input_ids=torch.tensor([[1, 2, 3, 4]]), past_key_values=cache)
+  times = []
+  for _ in range(n_tokens):
+    start = time.perf_counter()
+    token = model.logits_sample(logits, use_max=True)
+    _, _, logits = model.forward(input_ids=token[:, None], past_key_values=cache)
+    times.append(time.perf_counter() - start)
+  return statistics.median(times)
+
+def main(args):
+  torch.set_grad_enabled(False)
+  torch.manual_seed(0)
+  config = LlamaConfig(
+    hidden_size=args.hidden,
+    intermediate_size=args.hidden*4,
+    num_attention_heads=args.hidden//64,
+    num_key_value_heads=args.hidden//256,
+    num_hidden_layers=args.layers,
+    vocab_size=32000
+  )
+  shard = Shard("bench", 0, args.layers - 1, args.layers)
+  with tempfile.TemporaryDirectory() as model_dir:
+    LlamaForCausalLM(config).save_pretrained(model_dir)
+    baseline = None
+    for quantize in (None, *QUANTIZE_MODES):
+      model = ShardedHuggingFaceModel(shard, Path(model_dir), None, torch.device("cpu"), torch.float32, "cpu", quantize=quantize)
+      seconds = decode(model, args.tokens)
+      baseline = baseline or seconds
+      print(f"{quantize or 'float32':>8}: {1/seconds:8.1f} tok/s ({baseline/seconds:.2f}x), layer weights {weight_bytes(model)/2**20:8.1f} MiB")
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--tokens", type=int, default=64)
+  parser.add_argument("--hidden", type=int, default=1024)
+  parser.add_argument("--layers", type=int, default=8)
+  main(parser.parse_args())
@@ -0,0 +1,38 @@
+"""
+Setting up the torch engine's compute thread
+"""
+import os
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import torch
+
+from exo.inference.torch.utils import parse_cpu_list, setup_compute_thread
+
+
+class TestComputeThread(unittest.TestCase):
+  def test_parse_cpu_list(self):
+    self.assertEqual(parse_cpu_list("0-3,8, 10-11"), [0, 1, 2, 3, 8, 10, 11])
+    self.assertEqual(parse_cpu_list("5,2,2"), [2, 5])
+    for spec in ("", "3-1", "a"):
+      with self.assertRaises(ValueError):
+        parse_cpu_list(spec)
+
+  def test_setup_runs_once_on_the_compute_thread(self):
+    threads = torch.get_num_threads()
+    self.addCleanup(torch.set_num_threads, threads)
+    cpus = sorted(os.sched_getaffinity(0))[:1] if hasattr(os, "sched_getaffinity") else None
+    with ThreadPoolExecutor(max_workers=1, initializer=partial(setup_compute_thread, 1, None, cpus)) as executor:
+      def state():
+        return threading.get_ident(), torch.is_grad_enabled(), torch.get_num_threads(), sorted(os.sched_getaffinity(0)) if cpus else None
+      first, second = executor.submit(state).result(), executor.submit(state).result()
+    self.assertEqual(first, second)
+    self.assertEqual(first[1:], (False, 1, cpus))
+    # grad mode is per thread, the caller's is untouched
+    self.assertTrue(torch.is_grad_enabled())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,84 @@
+"""
+Accuracy of the torch engine's quantized shards against the float model
+"""
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import torch
+import torch.nn as nn
+from transformers import DynamicCache, LlamaConfig, LlamaForCausalLM
+
+from exo.inference.shard import Shard
+from exo.inference.torch.model.hf import ShardedHuggingFaceModel
+from exo.inference.torch.model.quantize import Int4Linear, quantize_model
+
+N_LAYERS = 2
+PROMPT = torch.tensor([[3, 14, 15, 9, 26, 5, 35]])
+
+
+def similarity(a: torch.Tensor, b: torch.Tensor) -> float:
+  return nn.functional.cosine_similarity(a.flatten().float(), b.flatten().float(), dim=0).item()
+
+
+class TestQuantize(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.dir.cleanup)
+    patcher = mock.patch.dict(os.environ, {"EXO_HOME": str(Path(self.dir.name)/"exo")})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    torch.manual_seed(0)
+    # every linear fits int4 groups except the head, whose 40 rows don't tile
+    config = LlamaConfig(hidden_size=64, intermediate_size=128, num_attention_heads=4, num_key_value_heads=2, num_hidden_layers=N_LAYERS, vocab_size=40, tie_word_embeddings=False)
+    self.model_path = Path(self.dir.name)/"model"
+    LlamaForCausalLM(config).save_pretrained(self.model_path)
+
+  def load(self, shard: Shard, quantize=None) -> ShardedHuggingFaceModel:
+    return ShardedHuggingFaceModel(shard, self.model_path, None, torch.device("cpu"), torch.float32, "cpu", quantize=quantize)
+
+  def logits(self, model: ShardedHuggingFaceModel) -> torch.Tensor:
+    with torch.no_grad():
+      return model.forward(input_ids=PROMPT, past_key_values=DynamicCache(), all_logits=True)[2]
+
+  def test_quantized_logits_match_float(self):
+    shard = Shard("model", 0, N_LAYERS - 1, N_LAYERS)
+    expected = self.logits(self.load(shard))
+    for quantize, min_similarity in (("int8", 0.999), ("int4", 0.99)):
+      with self.subTest(quantize=quantize):
+        model = self.load(shard, quantize)
+        self.assertEqual(self.logits(model).shape, expected.shape)
+        self.assertGreater(similarity(self.logits(model), expected), min_similarity)
+
+  def test_int4_layers(self):
+    model = self.load(Shard("model", 0, N_LAYERS - 1, N_LAYERS), "int4")
+    self.assertIsInstance(model.model.layers[0].self_attn.k_proj, Int4Linear)
+    self.assertIsInstance(model.model.layers[1].mlp.down_proj, Int4Linear)
+    self.assertIsInstance(model.llm_model.lm_head, nn.Linear)
+
+  def test_first_shard_head_is_left_alone(self):
+    model = self.load(Shard("model", 0, 0, N_LAYERS), "int8")
+    self.assertIsInstance(model.llm_model.lm_head, nn.Linear)
+    self.assertNotIsInstance(model.model.layers[0].mlp.up_proj, nn.Linear)
+
+  def test_forward_hooks_are_kept(self):
+    for quantize in ("int8", "int4"):
+      model = nn.Module()
+      model.model = nn.Module()
+      model.model.layers = nn.Sequential(nn.Linear(64, 32))
+      # like the tensor parallel all-reduce
+      model.model.layers[0].register_forward_hook(lambda module, inputs, output: output*0)
+      quantize_model(model, quantize, include_head=False)
+      self.assertNotIsInstance(model.model.layers[0], nn.Linear)
+      self.assertEqual(model.model.layers(torch.randn(2, 64)).abs().sum().item(), 0)
+
+  def test_rejects_unknown_mode(self):
+    with self.assertRaises(ValueError):
+      quantize_model(nn.Module(), "int2", include_head=False)
+
+
+if __name__ == "__main__":
+  unittest.main()
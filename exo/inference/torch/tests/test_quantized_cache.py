@@ -0,0 +1,74 @@
+"""
+Perplexity and memory of the torch engine's quantized kv caches against the float cache
+"""
+import math
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import torch
+import torch.nn as nn
+from transformers import DynamicCache, LlamaConfig, LlamaForCausalLM
+
+from exo.inference.shard import Shard
+from exo.inference.torch.model.hf import ShardedHuggingFaceModel
+from exo.inference.torch.model.quantized_cache import QuantizedDynamicCache
+
+N_LAYERS = 2
+TOKENS = [3, 14, 15, 9, 26, 5, 35, 8, 9, 7, 9, 32, 38, 4, 6, 26, 4, 33, 8, 32]
+PROMPT_LENGTH = 4
+
+
+def cache_bytes(cache: DynamicCache) -> int:
+  tensors = cache.key_cache + cache.value_cache + getattr(cache, "key_scales", []) + getattr(cache, "value_scales", [])
+  return sum(t.numel()*t.element_size() for t in tensors)
+
+
+class TestQuantizedCache(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.dir.cleanup)
+    patcher = mock.patch.dict(os.environ, {"EXO_HOME": str(Path(self.dir.name)/"exo")})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    torch.manual_seed(0)
+    config = LlamaConfig(hidden_size=64, intermediate_size=128, num_attention_heads=4, num_key_value_heads=2, num_hidden_layers=N_LAYERS, vocab_size=40, tie_word_embeddings=False)
+    model_path = Path(self.dir.name)/"model"
+    LlamaForCausalLM(config).save_pretrained(model_path)
+    self.model = ShardedHuggingFaceModel(Shard("model", 0, N_LAYERS - 1, N_LAYERS), model_path, None, torch.device("cpu"), torch.float32, "cpu")
+
+  def decode(self, cache: DynamicCache) -> torch.Tensor:
+    # the prompt in one pass, then a token at a time so attention reads the cached keys and values
+    with torch.no_grad():
+      logits = [self.model.forward(input_ids=torch.tensor([TOKENS[:PROMPT_LENGTH]]), past_key_values=cache, all_logits=True)[2]]
+      for token in TOKENS[PROMPT_LENGTH:-1]:
+        logits.append(self.model.forward(input_ids=torch.tensor([[token]]), past_key_values=cache)[2])
+    return torch.cat(logits, dim=1)[0]
+
+  def perplexity(self, logits: torch.Tensor) -> float:
+    return math.exp(nn.functional.cross_entropy(logits, torch.tensor(TOKENS[1:])).item())
+
+  def test_perplexity_matches_float_cache(self):
+    cache = DynamicCache()
+    expected = self.decode(cache)
+    for mode, tolerance, min_similarity in (("int8", 0.001, 0.9999), ("fp8", 0.005, 0.999)):
+      with self.subTest(mode=mode):
+        quantized_cache = QuantizedDynamicCache(mode)
+        logits = self.decode(quantized_cache)
+        self.assertEqual(quantized_cache.get_seq_length(), len(TOKENS) - 1)
+        self.assertLess(abs(self.perplexity(logits)/self.perplexity(expected) - 1), tolerance)
+        self.assertGreater(nn.functional.cosine_similarity(logits.flatten(), expected.flatten(), dim=0).item(), min_similarity)
+        # a byte per value and a float32 scale per head of 16 values, against float32 values
+        self.assertEqual(cache_bytes(quantized_cache)*64, cache_bytes(cache)*20)
+        self.assertEqual(self.model.kv_bytes_per_token(mode)*64, self.model.kv_bytes_per_token()*20)
+
+  def test_rejects_unknown_mode(self):
+    with self.assertRaises(ValueError):
+      QuantizedDynamicCache("int4")
+
+
+if __name__ == "__main__":
+  unittest.main()
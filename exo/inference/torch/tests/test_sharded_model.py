@@ -0,0 +1,163 @@
+"""
+Loading a shard of a model saved in the huggingface format
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import torch
+from transformers import DynamicCache, LlamaConfig, LlamaForCausalLM
+
+from exo.inference.kv_blocks import IDLE_TIMEOUT, KVBlockManager, KVCacheFullError
+from exo.inference.shard import Shard
+from exo.inference.torch.inference import TorchDynamicShardInferenceEngine
+from exo.inference.torch.model.hf import ShardedHuggingFaceModel
+
+N_LAYERS = 4
+
+
+def file_hashes(path: Path) -> dict:
+  return {p.name: hashlib.sha256(p.read_bytes()).hexdigest() for p in sorted(path.iterdir())}
+
+
+class TestShardedModel(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.dir.cleanup)
+    patcher = mock.patch.dict(os.environ, {"EXO_HOME": str(Path(self.dir.name)/"exo")})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    torch.manual_seed(0)
+    config = LlamaConfig(hidden_size=32, intermediate_size=64, num_attention_heads=4, num_key_value_heads=2, num_hidden_layers=N_LAYERS, vocab_size=50, tie_word_embeddings=False)
+    self.full = LlamaForCausalLM(config).eval()
+    self.model_path = Path(self.dir.name)/"model"
+    # small shards so the layers are spread over several files
+    self.full.save_pretrained(self.model_path, safe_serialization=True, max_shard_size="20KB")
+
+  def load(self, shard: Shard) -> ShardedHuggingFaceModel:
+    return ShardedHuggingFaceModel(shard, self.model_path, None, torch.device("cpu"), torch.float32, "cpu")
+
+  def test_loads_shard_layers_without_touching_files(self):
+    before = file_hashes(self.model_path)
+    sharded = self.load(Shard("model", 1, 2, N_LAYERS))
+    self.assertEqual(file_hashes(self.model_path), before)
+
+    self.assertEqual(len(sharded.model.layers), 2)
+    full_state, shard_state = self.full.state_dict(), sharded.llm_model.state_dict()
+    for i in range(2):
+      for name in ("self_attn.q_proj.weight", "mlp.down_proj.weight", "input_layernorm.weight"):
+        torch.testing.assert_close(shard_state[f"model.layers.{i}.{name}"], full_state[f"model.layers.{i + 1}.{name}"])
+
+  def test_last_shard_matches_full_model(self):
+    sharded = self.load(Shard("model", 2, 3, N_LAYERS))
+    torch.testing.assert_close(sharded.llm_model.lm_head.weight, self.full.lm_head.weight)
+    torch.testing.assert_close(sharded.model.norm.weight, self.full.model.norm.weight)
+
+    hidden = torch.randn(1, 3, 32)
+    position_ids = torch.arange(3)[None]
+    with torch.no_grad():
+      expected = hidden
+      for layer in self.full.model.layers[2:]:
+        expected = layer(expected, position_ids=position_ids)[0]
+      output = hidden
+      for layer in sharded.model.layers:
+        output = layer(output, position_ids=position_ids)[0]
+    torch.testing.assert_close(output, expected)
+
+  def test_second_load_uses_shard_cache(self):
+    shard = Shard("model", 0, 1, N_LAYERS)
+    first = self.load(shard)
+    self.assertEqual(len(list((Path(self.dir.name)/"exo"/"shard_cache").glob("*.safetensors"))), 1)
+    with mock.patch("exo.inference.torch.model.hf.safe_open", side_effect=AssertionError("read the source files")):
+      second = self.load(shard)
+    torch.testing.assert_close(second.model.embed_tokens.weight, first.model.embed_tokens.weight)
+    torch.testing.assert_close(second.model.embed_tokens.weight, self.full.model.embed_tokens.weight)
+
+  def test_cached_generation_matches_full_model(self):
+    first, last = self.load(Shard("model", 0, 1, N_LAYERS)), self.load(Shard("model", 2, 3, N_LAYERS))
+    prompt = torch.tensor([[3, 14, 15, 9, 26]])
+    with torch.no_grad():
+      expected = self.full.generate(prompt, max_new_tokens=6, do_sample=False)[0, prompt.shape[1]:].tolist()
+
+      # only the tokens not seen yet go through the shards after the prompt
+      first_cache, last_cache = DynamicCache(), DynamicCache()
+      tokens, input_ids = [], prompt
+      for _ in range(6):
+        hidden, _, _ = first.forward(input_ids=input_ids, past_key_values=first_cache)
+        _, _, logits = last.forward(hidden_states=hidden, past_key_values=last_cache)
+        input_ids = first.logits_sample(logits, use_max=True)[:, None]
+        tokens.append(input_ids.item())
+    self.assertEqual(tokens, expected)
+    self.assertEqual(first_cache.get_seq_length(), prompt.shape[1] + 5)
+    self.assertEqual(last_cache.get_seq_length(), prompt.shape[1] + 5)
+
+  def test_last_position_logits_pick_the_same_tokens(self):
+    sharded = self.load(Shard("model", 0, 3, N_LAYERS))
+    prompt = torch.tensor([[3, 14, 15, 9, 26]])
+    with torch.no_grad():
+      _, _, logits = sharded.forward(input_ids=prompt, past_key_values=DynamicCache())
+      _, _, all_logits = sharded.forward(input_ids=prompt, past_key_values=DynamicCache(), all_logits=True)
+    self.assertEqual(logits.shape, (1, 1, 50))
+    self.assertEqual(all_logits.shape, (1, prompt.shape[1], 50))
+    torch.testing.assert_close(logits[:, -1], all_logits[:, -1])
+    self.assertEqual(sharded.logits_sample(logits, use_max=True).tolist(), sharded.logits_sample(all_logits, use_max=True).tolist())
+
+  def test_sessions_are_admitted_by_kv_cache_budget(self):
+    sharded = self.load(Shard("model", 0, 1, N_LAYERS))
+    # two layers of two kv heads of 8 dims, keys and values in float32
+    self.assertEqual(sharded.kv_bytes_per_token(), 2*2*2*8*4)
+    engine = TorchDynamicShardInferenceEngine(mock.Mock())
+    engine.shard, engine.stateful_sharded_model = sharded.shard, sharded
+    engine.tokenizer = mock.Mock(return_value=mock.Mock(input_ids=torch.tensor([[3, 14, 15, 9, 26, 5]])))
+    # every prompt takes two of the five blocks
+    now = [0.0]
+    engine.kv_blocks = KVBlockManager(5, block_size=4, clock=lambda: now[0])
+
+    async def generate():
+      for request_id in ("a", "b"):
+        await engine.infer_prompt(request_id, engine.shard, "")
+      # a and b are still running, so c is turned away rather than evicting one of them
+      with self.assertRaises(KVCacheFullError):
+        await engine.infer_prompt("c", engine.shard, "")
+      self.assertEqual(list(engine.sessions), ["a", "b"])
+
+      now[0] = IDLE_TIMEOUT - 1
+      await engine.infer_tensor("a", engine.shard, np.array([[7, 8]]))
+      now[0] = IDLE_TIMEOUT
+      await engine.infer_prompt("c", engine.shard, "")
+      self.assertEqual(list(engine.sessions), ["a", "c"])
+      self.assertEqual(engine.kv_blocks.used_blocks, 4)
+      with self.assertRaises(ValueError):
+        await engine.infer_tensor("b", engine.shard, np.array([[7]]))
+    asyncio.run(generate())
+
+  def test_later_shard_without_cache_fails_decode(self):
+    engines = []
+    for shard in (Shard("model", 0, 1, N_LAYERS), Shard("model", 2, 3, N_LAYERS)):
+      engine = TorchDynamicShardInferenceEngine(mock.Mock())
+      engine.stateful_sharded_model = self.load(shard)
+      engine.shard, engine.kv_blocks = shard, KVBlockManager(8, block_size=4)
+      engine.tokenizer = mock.Mock(return_value=mock.Mock(input_ids=torch.tensor([[3, 14, 15, 9, 26]])), eos_token_id=0)
+      engines.append(engine)
+    first, last = engines
+
+    async def generate():
+      hidden, state, _ = await first.infer_prompt("a", first.shard, "")
+      token, _, _ = await last.infer_tensor("a", last.shard, hidden, inference_state=state)
+      hidden, state, _ = await first.infer_tensor("a", first.shard, token)
+      self.assertEqual(state, '{"n_captured_toks": 0}')
+      # the last shard's cache went, so the decode step can't restart the request from nothing
+      last.end_session("a")
+      with self.assertRaises(ValueError):
+        await last.infer_tensor("a", last.shard, hidden, inference_state=state)
+    asyncio.run(generate())
+
+
+if __name__ == "__main__":
+  unittest.main()
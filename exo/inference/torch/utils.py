@@ -2,9 +2,12 @@
 Utility functions to be used by inference engine
 and model
 """
+import os
 import re
+from typing import List, Optional
 
 from exo.inference.shard import Shard
+from exo.helpers import DEBUG
 
 import torch
 
@@ -58,3 +61,67 @@ def print_cuda_vram_stats():
   print(f'Allocated memory: {allocated_memory / 1024**2} MB')
   print(f'Max allocated memory: {max_memory / 1024**2} MB')
   print(f'Cached memory: {cached_memory / 1024**2} MB')
+
+def parse_cpu_list(spec: str) -> List[int]:
+  """
+  Parses a list of CPUs in the format taskset and /proc use, e.g. "0-7,16,18"
+
+  Args:
+    spec (str): Comma separated CPU ids and inclusive ranges
+
+  Returns:
+    cpus (List[int]) - sorted CPU ids
+  """
+  cpus = set()
+  for part in spec.split(","):
+    part = part.strip()
+    if not part:
+      continue
+    if "-" in part:
+      first, last = part.split("-", 1)
+      if int(first) > int(last):
+        raise ValueError(f"Invalid CPU range {part!r}")
+      cpus.update(range(int(first), int(last) + 1))
+    else:
+      cpus.add(int(part))
+  if not cpus:
+    raise ValueError(f"No CPUs in {spec!r}")
+  return sorted(cpus)
+
+def setup_compute_thread(
+  num_threads: Optional[int] = None,
+  interop_threads: Optional[int] = None,
+  cpu_affinity: Optional[List[int]] = None
+):
+  """
+  Runs in the engine's compute thread before any work, so torch's thread pools
+  are sized once and, when pinned, created on the given CPUs
+
+  Args:
+    num_threads (int, optional): Threads for intra-op parallelism, torch's default when None
+    interop_threads (int, optional): Threads for inter-op parallelism, torch's default when None
+    cpu_affinity (List[int], optional): CPUs the compute thread and the threads it starts may run on
+  """
+  if cpu_affinity:
+    if hasattr(os, "sched_setaffinity"):
+      # pid 0 is the calling thread, the intra-op workers it starts inherit its affinity
+      os.sched_setaffinity(0, cpu_affinity)
+    elif DEBUG >= 1:
+      print("CPU affinity isn't supported on this platform, ignoring it")
+
+  if num_threads is not None:
+    torch.set_num_threads(num_threads)
+
+  if interop_threads is not None:
+    try:
+      torch.set_num_interop_threads(interop_threads)
+    except RuntimeError as err:
+      # can only be set once per process, before any inter-op work
+      if DEBUG >= 1:
+        print(f"Couldn't set torch interop threads to {interop_threads}: {err}")
+
+  # grad mode is per thread, nothing run here is ever differentiated
+  torch.set_grad_enabled(False)
+
+  if DEBUG >= 2:
+    print(f"torch compute thread: {torch.get_num_threads()} intra-op threads, {torch.get_num_interop_threads()} interop threads, cpus {cpu_affinity or 'any'}")
@@ -3,9 +3,12 @@ import asyncio
 import signal
 import json
 import logging
+import os
 import time
 import traceback
 import uuid
+from typing import List
+from pathlib import Path
 from exo.networking.manual.manual_discovery import ManualDiscovery
 from exo.networking.manual.network_topology_config import NetworkTopology
 from exo.orchestration.standard_node import StandardNode
@@ -13,7 +16,9 @@ from exo.networking.grpc.grpc_server import GRPCServer
 from exo.networking.udp.udp_discovery import UDPDiscovery
 from exo.networking.tailscale.tailscale_discovery import TailscaleDiscovery
 from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.link_prober import LinkProber
 from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from exo.topology.latency_optimal_partitioning_strategy import LatencyOptimalPartitioningStrategy
 from exo.api import ChatGPTAPI
 from exo.download.shard_download import ShardDownloader, RepoProgressEvent, NoopShardDownloader
 from exo.download.hf.hf_shard_download import HFShardDownloader
@@ -25,10 +30,12 @@ from exo.inference.tokenizers import resolve_tokenizer
 from exo.orchestration.node import Node
 from exo.models import model_base_shards
 from exo.viz.topology_viz import TopologyViz
+from exo.profiling.layer_profile import device_key, save_profile
+from exo.profiling.profiler import profile_model
 
 # parse args
 parser = argparse.ArgumentParser(description="Initialize GRPC Discovery")
-parser.add_argument("command", nargs="?", choices=["run"], help="Command to run")
+parser.add_argument("command", nargs="?", choices=["run", "profile"], help="Command to run")
 parser.add_argument("model_name", nargs="?", help="Model name to run")
 parser.add_argument("--node-id", type=str, default=None, help="Node ID")
 parser.add_argument("--node-host", type=str, default="0.0.0.0", help="Node host")
@@ -41,18 +48,30 @@ parser.add_argument("--broadcast-port", type=int, default=5678, help="Broadcast
 parser.add_argument("--discovery-module", type=str, choices=["udp", "tailscale", "manual"], default="udp", help="Discovery module to use")
 parser.add_argument("--discovery-timeout", type=int, default=30, help="Discovery timeout in seconds")
 parser.add_argument("--discovery-config-path", type=str, default=None, help="Path to discovery config json file")
+parser.add_argument("--partitioning-strategy", type=str, choices=["ring-memory-weighted", "latency-optimal"], default="ring-memory-weighted", help="Strategy for splitting model layers across nodes")
+parser.add_argument("--max-replicas", type=int, default=1, help="Split the cluster into up to this many rings that each hold the whole model and serve requests independently")
+parser.add_argument("--tensor-parallel-size", type=int, default=1, help="Split every layer across groups of this many consecutive nodes in the ring (llama on tinygrad or torch, MoE experts on mlx)")
+parser.add_argument("--expert-placement", type=str, default=None, help="JSON file mapping model ids to the experts each node in a group holds, e.g. from /v1/experts. Same on all nodes")
+parser.add_argument("--link-probe-interval", type=float, default=30, help="Interval in seconds between link quality probes to peers (0 to disable)")
 parser.add_argument("--wait-for-peers", type=int, default=0, help="Number of peers to wait to connect to before starting")
 parser.add_argument("--chatgpt-api-port", type=int, default=8000, help="ChatGPT API port")
 parser.add_argument("--chatgpt-api-response-timeout", type=int, default=90, help="ChatGPT API response timeout in seconds")
 parser.add_argument("--max-generate-tokens", type=int, default=10000, help="Max tokens to generate in each request")
-parser.add_argument("--inference-engine", type=str, default=None, help="Inference engine to use (mlx, tinygrad, or dummy)")
+parser.add_argument("--inference-engine", type=str, default=None, help="Inference engine to use (mlx, tinygrad, torch, or dummy)")
+parser.add_argument("--cpu-benchmark", action="store_true", help="Measure CPU flops and memory bandwidth at startup on Linux nodes without a GPU (same as EXO_CPU_BENCHMARK=1)")
+parser.add_argument("--kv-cache-quantize", type=str, choices=["int8", "fp8"], default=None, help="Store kv caches quantized, about half the memory of float16 (int8 on tinygrad, int8 or fp8 on torch)")
 parser.add_argument("--disable-tui", action=argparse.BooleanOptionalAction, help="Disable TUI")
 parser.add_argument("--run-model", type=str, help="Specify a model to run directly")
 parser.add_argument("--prompt", type=str, help="Prompt for the model when using --run-model", default="Who are you?")
+parser.add_argument("--profile-seq-lens", type=str, default="1,128", help="Comma separated sequence lengths to profile each layer with when using 'profile' command")
+parser.add_argument("--profile-repeats", type=int, default=3, help="Number of timed forward passes per layer and sequence length when using 'profile' command")
 parser.add_argument("--tailscale-api-key", type=str, default=None, help="Tailscale API key")
 parser.add_argument("--tailnet-name", type=str, default=None, help="Tailnet name")
 args = parser.parse_args()
 print(f"Selected inference engine: {args.inference_engine}")
+if args.cpu_benchmark:
+  # read when the node and discovery look up this device's capabilities, before the event loop starts
+  os.environ["EXO_CPU_BENCHMARK"] = "1"
 
 
 print_yellow_exo()
@@ -65,7 +84,7 @@ shard_downloader: ShardDownloader = HFShardDownloader(quick_check=args.download_
 inference_engine_name = args.inference_engine or ("mlx" if system_info == "Apple Silicon Mac" else "tinygrad")
 print(f"Inference engine name after selection: {inference_engine_name}")
 
-inference_engine = get_inference_engine(inference_engine_name, shard_downloader)
+inference_engine = get_inference_engine(inference_engine_name, shard_downloader, kv_cache_quantize=args.kv_cache_quantize)
 print(f"Using inference engine: {inference_engine.__class__.__name__} with shard downloader: {shard_downloader.__class__.__name__}")
 
 if args.node_port is None:
@@ -98,10 +117,16 @@ node = StandardNode(
   None,
   inference_engine,
   discovery,
-  partitioning_strategy=RingMemoryWeightedPartitioningStrategy(),
+  partitioning_strategy=LatencyOptimalPartitioningStrategy() if args.partitioning_strategy == "latency-optimal" else RingMemoryWeightedPartitioningStrategy(),
   max_generate_tokens=args.max_generate_tokens,
   topology_viz=topology_viz,
-  shard_downloader=shard_downloader
+  shard_downloader=shard_downloader,
+  link_prober=LinkProber() if args.link_probe_interval > 0 else None,
+  link_probe_interval=args.link_probe_interval,
+  max_replicas=args.max_replicas,
+  tensor_parallel_size=args.tensor_parallel_size,
+  expert_placement=json.loads(Path(args.expert_placement).read_text()) if args.expert_placement else None,
+  kv_cache_quantize=args.kv_cache_quantize,
 )
 server = GRPCServer(node, args.node_host, args.node_port)
 node.server = server
@@ -187,6 +212,20 @@ async def run_model_cli(node: Node, inference_engine: InferenceEngine, model_nam
     node.on_token.deregister(callback_id)
 
 
+async def profile_model_cli(inference_engine: InferenceEngine, model_name: str, seq_lens: List[int], repeats: int):
+  shard = model_base_shards.get(model_name, {}).get(inference_engine.__class__.__name__)
+  if not shard:
+    print(f"Error: Unsupported model '{model_name}' for inference engine {inference_engine.__class__.__name__}")
+    return
+  device = device_key(node.device_capabilities)
+  print(f"Profiling {shard.model_id} ({shard.n_layers} layers) with {inference_engine.__class__.__name__} on {device}, {seq_lens=}")
+  profile = await profile_model(inference_engine, inference_engine.__class__.__name__, shard, device, seq_lens, repeats)
+  path = save_profile(profile)
+  for seq_len in seq_lens:
+    print(f"seq_len={seq_len}: {sum(profile.layer_latencies(seq_len))*1000:.2f}ms per forward pass over all layers")
+  print(f"Saved profile to {path}")
+
+
 async def main():
   loop = asyncio.get_running_loop()
 
@@ -197,6 +236,13 @@ async def main():
   for s in [signal.SIGINT, signal.SIGTERM]:
     loop.add_signal_handler(s, handle_exit)
 
+  if args.command == "profile":
+    if not args.model_name:
+      print("Error: Model name is required when using 'profile' command")
+      return
+    await profile_model_cli(inference_engine, args.model_name, [int(seq_len) for seq_len in args.profile_seq_lens.split(",")], args.profile_repeats)
+    return
+
   await node.start(wait_for_peers=args.wait_for_peers)
 
   if args.command == "run" or args.run_model:
@@ -1,24 +1,30 @@
 import grpc
 import numpy as np
 import asyncio
-from typing import Optional, Tuple, List
+import time
+from typing import Optional, Tuple, List, Dict
 
 from . import node_service_pb2
 from . import node_service_pb2_grpc
 
 from ..peer_handle import PeerHandle
 from exo.inference.shard import Shard
-from exo.topology.topology import Topology
-from exo.topology.device_capabilities import DeviceCapabilities
+from exo.topology.gossip import TopologyEntry
+from exo.topology.topology import LinkStats
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
 from exo.helpers import DEBUG
 
 class GRPCPeerHandle(PeerHandle):
-  def __init__(self, _id: str, address: str, device_capabilities: DeviceCapabilities):
+  def __init__(self, _id: str, address: str, device_capabilities: DeviceCapabilities, health_check_ttl: float = 5.0):
     self._id = _id
     self.address = address
     self._device_capabilities = device_capabilities
     self.channel = None
     self.stub = None
+    # Any successful RPC proves liveness, so health checks within this window are answered without a round trip.
+    self.health_check_ttl = health_check_ttl
+    self.last_alive = 0.0
+    self._health_check_task: Optional[asyncio.Task] = None
 
   def id(self) -> str:
     return self._id
@@ -43,15 +49,28 @@ class GRPCPeerHandle(PeerHandle):
       await self.channel.close()
     self.channel = None
     self.stub = None
+    self.last_alive = 0.0
 
   async def _ensure_connected(self):
     if not await self.is_connected(): await asyncio.wait_for(self.connect(), timeout=5)
 
+  def _mark_alive(self):
+    self.last_alive = time.time()
+
   async def health_check(self) -> bool:
+    if time.time() - self.last_alive < self.health_check_ttl:
+      return True
+    # Concurrent callers (e.g. presence broadcasts arriving on several interfaces) share a single in-flight probe.
+    if self._health_check_task is None or self._health_check_task.done():
+      self._health_check_task = asyncio.create_task(self._health_check())
+    return await asyncio.shield(self._health_check_task)
+
+  async def _health_check(self) -> bool:
     try:
       await self._ensure_connected()
       request = node_service_pb2.HealthCheckRequest()
       response = await asyncio.wait_for(self.stub.HealthCheck(request), timeout=5)
+      if response.is_healthy: self._mark_alive()
       return response.is_healthy
     except asyncio.TimeoutError:
       return False
@@ -62,6 +81,11 @@ class GRPCPeerHandle(PeerHandle):
         traceback.print_exc()
       return False
 
+  async def ping(self, payload: bytes = b"") -> None:
+    await self._ensure_connected()
+    await self.stub.Ping(node_service_pb2.PingRequest(payload=payload))
+    self._mark_alive()
+
   async def send_prompt(self, shard: Shard, prompt: str, image_str: Optional[str] = None, request_id: Optional[str] = None, inference_state: Optional[str] = None) -> Optional[np.array]:
     request = node_service_pb2.PromptRequest(
       prompt=prompt,
@@ -77,6 +101,7 @@ class GRPCPeerHandle(PeerHandle):
     )
 
     response = await self.stub.SendPrompt(request)
+    self._mark_alive()
 
     if not response.tensor_data or not response.shape or not response.dtype:
       return None
@@ -97,15 +122,31 @@ class GRPCPeerHandle(PeerHandle):
     )
 
     response = await self.stub.SendTensor(request)
+    self._mark_alive()
 
     if not response.tensor_data or not response.shape or not response.dtype:
       return None
 
     return np.frombuffer(response.tensor_data, dtype=np.dtype(response.dtype)).reshape(response.shape)
 
+  async def send_partial(self, request_id: str, step: int, node_id: str, tensor: np.ndarray) -> None:
+    request = node_service_pb2.PartialRequest(
+      request_id=request_id,
+      step=step,
+      node_id=node_id,
+      tensor=node_service_pb2.Tensor(tensor_data=tensor.tobytes(), shape=tensor.shape, dtype=str(tensor.dtype)),
+    )
+    await self.stub.SendPartial(request)
+    self._mark_alive()
+
+  async def send_turn(self, request_id: str, call: int, turn: int) -> None:
+    await self.stub.SendTurn(node_service_pb2.TurnRequest(request_id=request_id, call=call, turn=turn))
+    self._mark_alive()
+
   async def get_inference_result(self, request_id: str) -> Tuple[Optional[np.ndarray], bool]:
     request = node_service_pb2.GetInferenceResultRequest(request_id=request_id)
     response = await self.stub.GetInferenceResult(request)
+    self._mark_alive()
     if response.tensor is None:
       return None, response.is_finished
     return (
@@ -113,22 +154,53 @@ class GRPCPeerHandle(PeerHandle):
       response.is_finished,
     )
 
-  async def collect_topology(self, visited: set[str], max_depth: int) -> Topology:
-    request = node_service_pb2.CollectTopologyRequest(visited=visited, max_depth=max_depth)
-    response = await self.stub.CollectTopology(request)
-    topology = Topology()
-    for node_id, capabilities in response.nodes.items():
-      device_capabilities = DeviceCapabilities(model=capabilities.model, chip=capabilities.chip, memory=capabilities.memory, flops=capabilities.flops)
-      topology.update_node(node_id, device_capabilities)
-    for node_id, peers in response.peer_graph.items():
-      for peer_id in peers.peer_ids:
-        topology.add_edge(node_id, peer_id)
-    return topology
+  async def gossip_topology(self, node_id: str, digest: Dict[str, int], entries: List[TopologyEntry]) -> Tuple[Dict[str, int], List[TopologyEntry]]:
+    request = node_service_pb2.GossipTopologyRequest(
+      node_id=node_id,
+      digest=digest,
+      entries=[
+        node_service_pb2.TopologyEntry(
+          node_id=entry.node_id,
+          version=entry.version,
+          device_capabilities=node_service_pb2.DeviceCapabilities(
+            model=entry.device_capabilities.model,
+            chip=entry.device_capabilities.chip,
+            memory=entry.device_capabilities.memory,
+            flops=node_service_pb2.DeviceFlops(**entry.device_capabilities.flops.to_dict()),
+            memory_bandwidth=entry.device_capabilities.memory_bandwidth,
+          ),
+          peer_ids=sorted(entry.peer_ids),
+          links={peer_id: node_service_pb2.LinkStats(**link.to_dict()) for peer_id, link in entry.links.items()},
+          layer_costs={model_id: node_service_pb2.LayerCosts(latencies=latencies) for model_id, latencies in entry.layer_costs.items()},
+        ) for entry in entries
+      ],
+    )
+    response = await self.stub.GossipTopology(request)
+    self._mark_alive()
+    response_entries = [
+      TopologyEntry(
+        node_id=entry.node_id,
+        version=entry.version,
+        device_capabilities=DeviceCapabilities(
+          model=entry.device_capabilities.model,
+          chip=entry.device_capabilities.chip,
+          memory=entry.device_capabilities.memory,
+          flops=DeviceFlops(fp32=entry.device_capabilities.flops.fp32, fp16=entry.device_capabilities.flops.fp16, int8=entry.device_capabilities.flops.int8),
+          memory_bandwidth=entry.device_capabilities.memory_bandwidth,
+        ),
+        peer_ids=set(entry.peer_ids),
+        links={peer_id: LinkStats(rtt=link.rtt, jitter=link.jitter, throughput=link.throughput) for peer_id, link in entry.links.items()},
+        layer_costs={model_id: list(costs.latencies) for model_id, costs in entry.layer_costs.items()},
+      ) for entry in response.entries
+    ]
+    return dict(response.digest), response_entries
 
   async def send_result(self, request_id: str, result: List[int], is_finished: bool) -> None:
     request = node_service_pb2.SendResultRequest(request_id=request_id, result=result, is_finished=is_finished)
     await self.stub.SendResult(request)
+    self._mark_alive()
 
   async def send_opaque_status(self, request_id: str, status: str) -> None:
     request = node_service_pb2.SendOpaqueStatusRequest(request_id=request_id, status=status)
     await self.stub.SendOpaqueStatus(request)
+    self._mark_alive()
@@ -8,6 +8,9 @@ from . import node_service_pb2_grpc
 from exo import DEBUG
 from exo.inference.shard import Shard
 from exo.orchestration import Node
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+from exo.topology.gossip import TopologyEntry
+from exo.topology.topology import LinkStats
 
 
 class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
@@ -84,23 +87,44 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
       ) if result[0] is not None else node_service_pb2.InferenceResult(is_finished=result[1])
     )
 
-  async def CollectTopology(self, request, context):
-    max_depth = request.max_depth
-    visited = set(request.visited)
-    topology = await self.node.collect_topology(visited, max_depth)
-    nodes = {
-      node_id:
-        node_service_pb2.DeviceCapabilities(
-          model=cap.model,
-          chip=cap.chip,
-          memory=cap.memory,
-          flops=node_service_pb2.DeviceFlops(fp32=cap.flops.fp32, fp16=cap.flops.fp16, int8=cap.flops.int8),
-        )
-      for node_id, cap in topology.nodes.items()
-    }
-    peer_graph = {node_id: node_service_pb2.Peers(peer_ids=peers) for node_id, peers in topology.peer_graph.items()}
-    if DEBUG >= 5: print(f"CollectTopology {max_depth=} {visited=} {nodes=} {peer_graph=}")
-    return node_service_pb2.Topology(nodes=nodes, peer_graph=peer_graph)
+  async def GossipTopology(self, request, context):
+    entries = [
+      TopologyEntry(
+        node_id=entry.node_id,
+        version=entry.version,
+        device_capabilities=DeviceCapabilities(
+          model=entry.device_capabilities.model,
+          chip=entry.device_capabilities.chip,
+          memory=entry.device_capabilities.memory,
+          flops=DeviceFlops(fp32=entry.device_capabilities.flops.fp32, fp16=entry.device_capabilities.flops.fp16, int8=entry.device_capabilities.flops.int8),
+          memory_bandwidth=entry.device_capabilities.memory_bandwidth,
+        ),
+        peer_ids=set(entry.peer_ids),
+        links={peer_id: LinkStats(rtt=link.rtt, jitter=link.jitter, throughput=link.throughput) for peer_id, link in entry.links.items()},
+        layer_costs={model_id: list(costs.latencies) for model_id, costs in entry.layer_costs.items()},
+      ) for entry in request.entries
+    ]
+    digest, response_entries = await self.node.handle_topology_gossip(request.node_id, dict(request.digest), entries)
+    if DEBUG >= 5: print(f"GossipTopology from {request.node_id}: received {len(entries)} entries, sending {len(response_entries)} entries")
+    return node_service_pb2.GossipTopologyResponse(
+      digest=digest,
+      entries=[
+        node_service_pb2.TopologyEntry(
+          node_id=entry.node_id,
+          version=entry.version,
+          device_capabilities=node_service_pb2.DeviceCapabilities(
+            model=entry.device_capabilities.model,
+            chip=entry.device_capabilities.chip,
+            memory=entry.device_capabilities.memory,
+            flops=node_service_pb2.DeviceFlops(**entry.device_capabilities.flops.to_dict()),
+            memory_bandwidth=entry.device_capabilities.memory_bandwidth,
+          ),
+          peer_ids=sorted(entry.peer_ids),
+          links={peer_id: node_service_pb2.LinkStats(**link.to_dict()) for peer_id, link in entry.links.items()},
+          layer_costs={model_id: node_service_pb2.LayerCosts(latencies=latencies) for model_id, latencies in entry.layer_costs.items()},
+        ) for entry in response_entries
+      ],
+    )
 
   async def SendResult(self, request, context):
     request_id = request.request_id
@@ -117,5 +141,19 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
     self.node.on_opaque_status.trigger_all(request_id, status)
     return node_service_pb2.Empty()
 
+  async def SendPartial(self, request, context):
+    tensor = np.frombuffer(request.tensor.tensor_data, dtype=np.dtype(request.tensor.dtype)).reshape(request.tensor.shape)
+    if DEBUG >= 8: print(f"Received SendPartial request: {request.request_id=} {request.step=} {request.node_id=} {tensor.shape=}")
+    self.node.handle_partial(request.request_id, request.step, request.node_id, tensor)
+    return node_service_pb2.Empty()
+
+  async def SendTurn(self, request, context):
+    if DEBUG >= 8: print(f"Received SendTurn request: {request.request_id=} {request.call=} {request.turn=}")
+    self.node.handle_turn(request.request_id, request.call, request.turn)
+    return node_service_pb2.Empty()
+
   async def HealthCheck(self, request, context):
     return node_service_pb2.HealthCheckResponse(is_healthy=True)
+
+  async def Ping(self, request, context):
+    return node_service_pb2.PingResponse()
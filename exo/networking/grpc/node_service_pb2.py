@@ -14,17 +14,21 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12node_service.proto\x12\x0cnode_service\"S\n\x05Shard\x12\x10\n\x08model_id\x18\x01 \x01(\t\x12\x13\n\x0bstart_layer\x18\x02 \x01(\x05\x12\x11\n\tend_layer\x18\x03 \x01(\x05\x12\x10\n\x08n_layers\x18\x04 \x01(\x05\"\xc3\x01\n\rPromptRequest\x12\"\n\x05shard\x18\x01 \x01(\x0b\x32\x13.node_service.Shard\x12\x0e\n\x06prompt\x18\x02 \x01(\t\x12\x16\n\timage_str\x18\x03 \x01(\tH\x00\x88\x01\x01\x12\x17\n\nrequest_id\x18\x04 \x01(\tH\x01\x88\x01\x01\x12\x1c\n\x0finference_state\x18\x05 \x01(\tH\x02\x88\x01\x01\x42\x0c\n\n_image_strB\r\n\x0b_request_idB\x12\n\x10_inference_state\"\xb3\x01\n\rTensorRequest\x12\"\n\x05shard\x18\x01 \x01(\x0b\x32\x13.node_service.Shard\x12$\n\x06tensor\x18\x02 \x01(\x0b\x32\x14.node_service.Tensor\x12\x17\n\nrequest_id\x18\x03 \x01(\tH\x00\x88\x01\x01\x12\x1c\n\x0finference_state\x18\x04 \x01(\tH\x01\x88\x01\x01\x42\r\n\x0b_request_idB\x12\n\x10_inference_state\"/\n\x19GetInferenceResultRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\t\"\\\n\x0fInferenceResult\x12)\n\x06tensor\x18\x01 \x01(\x0b\x32\x14.node_service.TensorH\x00\x88\x01\x01\x12\x13\n\x0bis_finished\x18\x02 \x01(\x08\x42\t\n\x07_tensor\";\n\x06Tensor\x12\x13\n\x0btensor_data\x18\x01 \x01(\x0c\x12\r\n\x05shape\x18\x02 \x03(\x05\x12\r\n\x05\x64type\x18\x03 \x01(\t\"<\n\x16\x43ollectTopologyRequest\x12\x0f\n\x07visited\x18\x01 \x03(\t\x12\x11\n\tmax_depth\x18\x02 \x01(\x05\"\x8e\x02\n\x08Topology\x12\x30\n\x05nodes\x18\x01 \x03(\x0b\x32!.node_service.Topology.NodesEntry\x12\x39\n\npeer_graph\x18\x02 \x03(\x0b\x32%.node_service.Topology.PeerGraphEntry\x1aN\n\nNodesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12/\n\x05value\x18\x02 \x01(\x0b\x32 .node_service.DeviceCapabilities:\x02\x38\x01\x1a\x45\n\x0ePeerGraphEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\"\n\x05value\x18\x02 \x01(\x0b\x32\x13.node_service.Peers:\x02\x38\x01\"\x19\n\x05Peers\x12\x10\n\x08peer_ids\x18\x01 \x03(\t\"7\n\x0b\x44\x65viceFlops\x12\x0c\n\x04\x66p32\x18\x01 \x01(\x02\x12\x0c\n\x04\x66p16\x18\x02 \x01(\x02\x12\x0c\n\x04int8\x18\x03 \x01(\x02\"k\n\x12\x44\x65viceCapabilities\x12\r\n\x05model\x18\x01 \x01(\t\x12\x0c\n\x04\x63hip\x18\x02 \x01(\t\x12\x0e\n\x06memory\x18\x03 \x01(\x05\x12(\n\x05\x66lops\x18\x04 \x01(\x0b\x32\x19.node_service.DeviceFlops\"L\n\x11SendResultRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\t\x12\x0e\n\x06result\x18\x02 \x03(\x05\x12\x13\n\x0bis_finished\x18\x03 \x01(\x08\"=\n\x17SendOpaqueStatusRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t\"\x14\n\x12HealthCheckRequest\")\n\x13HealthCheckResponse\x12\x12\n\nis_healthy\x18\x01 \x01(\x08\"\x07\n\x05\x45mpty2\xb4\x04\n\x0bNodeService\x12\x41\n\nSendPrompt\x12\x1b.node_service.PromptRequest\x1a\x14.node_service.Tensor\"\x00\x12\x41\n\nSendTensor\x12\x1b.node_service.TensorRequest\x1a\x14.node_service.Tensor\"\x00\x12^\n\x12GetInferenceResult\x12\'.node_service.GetInferenceResultRequest\x1a\x1d.node_service.InferenceResult\"\x00\x12Q\n\x0f\x43ollectTopology\x12$.node_service.CollectTopologyRequest\x1a\x16.node_service.Topology\"\x00\x12\x44\n\nSendResult\x12\x1f.node_service.SendResultRequest\x1a\x13.node_service.Empty\"\x00\x12P\n\x10SendOpaqueStatus\x12%.node_service.SendOpaqueStatusRequest\x1a\x13.node_service.Empty\"\x00\x12T\n\x0bHealthCheck\x12 .node_service.HealthCheckRequest\x1a!.node_service.HealthCheckResponse\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12node_service.proto\x12\x0cnode_service\"S\n\x05Shard\x12\x10\n\x08model_id\x18\x01 \x01(\t\x12\x13\n\x0bstart_layer\x18\x02 \x01(\x05\x12\x11\n\tend_layer\x18\x03 \x01(\x05\x12\x10\n\x08n_layers\x18\x04 \x01(\x05\"\xc3\x01\n\rPromptRequest\x12\"\n\x05shard\x18\x01 \x01(\x0b\x32\x13.node_service.Shard\x12\x0e\n\x06prompt\x18\x02 \x01(\t\x12\x16\n\timage_str\x18\x03 \x01(\tH\x00\x88\x01\x01\x12\x17\n\nrequest_id\x18\x04 \x01(\tH\x01\x88\x01\x01\x12\x1c\n\x0finference_state\x18\x05 \x01(\tH\x02\x88\x01\x01\x42\x0c\n\n_image_strB\r\n\x0b_request_idB\x12\n\x10_inference_state\"\xb3\x01\n\rTensorRequest\x12\"\n\x05shard\x18\x01 \x01(\x0b\x32\x13.node_service.Shard\x12$\n\x06tensor\x18\x02 \x01(\x0b\x32\x14.node_service.Tensor\x12\x17\n\nrequest_id\x18\x03 \x01(\tH\x00\x88\x01\x01\x12\x1c\n\x0finference_state\x18\x04 \x01(\tH\x01\x88\x01\x01\x42\r\n\x0b_request_idB\x12\n\x10_inference_state\"/\n\x19GetInferenceResultRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\t\"\\\n\x0fInferenceResult\x12)\n\x06tensor\x18\x01 \x01(\x0b\x32\x14.node_service.TensorH\x00\x88\x01\x01\x12\x13\n\x0bis_finished\x18\x02 \x01(\x08\x42\t\n\x07_tensor\";\n\x06Tensor\x12\x13\n\x0btensor_data\x18\x01 \x01(\x0c\x12\r\n\x05shape\x18\x02 \x03(\x05\x12\r\n\x05\x64type\x18\x03 \x01(\t\"\x8f\x03\n\rTopologyEntry\x12\x0f\n\x07node_id\x18\x01 \x01(\t\x12\x0f\n\x07version\x18\x02 \x01(\x03\x12=\n\x13\x64\x65vice_capabilities\x18\x03 \x01(\x0b\x32 .node_service.DeviceCapabilities\x12\x10\n\x08peer_ids\x18\x04 \x03(\t\x12\x35\n\x05links\x18\x05 \x03(\x0b\x32&.node_service.TopologyEntry.LinksEntry\x12@\n\x0blayer_costs\x18\x06 \x03(\x0b\x32+.node_service.TopologyEntry.LayerCostsEntry\x1a\x45\n\nLinksEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12&\n\x05value\x18\x02 \x01(\x0b\x32\x17.node_service.LinkStats:\x02\x38\x01\x1aK\n\x0fLayerCostsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\'\n\x05value\x18\x02 \x01(\x0b\x32\x18.node_service.LayerCosts:\x02\x38\x01\"\x1f\n\nLayerCosts\x12\x11\n\tlatencies\x18\x01 \x03(\x02\"<\n\tLinkStats\x12\x0b\n\x03rtt\x18\x01 \x01(\x02\x12\x0e\n\x06jitter\x18\x02 \x01(\x02\x12\x12\n\nthroughput\x18\x03 \x01(\x02\"\xc6\x01\n\x15GossipTopologyRequest\x12\x0f\n\x07node_id\x18\x01 \x01(\t\x12?\n\x06\x64igest\x18\x02 \x03(\x0b\x32/.node_service.GossipTopologyRequest.DigestEntry\x12,\n\x07\x65ntries\x18\x03 \x03(\x0b\x32\x1b.node_service.TopologyEntry\x1a-\n\x0b\x44igestEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x03:\x02\x38\x01\"\xb7\x01\n\x16GossipTopologyResponse\x12@\n\x06\x64igest\x18\x01 \x03(\x0b\x32\x30.node_service.GossipTopologyResponse.DigestEntry\x12,\n\x07\x65ntries\x18\x02 \x03(\x0b\x32\x1b.node_service.TopologyEntry\x1a-\n\x0b\x44igestEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x03:\x02\x38\x01\"7\n\x0b\x44\x65viceFlops\x12\x0c\n\x04\x66p32\x18\x01 \x01(\x02\x12\x0c\n\x04\x66p16\x18\x02 \x01(\x02\x12\x0c\n\x04int8\x18\x03 \x01(\x02\"\x85\x01\n\x12\x44\x65viceCapabilities\x12\r\n\x05model\x18\x01 \x01(\t\x12\x0c\n\x04\x63hip\x18\x02 \x01(\t\x12\x0e\n\x06memory\x18\x03 \x01(\x05\x12(\n\x05\x66lops\x18\x04 \x01(\x0b\x32\x19.node_service.DeviceFlops\x12\x18\n\x10memory_bandwidth\x18\x05 \x01(\x02\"L\n\x11SendResultRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\t\x12\x0e\n\x06result\x18\x02 \x03(\x05\x12\x13\n\x0bis_finished\x18\x03 \x01(\x08\"=\n\x17SendOpaqueStatusRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t\"i\n\x0ePartialRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\t\x12\x0c\n\x04step\x18\x02 \x01(\x05\x12\x0f\n\x07node_id\x18\x03 \x01(\t\x12$\n\x06tensor\x18\x04 \x01(\x0b\x32\x14.node_service.Tensor\"=\n\x0bTurnRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\t\x12\x0c\n\x04\x63\x61ll\x18\x02 \x01(\x05\x12\x0c\n\x04turn\x18\x03 \x01(\x05\"\x14\n\x12HealthCheckRequest\")\n\x13HealthCheckResponse\x12\x12\n\nis_healthy\x18\x01 \x01(\x08\"\x1e\n\x0bPingRequest\x12\x0f\n\x07payload\x18\x01 \x01(\x0c\"\x0e\n\x0cPingResponse\"\x07\n\x05\x45mpty2\x83\x06\n\x0bNodeService\x12\x41\n\nSendPrompt\x12\x1b.node_service.PromptRequest\x1a\x14.node_service.Tensor\"\x00\x12\x41\n\nSendTensor\x12\x1b.node_service.TensorRequest\x1a\x14.node_service.Tensor\"\x00\x12^\n\x12GetInferenceResult\x12\'.node_service.GetInferenceResultRequest\x1a\x1d.node_service.InferenceResult\"\x00\x12]\n\x0eGossipTopology\x12#.node_service.GossipTopologyRequest\x1a$.node_service.GossipTopologyResponse\"\x00\x12\x44\n\nSendResult\x12\x1f.node_service.SendResultRequest\x1a\x13.node_service.Empty\"\x00\x12P\n\x10SendOpaqueStatus\x12%.node_service.SendOpaqueStatusRequest\x1a\x13.node_service.Empty\"\x00\x12\x42\n\x0bSendPartial\x12\x1c.node_service.PartialRequest\x1a\x13.node_service.Empty\"\x00\x12<\n\x08SendTurn\x12\x19.node_service.TurnRequest\x1a\x13.node_service.Empty\"\x00\x12T\n\x0bHealthCheck\x12 .node_service.HealthCheckRequest\x1a!.node_service.HealthCheckResponse\"\x00\x12?\n\x04Ping\x12\x19.node_service.PingRequest\x1a\x1a.node_service.PingResponse\"\x00\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'node_service_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_TOPOLOGY_NODESENTRY']._loaded_options = None
-  _globals['_TOPOLOGY_NODESENTRY']._serialized_options = b'8\001'
-  _globals['_TOPOLOGY_PEERGRAPHENTRY']._loaded_options = None
-  _globals['_TOPOLOGY_PEERGRAPHENTRY']._serialized_options = b'8\001'
+  _globals['_TOPOLOGYENTRY_LINKSENTRY']._loaded_options = None
+  _globals['_TOPOLOGYENTRY_LINKSENTRY']._serialized_options = b'8\001'
+  _globals['_TOPOLOGYENTRY_LAYERCOSTSENTRY']._loaded_options = None
+  _globals['_TOPOLOGYENTRY_LAYERCOSTSENTRY']._serialized_options = b'8\001'
+  _globals['_GOSSIPTOPOLOGYREQUEST_DIGESTENTRY']._loaded_options = None
+  _globals['_GOSSIPTOPOLOGYREQUEST_DIGESTENTRY']._serialized_options = b'8\001'
+  _globals['_GOSSIPTOPOLOGYRESPONSE_DIGESTENTRY']._loaded_options = None
+  _globals['_GOSSIPTOPOLOGYRESPONSE_DIGESTENTRY']._serialized_options = b'8\001'
   _globals['_SHARD']._serialized_start=36
   _globals['_SHARD']._serialized_end=119
   _globals['_PROMPTREQUEST']._serialized_start=122
@@ -37,30 +41,46 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_INFERENCERESULT']._serialized_end=642
   _globals['_TENSOR']._serialized_start=644
   _globals['_TENSOR']._serialized_end=703
-  _globals['_COLLECTTOPOLOGYREQUEST']._serialized_start=705
-  _globals['_COLLECTTOPOLOGYREQUEST']._serialized_end=765
-  _globals['_TOPOLOGY']._serialized_start=768
-  _globals['_TOPOLOGY']._serialized_end=1038
-  _globals['_TOPOLOGY_NODESENTRY']._serialized_start=889
-  _globals['_TOPOLOGY_NODESENTRY']._serialized_end=967
-  _globals['_TOPOLOGY_PEERGRAPHENTRY']._serialized_start=969
-  _globals['_TOPOLOGY_PEERGRAPHENTRY']._serialized_end=1038
-  _globals['_PEERS']._serialized_start=1040
-  _globals['_PEERS']._serialized_end=1065
-  _globals['_DEVICEFLOPS']._serialized_start=1067
-  _globals['_DEVICEFLOPS']._serialized_end=1122
-  _globals['_DEVICECAPABILITIES']._serialized_start=1124
-  _globals['_DEVICECAPABILITIES']._serialized_end=1231
-  _globals['_SENDRESULTREQUEST']._serialized_start=1233
-  _globals['_SENDRESULTREQUEST']._serialized_end=1309
-  _globals['_SENDOPAQUESTATUSREQUEST']._serialized_start=1311
-  _globals['_SENDOPAQUESTATUSREQUEST']._serialized_end=1372
-  _globals['_HEALTHCHECKREQUEST']._serialized_start=1374
-  _globals['_HEALTHCHECKREQUEST']._serialized_end=1394
-  _globals['_HEALTHCHECKRESPONSE']._serialized_start=1396
-  _globals['_HEALTHCHECKRESPONSE']._serialized_end=1437
-  _globals['_EMPTY']._serialized_start=1439
-  _globals['_EMPTY']._serialized_end=1446
-  _globals['_NODESERVICE']._serialized_start=1449
-  _globals['_NODESERVICE']._serialized_end=2013
+  _globals['_TOPOLOGYENTRY']._serialized_start=706
+  _globals['_TOPOLOGYENTRY']._serialized_end=1105
+  _globals['_TOPOLOGYENTRY_LINKSENTRY']._serialized_start=959
+  _globals['_TOPOLOGYENTRY_LINKSENTRY']._serialized_end=1028
+  _globals['_TOPOLOGYENTRY_LAYERCOSTSENTRY']._serialized_start=1030
+  _globals['_TOPOLOGYENTRY_LAYERCOSTSENTRY']._serialized_end=1105
+  _globals['_LAYERCOSTS']._serialized_start=1107
+  _globals['_LAYERCOSTS']._serialized_end=1138
+  _globals['_LINKSTATS']._serialized_start=1140
+  _globals['_LINKSTATS']._serialized_end=1200
+  _globals['_GOSSIPTOPOLOGYREQUEST']._serialized_start=1203
+  _globals['_GOSSIPTOPOLOGYREQUEST']._serialized_end=1401
+  _globals['_GOSSIPTOPOLOGYREQUEST_DIGESTENTRY']._serialized_start=1356
+  _globals['_GOSSIPTOPOLOGYREQUEST_DIGESTENTRY']._serialized_end=1401
+  _globals['_GOSSIPTOPOLOGYRESPONSE']._serialized_start=1404
+  _globals['_GOSSIPTOPOLOGYRESPONSE']._serialized_end=1587
+  _globals['_GOSSIPTOPOLOGYRESPONSE_DIGESTENTRY']._serialized_start=1356
+  _globals['_GOSSIPTOPOLOGYRESPONSE_DIGESTENTRY']._serialized_end=1401
+  _globals['_DEVICEFLOPS']._serialized_start=1589
+  _globals['_DEVICEFLOPS']._serialized_end=1644
+  _globals['_DEVICECAPABILITIES']._serialized_start=1647
+  _globals['_DEVICECAPABILITIES']._serialized_end=1780
+  _globals['_SENDRESULTREQUEST']._serialized_start=1782
+  _globals['_SENDRESULTREQUEST']._serialized_end=1858
+  _globals['_SENDOPAQUESTATUSREQUEST']._serialized_start=1860
+  _globals['_SENDOPAQUESTATUSREQUEST']._serialized_end=1921
+  _globals['_PARTIALREQUEST']._serialized_start=1923
+  _globals['_PARTIALREQUEST']._serialized_end=2028
+  _globals['_TURNREQUEST']._serialized_start=2030
+  _globals['_TURNREQUEST']._serialized_end=2091
+  _globals['_HEALTHCHECKREQUEST']._serialized_start=2093
+  _globals['_HEALTHCHECKREQUEST']._serialized_end=2113
+  _globals['_HEALTHCHECKRESPONSE']._serialized_start=2115
+  _globals['_HEALTHCHECKRESPONSE']._serialized_end=2156
+  _globals['_PINGREQUEST']._serialized_start=2158
+  _globals['_PINGREQUEST']._serialized_end=2188
+  _globals['_PINGRESPONSE']._serialized_start=2190
+  _globals['_PINGRESPONSE']._serialized_end=2204
+  _globals['_EMPTY']._serialized_start=2206
+  _globals['_EMPTY']._serialized_end=2213
+  _globals['_NODESERVICE']._serialized_start=2216
+  _globals['_NODESERVICE']._serialized_end=2987
 # @@protoc_insertion_point(module_scope)
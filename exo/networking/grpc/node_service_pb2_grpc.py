@@ -54,10 +54,10 @@ class NodeServiceStub(object):
                 request_serializer=node__service__pb2.GetInferenceResultRequest.SerializeToString,
                 response_deserializer=node__service__pb2.InferenceResult.FromString,
                 _registered_method=True)
-        self.CollectTopology = channel.unary_unary(
-                '/node_service.NodeService/CollectTopology',
-                request_serializer=node__service__pb2.CollectTopologyRequest.SerializeToString,
-                response_deserializer=node__service__pb2.Topology.FromString,
+        self.GossipTopology = channel.unary_unary(
+                '/node_service.NodeService/GossipTopology',
+                request_serializer=node__service__pb2.GossipTopologyRequest.SerializeToString,
+                response_deserializer=node__service__pb2.GossipTopologyResponse.FromString,
                 _registered_method=True)
         self.SendResult = channel.unary_unary(
                 '/node_service.NodeService/SendResult',
@@ -69,11 +69,26 @@ class NodeServiceStub(object):
                 request_serializer=node__service__pb2.SendOpaqueStatusRequest.SerializeToString,
                 response_deserializer=node__service__pb2.Empty.FromString,
                 _registered_method=True)
+        self.SendPartial = channel.unary_unary(
+                '/node_service.NodeService/SendPartial',
+                request_serializer=node__service__pb2.PartialRequest.SerializeToString,
+                response_deserializer=node__service__pb2.Empty.FromString,
+                _registered_method=True)
+        self.SendTurn = channel.unary_unary(
+                '/node_service.NodeService/SendTurn',
+                request_serializer=node__service__pb2.TurnRequest.SerializeToString,
+                response_deserializer=node__service__pb2.Empty.FromString,
+                _registered_method=True)
         self.HealthCheck = channel.unary_unary(
                 '/node_service.NodeService/HealthCheck',
                 request_serializer=node__service__pb2.HealthCheckRequest.SerializeToString,
                 response_deserializer=node__service__pb2.HealthCheckResponse.FromString,
                 _registered_method=True)
+        self.Ping = channel.unary_unary(
+                '/node_service.NodeService/Ping',
+                request_serializer=node__service__pb2.PingRequest.SerializeToString,
+                response_deserializer=node__service__pb2.PingResponse.FromString,
+                _registered_method=True)
 
 
 class NodeServiceServicer(object):
@@ -97,7 +112,7 @@ class NodeServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
-    def CollectTopology(self, request, context):
+    def GossipTopology(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
@@ -115,12 +130,30 @@ class NodeServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SendPartial(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SendTurn(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def HealthCheck(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def Ping(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_NodeServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -139,10 +172,10 @@ def add_NodeServiceServicer_to_server(servicer, server):
                     request_deserializer=node__service__pb2.GetInferenceResultRequest.FromString,
                     response_serializer=node__service__pb2.InferenceResult.SerializeToString,
             ),
-            'CollectTopology': grpc.unary_unary_rpc_method_handler(
-                    servicer.CollectTopology,
-                    request_deserializer=node__service__pb2.CollectTopologyRequest.FromString,
-                    response_serializer=node__service__pb2.Topology.SerializeToString,
+            'GossipTopology': grpc.unary_unary_rpc_method_handler(
+                    servicer.GossipTopology,
+                    request_deserializer=node__service__pb2.GossipTopologyRequest.FromString,
+                    response_serializer=node__service__pb2.GossipTopologyResponse.SerializeToString,
             ),
             'SendResult': grpc.unary_unary_rpc_method_handler(
                     servicer.SendResult,
@@ -154,11 +187,26 @@ def add_NodeServiceServicer_to_server(servicer, server):
                     request_deserializer=node__service__pb2.SendOpaqueStatusRequest.FromString,
                     response_serializer=node__service__pb2.Empty.SerializeToString,
             ),
+            'SendPartial': grpc.unary_unary_rpc_method_handler(
+                    servicer.SendPartial,
+                    request_deserializer=node__service__pb2.PartialRequest.FromString,
+                    response_serializer=node__service__pb2.Empty.SerializeToString,
+            ),
+            'SendTurn': grpc.unary_unary_rpc_method_handler(
+                    servicer.SendTurn,
+                    request_deserializer=node__service__pb2.TurnRequest.FromString,
+                    response_serializer=node__service__pb2.Empty.SerializeToString,
+            ),
             'HealthCheck': grpc.unary_unary_rpc_method_handler(
                     servicer.HealthCheck,
                     request_deserializer=node__service__pb2.HealthCheckRequest.FromString,
                     response_serializer=node__service__pb2.HealthCheckResponse.SerializeToString,
             ),
+            'Ping': grpc.unary_unary_rpc_method_handler(
+                    servicer.Ping,
+                    request_deserializer=node__service__pb2.PingRequest.FromString,
+                    response_serializer=node__service__pb2.PingResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'node_service.NodeService', rpc_method_handlers)
@@ -252,7 +300,7 @@ class NodeService(object):
             _registered_method=True)
 
     @staticmethod
-    def CollectTopology(request,
+    def GossipTopology(request,
             target,
             options=(),
             channel_credentials=None,
@@ -265,9 +313,9 @@ class NodeService(object):
         return grpc.experimental.unary_unary(
             request,
             target,
-            '/node_service.NodeService/CollectTopology',
-            node__service__pb2.CollectTopologyRequest.SerializeToString,
-            node__service__pb2.Topology.FromString,
+            '/node_service.NodeService/GossipTopology',
+            node__service__pb2.GossipTopologyRequest.SerializeToString,
+            node__service__pb2.GossipTopologyResponse.FromString,
             options,
             channel_credentials,
             insecure,
@@ -332,6 +380,60 @@ class NodeService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def SendPartial(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.NodeService/SendPartial',
+            node__service__pb2.PartialRequest.SerializeToString,
+            node__service__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SendTurn(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.NodeService/SendTurn',
+            node__service__pb2.TurnRequest.SerializeToString,
+            node__service__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def HealthCheck(request,
             target,
@@ -358,3 +460,30 @@ class NodeService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def Ping(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.NodeService/Ping',
+            node__service__pb2.PingRequest.SerializeToString,
+            node__service__pb2.PingResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+from unittest import mock
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.orchestration.node import Node
+from exo.topology.device_capabilities import UNKNOWN_DEVICE_CAPABILITIES
+
+
+class TestGRPCPeerHandleHealthCheck(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.node = mock.AsyncMock(spec=Node)
+    self.server = GRPCServer(self.node, "localhost", 50061)
+    await self.server.start()
+    self.peer = GRPCPeerHandle("peer", "localhost:50061", UNKNOWN_DEVICE_CAPABILITIES, health_check_ttl=60)
+
+  async def asyncTearDown(self):
+    await self.peer.disconnect()
+    await self.server.stop()
+
+  async def test_health_check_is_cached_within_ttl(self):
+    self.assertTrue(await self.peer.health_check())
+    with mock.patch.object(self.peer.stub, "HealthCheck", side_effect=AssertionError("should not probe")):
+      self.assertTrue(await self.peer.health_check())
+
+  async def test_concurrent_health_checks_share_one_probe(self):
+    await self.peer.connect()
+    real_health_check = self.peer.stub.HealthCheck
+    calls = []
+
+    async def counting_health_check(request):
+      calls.append(request)
+      return await real_health_check(request)
+
+    with mock.patch.object(self.peer.stub, "HealthCheck", side_effect=counting_health_check):
+      results = await asyncio.gather(*[self.peer.health_check() for _ in range(5)])
+    self.assertEqual(results, [True]*5)
+    self.assertEqual(len(calls), 1)
+
+  async def test_data_traffic_marks_peer_alive(self):
+    await self.peer.connect()
+    self.assertEqual(self.peer.last_alive, 0.0)
+    await self.peer.send_result("request", [1, 2, 3], False)
+    self.assertGreater(self.peer.last_alive, 0.0)
+    with mock.patch.object(self.peer.stub, "HealthCheck", side_effect=AssertionError("should not probe")):
+      self.assertTrue(await self.peer.health_check())
+
+  async def test_stale_peer_is_probed(self):
+    self.assertTrue(await self.peer.health_check())
+    await self.server.stop()
+    self.peer.last_alive -= 61
+    self.assertFalse(await self.peer.health_check())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,64 @@
+import asyncio
+import statistics
+import time
+from typing import Dict, List
+from exo.networking.peer_handle import PeerHandle
+from exo.topology.topology import LinkStats
+from exo.helpers import DEBUG
+
+
+async def measure_rtts(peer: PeerHandle, samples: int, timeout: float) -> List[float]:
+  rtts = []
+  for _ in range(samples):
+    start = time.perf_counter()
+    await asyncio.wait_for(peer.ping(), timeout=timeout)
+    rtts.append(time.perf_counter() - start)
+  return rtts
+
+
+async def probe_link(peer: PeerHandle, samples: int = 5, payload_size: int = 1024*1024, timeout: float = 5) -> LinkStats:
+  # Probes go over the same transport as tensors, so they include serialization overhead the forward pass also pays.
+  await asyncio.wait_for(peer.ping(), timeout=timeout)  # warm up the connection
+  rtts = await measure_rtts(peer, samples, timeout)
+  rtt = statistics.median(rtts)
+  jitter = statistics.mean(abs(a - b) for a, b in zip(rtts, rtts[1:])) if len(rtts) > 1 else 0.0
+  payload = bytes(payload_size)
+  start = time.perf_counter()
+  await asyncio.wait_for(peer.ping(payload), timeout=timeout)
+  transfer_time = max(time.perf_counter() - start - rtt, 1e-6)
+  return LinkStats(rtt=rtt, jitter=jitter, throughput=payload_size/transfer_time)
+
+
+class LinkProber:
+  def __init__(self, samples: int = 5, payload_size: int = 1024*1024, timeout: float = 5, smoothing: float = 0.5):
+    self.samples = samples
+    self.payload_size = payload_size
+    self.timeout = timeout
+    self.smoothing = smoothing
+    self.stats: Dict[str, LinkStats] = {}
+
+  async def probe(self, peer: PeerHandle) -> LinkStats:
+    measured = await probe_link(peer, self.samples, self.payload_size, self.timeout)
+    previous = self.stats.get(peer.id())
+    if previous is not None:
+      # exponential smoothing so a single noisy probe doesn't flip placement decisions
+      a = self.smoothing
+      measured = LinkStats(
+        rtt=a*measured.rtt + (1 - a)*previous.rtt,
+        jitter=a*measured.jitter + (1 - a)*previous.jitter,
+        throughput=a*measured.throughput + (1 - a)*previous.throughput,
+      )
+    self.stats[peer.id()] = measured
+    return measured
+
+  async def probe_peers(self, peers: List[PeerHandle]) -> Dict[str, LinkStats]:
+    # Peers are probed one at a time so throughput probes don't compete for the same uplink.
+    for peer in peers:
+      try:
+        await self.probe(peer)
+      except Exception as e:
+        if DEBUG >= 2: print(f"Failed to probe link to {peer.id()}@{peer.addr()}: {e}")
+        self.stats.pop(peer.id(), None)
+    peer_ids = {peer.id() for peer in peers}
+    self.stats = {peer_id: stats for peer_id, stats in self.stats.items() if peer_id in peer_ids}
+    return self.stats
@@ -1,9 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Dict
 import numpy as np
 from exo.inference.shard import Shard
 from exo.topology.device_capabilities import DeviceCapabilities
-from exo.topology.topology import Topology
+from exo.topology.gossip import TopologyEntry
 
 class PeerHandle(ABC):
   @abstractmethod
@@ -34,6 +34,10 @@ class PeerHandle(ABC):
   async def health_check(self) -> bool:
     pass
 
+  @abstractmethod
+  async def ping(self, payload: bytes = b"") -> None:
+    pass
+
   @abstractmethod
   async def send_prompt(self, shard: Shard, prompt: str, image_str: Optional[str] = None, request_id: Optional[str] = None, inference_state: Optional[str] = None) -> Optional[np.array]:
     pass
@@ -46,10 +50,18 @@ class PeerHandle(ABC):
   async def send_result(self, request_id: str, result: List[int], is_finished: bool) -> None:
     pass
 
+  @abstractmethod
+  async def send_partial(self, request_id: str, step: int, node_id: str, tensor: np.ndarray) -> None:
+    pass
+
+  @abstractmethod
+  async def send_turn(self, request_id: str, call: int, turn: int) -> None:
+    pass
+
   @abstractmethod
   async def get_inference_result(self, request_id: str) -> Tuple[Optional[np.ndarray], bool]:
     pass
 
   @abstractmethod
-  async def collect_topology(self, visited: set[str], max_depth: int) -> Topology:
+  async def gossip_topology(self, node_id: str, digest: Dict[str, int], entries: List[TopologyEntry]) -> Tuple[Dict[str, int], List[TopologyEntry]]:
     pass
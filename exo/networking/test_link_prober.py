@@ -0,0 +1,42 @@
+import asyncio
+import unittest
+from unittest import mock
+from exo.networking.peer_handle import PeerHandle
+from exo.networking.link_prober import LinkProber, probe_link
+
+
+def create_peer(peer_id: str, rtt: float, throughput: float):
+  peer = mock.AsyncMock(spec=PeerHandle)
+  peer.id.return_value = peer_id
+  peer.addr.return_value = f"{peer_id}:50051"
+
+  async def ping(payload: bytes = b""):
+    await asyncio.sleep(rtt + len(payload)/throughput)
+
+  peer.ping.side_effect = ping
+  return peer
+
+
+class TestLinkProber(unittest.IsolatedAsyncioTestCase):
+  async def test_probe_link(self):
+    stats = await probe_link(create_peer("peer1", 0.01, 100*1024*1024), samples=3)
+    self.assertAlmostEqual(stats.rtt, 0.01, delta=0.005)
+    self.assertLess(stats.jitter, 0.005)
+    self.assertAlmostEqual(stats.throughput, 100*1024*1024, delta=40*1024*1024)
+
+  async def test_probe_peers_drops_failed_and_departed_peers(self):
+    prober = LinkProber(samples=2, payload_size=1024)
+    peer1, peer2 = create_peer("peer1", 0.001, 1e9), create_peer("peer2", 0.001, 1e9)
+    await prober.probe_peers([peer1, peer2])
+    self.assertEqual(set(prober.stats), {"peer1", "peer2"})
+
+    peer2.ping.side_effect = ConnectionError("unreachable")
+    await prober.probe_peers([peer1, peer2])
+    self.assertEqual(set(prober.stats), {"peer1"})
+
+    await prober.probe_peers([])
+    self.assertEqual(prober.stats, {})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import struct
+from dataclasses import dataclass
+from typing import Optional, Union
+from exo.topology.device_capabilities import DeviceCapabilities
+
+# Wire format for UDP discovery. Every datagram starts with a fixed header:
+#   magic (3s) | protocol version (B) | message type (B) | capabilities hash (8s)
+# followed by a type specific body. Presence messages are broadcast every interval and only carry a hash of the
+# sender's device capabilities; the full capabilities are requested by unicast whenever a listener sees a hash it
+# does not know yet.
+MAGIC = b"EXO"
+PROTOCOL_VERSION = 1
+CAPABILITIES_HASH_SIZE = 8
+
+MSG_PRESENCE = 1
+MSG_CAPABILITIES_REQUEST = 2
+MSG_CAPABILITIES_RESPONSE = 3
+
+HEADER = struct.Struct(f"!3sBB{CAPABILITIES_HASH_SIZE}s")
+PRESENCE_BODY = struct.Struct("!HB")  # grpc_port, priority; followed by the utf-8 node id
+
+
+@dataclass(frozen=True)
+class Presence:
+  node_id: str
+  grpc_port: int
+  priority: int
+  capabilities_hash: bytes
+
+
+@dataclass(frozen=True)
+class CapabilitiesRequest:
+  capabilities_hash: bytes
+
+
+@dataclass(frozen=True)
+class CapabilitiesResponse:
+  capabilities_hash: bytes
+  device_capabilities: DeviceCapabilities
+
+
+def capabilities_hash(device_capabilities: DeviceCapabilities) -> bytes:
+  return hashlib.sha256(json.dumps(device_capabilities.to_dict(), sort_keys=True).encode("utf-8")).digest()[:CAPABILITIES_HASH_SIZE]
+
+
+def encode_presence(presence: Presence) -> bytes:
+  return HEADER.pack(MAGIC, PROTOCOL_VERSION, MSG_PRESENCE, presence.capabilities_hash) + PRESENCE_BODY.pack(presence.grpc_port, presence.priority) + presence.node_id.encode("utf-8")
+
+
+def encode_capabilities_request(request: CapabilitiesRequest) -> bytes:
+  return HEADER.pack(MAGIC, PROTOCOL_VERSION, MSG_CAPABILITIES_REQUEST, request.capabilities_hash)
+
+
+def encode_capabilities_response(response: CapabilitiesResponse) -> bytes:
+  return HEADER.pack(MAGIC, PROTOCOL_VERSION, MSG_CAPABILITIES_RESPONSE, response.capabilities_hash) + json.dumps(response.device_capabilities.to_dict()).encode("utf-8")
+
+
+def decode_message(data: bytes) -> Optional[Union[Presence, CapabilitiesRequest, CapabilitiesResponse]]:
+  if len(data) < HEADER.size:
+    return None
+  magic, version, message_type, caps_hash = HEADER.unpack_from(data)
+  if magic != MAGIC or version != PROTOCOL_VERSION:
+    return None
+  body = data[HEADER.size:]
+  try:
+    if message_type == MSG_PRESENCE:
+      grpc_port, priority = PRESENCE_BODY.unpack_from(body)
+      node_id = body[PRESENCE_BODY.size:].decode("utf-8")
+      return Presence(node_id, grpc_port, priority, caps_hash) if node_id else None
+    if message_type == MSG_CAPABILITIES_REQUEST:
+      return CapabilitiesRequest(caps_hash)
+    if message_type == MSG_CAPABILITIES_RESPONSE:
+      device_capabilities = DeviceCapabilities(**json.loads(body.decode("utf-8")))
+      # Only trust capabilities that match the hash they are advertised under.
+      return CapabilitiesResponse(caps_hash, device_capabilities) if capabilities_hash(device_capabilities) == caps_hash else None
+  except (struct.error, UnicodeDecodeError, ValueError, TypeError):
+    return None
+  return None
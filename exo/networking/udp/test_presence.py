@@ -0,0 +1,50 @@
+import unittest
+from exo.networking.udp.presence import (
+  Presence,
+  CapabilitiesRequest,
+  CapabilitiesResponse,
+  HEADER,
+  capabilities_hash,
+  decode_message,
+  encode_presence,
+  encode_capabilities_request,
+  encode_capabilities_response,
+)
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+
+
+class TestPresence(unittest.TestCase):
+  def setUp(self):
+    self.caps = DeviceCapabilities(model="MacBook Pro", chip="Apple M3 Max", memory=131072, flops=DeviceFlops(fp32=14.2, fp16=28.4, int8=56.8))
+    self.caps_hash = capabilities_hash(self.caps)
+
+  def test_presence_round_trip(self):
+    presence = Presence(node_id="node1", grpc_port=50051, priority=1, capabilities_hash=self.caps_hash)
+    data = encode_presence(presence)
+    self.assertEqual(decode_message(data), presence)
+    self.assertLess(len(data), 32)
+
+  def test_capabilities_round_trip(self):
+    self.assertEqual(decode_message(encode_capabilities_request(CapabilitiesRequest(self.caps_hash))), CapabilitiesRequest(self.caps_hash))
+    response = decode_message(encode_capabilities_response(CapabilitiesResponse(self.caps_hash, self.caps)))
+    self.assertEqual(response.device_capabilities, self.caps)
+
+  def test_capabilities_hash_changes_with_capabilities(self):
+    other = DeviceCapabilities(model="MacBook Pro", chip="Apple M3 Max", memory=65536, flops=self.caps.flops)
+    self.assertEqual(capabilities_hash(self.caps), self.caps_hash)
+    self.assertNotEqual(capabilities_hash(other), self.caps_hash)
+
+  def test_rejects_invalid_messages(self):
+    self.assertIsNone(decode_message(b""))
+    self.assertIsNone(decode_message(b'{"type": "discovery", "node_id": "node1"}'))
+    data = bytearray(encode_presence(Presence("node1", 50051, 1, self.caps_hash)))
+    data[3] += 1  # protocol version
+    self.assertIsNone(decode_message(bytes(data)))
+    self.assertIsNone(decode_message(encode_presence(Presence("node1", 50051, 1, self.caps_hash))[:HEADER.size + 1]))
+
+  def test_rejects_capabilities_not_matching_hash(self):
+    self.assertIsNone(decode_message(encode_capabilities_response(CapabilitiesResponse(b"\0"*8, self.caps))))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,6 +1,6 @@
 import asyncio
-import json
 import socket
+import statistics
 import time
 import traceback
 from typing import List, Dict, Callable, Tuple, Coroutine
@@ -8,6 +8,17 @@ from exo.networking.discovery import Discovery
 from exo.networking.peer_handle import PeerHandle
 from exo.topology.device_capabilities import DeviceCapabilities, device_capabilities, UNKNOWN_DEVICE_CAPABILITIES
 from exo.helpers import DEBUG, DEBUG_DISCOVERY, get_all_ip_addresses
+from exo.networking.link_prober import measure_rtts
+from exo.networking.udp.presence import (
+  Presence,
+  CapabilitiesRequest,
+  CapabilitiesResponse,
+  capabilities_hash,
+  decode_message,
+  encode_presence,
+  encode_capabilities_request,
+  encode_capabilities_response,
+)
 
 class ListenProtocol(asyncio.DatagramProtocol):
   def __init__(self, on_message: Callable[[bytes, Tuple[str, int]], Coroutine]):
@@ -23,14 +34,19 @@ class ListenProtocol(asyncio.DatagramProtocol):
 
 
 class BroadcastProtocol(asyncio.DatagramProtocol):
-  def __init__(self, message: str, broadcast_port: int):
-    self.message = message
-    self.broadcast_port = broadcast_port
+  def __init__(self, on_message: Callable[[bytes, Tuple[str, int]], Coroutine]):
+    super().__init__()
+    self.on_message = on_message
+    self.transport = None
 
   def connection_made(self, transport):
     sock = transport.get_extra_info("socket")
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    transport.sendto(self.message.encode("utf-8"), ("<broadcast>", self.broadcast_port))
+    self.transport = transport
+
+  def datagram_received(self, data, addr):
+    # capability requests from listeners are unicast back to the socket the presence was broadcast from
+    asyncio.create_task(self.on_message(data, addr))
 
 
 class UDPDiscovery(Discovery):
@@ -44,6 +60,9 @@ class UDPDiscovery(Discovery):
     broadcast_interval: int = 1,
     discovery_timeout: int = 30,
     device_capabilities: DeviceCapabilities = UNKNOWN_DEVICE_CAPABILITIES,
+    max_broadcast_interval: float = 8,
+    broadcast_backoff: float = 2,
+    address_switch_threshold: float = 0.8,
   ):
     self.node_id = node_id
     self.node_port = node_port
@@ -53,7 +72,18 @@ class UDPDiscovery(Discovery):
     self.broadcast_interval = broadcast_interval
     self.discovery_timeout = discovery_timeout
     self.device_capabilities = device_capabilities
+    # Once the set of known peers stops changing, broadcasts back off towards max_broadcast_interval. It is capped so
+    # that peers still hear from us several times per discovery_timeout.
+    self.max_broadcast_interval = max(broadcast_interval, min(max_broadcast_interval, discovery_timeout/3))
+    self.broadcast_backoff = broadcast_backoff
     self.known_peers: Dict[str, Tuple[PeerHandle, float, float, int]] = {}
+    self.address_probed_at: Dict[Tuple[str, str], float] = {}
+    self.address_switch_threshold = address_switch_threshold
+    self.capabilities_cache: Dict[bytes, DeviceCapabilities] = {}
+    self.capabilities_requested_at: Dict[bytes, float] = {}
+    self.broadcast_transports: Dict[str, asyncio.DatagramTransport] = {}
+    self.listen_transport = None
+    self.peers_changed = asyncio.Event()
     self.broadcast_task = None
     self.listen_task = None
     self.cleanup_task = None
@@ -70,6 +100,12 @@ class UDPDiscovery(Discovery):
     if self.cleanup_task: self.cleanup_task.cancel()
     if self.broadcast_task or self.listen_task or self.cleanup_task:
       await asyncio.gather(self.broadcast_task, self.listen_task, self.cleanup_task, return_exceptions=True)
+    for transport in self.broadcast_transports.values():
+      transport.close()
+    self.broadcast_transports = {}
+    if self.listen_transport:
+      self.listen_transport.close()
+      self.listen_transport = None
 
   async def discover_peers(self, wait_for_peers: int = 0) -> List[PeerHandle]:
     if wait_for_peers > 0:
@@ -78,73 +114,117 @@ class UDPDiscovery(Discovery):
         await asyncio.sleep(0.1)
     return [peer_handle for peer_handle, _, _, _ in self.known_peers.values()]
 
+  def on_peers_changed(self):
+    self.peers_changed.set()
+
+  async def update_broadcast_transports(self, addrs: List[str]):
+    for addr in [addr for addr in self.broadcast_transports if addr not in addrs]:
+      self.broadcast_transports.pop(addr).close()
+    for addr in addrs:
+      if addr in self.broadcast_transports and not self.broadcast_transports[addr].is_closing():
+        continue
+      try:
+        transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(
+          lambda: BroadcastProtocol(self.on_listen_message),
+          local_addr=(addr, 0),
+          family=socket.AF_INET
+        )
+        self.broadcast_transports[addr] = transport
+      except Exception as e:
+        print(f"Error creating broadcast socket ({addr}): {e}")
+
   async def task_broadcast_presence(self):
     if DEBUG_DISCOVERY >= 2: print("Starting task_broadcast_presence...")
 
+    interval = self.broadcast_interval
     while True:
       # Explicitly broadcasting on all assigned ips since broadcasting on `0.0.0.0` on MacOS does not broadcast over
       # the Thunderbolt bridge when other connection modalities exist such as WiFi or Ethernet
-      for addr in get_all_ip_addresses():
-        message = json.dumps({
-          "type": "discovery",
-          "node_id": self.node_id,
-          "grpc_port": self.node_port,
-          "device_capabilities": self.device_capabilities.to_dict(),
-          "priority": 1, # For now, every interface has the same priority. We can make this better by prioriting interfaces based on bandwidth, latency, and jitter e.g. prioritise Thunderbolt over WiFi.
-        })
-        if DEBUG_DISCOVERY >= 3: print(f"Broadcasting presence at ({addr}): {message}")
-
-        transport = None
+      await self.update_broadcast_transports(get_all_ip_addresses())
+      message = encode_presence(Presence(
+        node_id=self.node_id,
+        grpc_port=self.node_port,
+        priority=1, # Every interface has the same priority; between equal priorities the listener keeps the address with the lowest measured rtt.
+        capabilities_hash=capabilities_hash(self.device_capabilities),
+      ))
+      for addr, transport in list(self.broadcast_transports.items()):
+        if DEBUG_DISCOVERY >= 3: print(f"Broadcasting presence at ({addr}): {len(message)} bytes")
         try:
-          transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(
-            lambda: BroadcastProtocol(message, self.broadcast_port),
-            local_addr=(addr, 0),
-            family=socket.AF_INET
-          )
-          if DEBUG_DISCOVERY >= 3:
-            print(f"Broadcasting presence at ({addr})")
+          transport.sendto(message, ("<broadcast>", self.broadcast_port))
         except Exception as e:
           print(f"Error in broadcast presence ({addr}): {e}")
-        finally:
-          if transport:
-            try:
-              transport.close()
-            except Exception as e:
-              if DEBUG_DISCOVERY >= 2: print(f"Error closing transport: {e}")
-              if DEBUG_DISCOVERY >= 2: traceback.print_exc()
-      await asyncio.sleep(self.broadcast_interval)
+          self.broadcast_transports.pop(addr, None)
+          transport.close()
 
-  async def on_listen_message(self, data, addr):
-    if not data:
+      try:
+        await asyncio.wait_for(self.peers_changed.wait(), timeout=interval)
+        interval = self.broadcast_interval
+      except asyncio.TimeoutError:
+        interval = min(interval*self.broadcast_backoff, self.max_broadcast_interval)
+      self.peers_changed.clear()
+
+  async def request_capabilities(self, caps_hash: bytes, addr: Tuple[str, int]):
+    if self.listen_transport is None or time.time() - self.capabilities_requested_at.get(caps_hash, 0) < self.broadcast_interval:
       return
+    self.capabilities_requested_at[caps_hash] = time.time()
+    if DEBUG_DISCOVERY >= 2: print(f"Requesting capabilities {caps_hash.hex()} from {addr}")
+    self.listen_transport.sendto(encode_capabilities_request(CapabilitiesRequest(caps_hash)), addr)
 
-    decoded_data = data.decode("utf-8", errors="ignore")
+  async def is_faster_address(self, peer_id: str, address: str, device_capabilities: DeviceCapabilities) -> bool:
+    # The same peer is reachable on several interfaces with the same priority (e.g. Thunderbolt and WiFi). Compare
+    # round trip times, at most once per discovery_timeout per address, and only switch for a clear improvement.
+    if time.time() - self.address_probed_at.get((peer_id, address), 0) < self.discovery_timeout:
+      return False
+    self.address_probed_at[(peer_id, address)] = time.time()
+    existing_handle = self.known_peers[peer_id][0]
+    candidate_handle = self.create_peer_handle(peer_id, address, device_capabilities)
+    try:
+      existing_rtt = statistics.median(await measure_rtts(existing_handle, 3, timeout=1))
+      candidate_rtt = statistics.median(await measure_rtts(candidate_handle, 3, timeout=1))
+      if DEBUG_DISCOVERY >= 1: print(f"Peer {peer_id}: rtt {existing_rtt*1000:.2f}ms at {existing_handle.addr()}, {candidate_rtt*1000:.2f}ms at {address}")
+      return candidate_rtt < existing_rtt*self.address_switch_threshold
+    except Exception as e:
+      if DEBUG_DISCOVERY >= 2: print(f"Failed to compare addresses for {peer_id}: {e}")
+      return False
+    finally:
+      await candidate_handle.disconnect()
 
-    # Check if the decoded data starts with a valid JSON character
-    if not (decoded_data.strip() and decoded_data.strip()[0] in "{["):
-      if DEBUG_DISCOVERY >= 2: print(f"Received invalid JSON data from {addr}: {decoded_data[:100]}")
+  async def on_listen_message(self, data, addr):
+    if not data:
       return
 
-    try:
-      decoder = json.JSONDecoder(strict=False)
-      message = decoder.decode(decoded_data)
-    except json.JSONDecodeError as e:
-      if DEBUG_DISCOVERY >= 2: print(f"Error decoding JSON data from {addr}: {e}")
+    message = decode_message(data)
+    if message is None:
+      if DEBUG_DISCOVERY >= 2: print(f"Received invalid discovery message from {addr}: {data[:100]}")
       return
 
     if DEBUG_DISCOVERY >= 2: print(f"received from peer {addr}: {message}")
 
-    if message["type"] == "discovery" and message["node_id"] != self.node_id:
-      peer_id = message["node_id"]
+    if isinstance(message, CapabilitiesRequest):
+      if message.capabilities_hash == capabilities_hash(self.device_capabilities) and self.listen_transport is not None:
+        self.listen_transport.sendto(encode_capabilities_response(CapabilitiesResponse(message.capabilities_hash, self.device_capabilities)), addr)
+      return
+
+    if isinstance(message, CapabilitiesResponse):
+      self.capabilities_cache[message.capabilities_hash] = message.device_capabilities
+      self.capabilities_requested_at.pop(message.capabilities_hash, None)
+      return
+
+    if message.node_id != self.node_id:
+      peer_id = message.node_id
       peer_host = addr[0]
-      peer_port = message["grpc_port"]
-      peer_prio = message["priority"]
-      device_capabilities = DeviceCapabilities(**message["device_capabilities"])
+      peer_port = message.grpc_port
+      peer_prio = message.priority
+      device_capabilities = self.capabilities_cache.get(message.capabilities_hash)
+      if device_capabilities is None:
+        # full capabilities are only fetched when a peer advertises a hash we have not seen before
+        await self.request_capabilities(message.capabilities_hash, addr)
+        return
 
-      if peer_id not in self.known_peers or self.known_peers[peer_id][0].addr() != f"{peer_host}:{peer_port}":
-        if peer_id in self.known_peers:
+      if peer_id not in self.known_peers or self.known_peers[peer_id][0].addr() != f"{peer_host}:{peer_port}" or self.known_peers[peer_id][0].device_capabilities() != device_capabilities:
+        if peer_id in self.known_peers and self.known_peers[peer_id][0].addr() != f"{peer_host}:{peer_port}":
           existing_peer_prio = self.known_peers[peer_id][3]
-          if existing_peer_prio >= peer_prio:
+          if existing_peer_prio > peer_prio or (existing_peer_prio == peer_prio and not await self.is_faster_address(peer_id, f"{peer_host}:{peer_port}", device_capabilities)):
             if DEBUG >= 1: print(f"Ignoring peer {peer_id} at {peer_host}:{peer_port} with priority {peer_prio} because we already know about a peer with higher or equal priority: {existing_peer_prio}")
             return
         new_peer_handle = self.create_peer_handle(peer_id, f"{peer_host}:{peer_port}", device_capabilities)
@@ -153,16 +233,19 @@ class UDPDiscovery(Discovery):
           return
         if DEBUG >= 1: print(f"Adding {peer_id=} at {peer_host}:{peer_port}. Replace existing peer_id: {peer_id in self.known_peers}")
         self.known_peers[peer_id] = (new_peer_handle, time.time(), time.time(), peer_prio)
+        self.on_peers_changed()
       else:
         if not await self.known_peers[peer_id][0].health_check():
           if DEBUG >= 1: print(f"Peer {peer_id} at {peer_host}:{peer_port} is not healthy. Removing.")
-          if peer_id in self.known_peers: del self.known_peers[peer_id]
+          if peer_id in self.known_peers:
+            del self.known_peers[peer_id]
+            self.on_peers_changed()
           return
         if peer_id in self.known_peers: self.known_peers[peer_id] = (self.known_peers[peer_id][0], self.known_peers[peer_id][1], time.time(), peer_prio)
 
   async def task_listen_for_peers(self):
-    await asyncio.get_event_loop().create_datagram_endpoint(lambda: ListenProtocol(self.on_listen_message),
-                                                            local_addr=("0.0.0.0", self.listen_port))
+    self.listen_transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(lambda: ListenProtocol(self.on_listen_message),
+                                                                                     local_addr=("0.0.0.0", self.listen_port))
     if DEBUG_DISCOVERY >= 2: print("Started listen task")
 
   async def task_cleanup_peers(self):
@@ -182,6 +265,7 @@ class UDPDiscovery(Discovery):
         for peer_id in peers_to_remove:
           if peer_id in self.known_peers:
             del self.known_peers[peer_id]
+            self.on_peers_changed()
             if DEBUG_DISCOVERY >= 2: print(f"Removed peer {peer_id} due to inactivity or failed health check.")
       except Exception as e:
         print(f"Error in cleanup peers: {e}")
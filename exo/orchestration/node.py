@@ -1,9 +1,10 @@
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Dict
 import numpy as np
 from abc import ABC, abstractmethod
 from exo.helpers import AsyncCallbackSystem
 from exo.inference.shard import Shard
 from exo.topology.topology import Topology
+from exo.topology.gossip import TopologyEntry
 
 
 class Node(ABC):
@@ -28,7 +29,19 @@ class Node(ABC):
     pass
 
   @abstractmethod
-  async def collect_topology(self, visited: set[str] = set(), max_depth: int = 2) -> Topology:
+  async def collect_topology(self) -> Topology:
+    pass
+
+  @abstractmethod
+  async def handle_topology_gossip(self, node_id: str, digest: Dict[str, int], entries: List[TopologyEntry]) -> Tuple[Dict[str, int], List[TopologyEntry]]:
+    pass
+
+  @abstractmethod
+  def handle_partial(self, request_id: str, step: int, node_id: str, tensor: np.ndarray) -> None:
+    pass
+
+  @abstractmethod
+  def handle_turn(self, request_id: str, call: int, turn: int) -> None:
     pass
 
   @property
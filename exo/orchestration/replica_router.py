@@ -0,0 +1,32 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class ReplicaRouter:
+  """
+  Tracks which replica (identified by the ring's node ids) every in-flight request runs on, from the assignments and
+  results all nodes broadcast, and sends new requests to the replica with the fewest in flight.
+  """
+  def __init__(self, max_request_age: float = 600.0):
+    self.max_request_age = max_request_age
+    self.assignments: Dict[str, Tuple[Tuple[str, ...], float]] = {}
+
+  def assign(self, request_id: str, replica: List[str]) -> None:
+    self.assignments[request_id] = (tuple(replica), time.time())
+
+  def finish(self, request_id: str) -> None:
+    self.assignments.pop(request_id, None)
+
+  def get_replica(self, request_id: Optional[str]) -> Optional[Tuple[str, ...]]:
+    assignment = self.assignments.get(request_id)
+    return assignment[0] if assignment else None
+
+  def queue_depth(self, replica: List[str]) -> int:
+    # requests that never report finishing (e.g. a node died mid request) stop counting after max_request_age
+    now = time.time()
+    self.assignments = {request_id: (r, t) for request_id, (r, t) in self.assignments.items() if now - t < self.max_request_age}
+    return sum(1 for r, _ in self.assignments.values() if r == tuple(replica))
+
+  def choose(self, replicas: List[List[str]], node_id: str) -> List[str]:
+    # least loaded replica; on a tie prefer our own ring, which saves forwarding the prompt
+    return min(replicas, key=lambda replica: (self.queue_depth(replica), node_id not in replica, replicas.index(replica)))
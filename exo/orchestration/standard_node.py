@@ -6,11 +6,20 @@ import time
 import traceback
 from typing import List, Dict, Optional, Tuple, Union, Set
 from exo.networking import Discovery, PeerHandle, Server
+from exo.networking.link_prober import LinkProber
 from exo.inference.inference_engine import InferenceEngine, Shard
 from .node import Node
-from exo.topology.topology import Topology
+from .replica_router import ReplicaRouter
+from .tensor_parallel_exchange import TensorParallelExchange
+from exo.inference.tensor_parallel import TensorParallelContext
+from exo.inference.expert_parallel import Placement
+from exo.inference.kv_blocks import KVCacheFullError
+from exo.topology.topology import Topology, LinkStats
+from exo.topology.gossip import TopologyGossip, TopologyEntry
+from exo.profiling.layer_profile import device_key, load_profiles
 from exo.topology.device_capabilities import device_capabilities
 from exo.topology.partitioning_strategy import Partition, PartitioningStrategy, map_partitions_to_shards
+from exo.topology.replica_planner import plan_replicas, model_size_bytes
 from exo import DEBUG
 from exo.helpers import AsyncCallbackSystem
 from exo.viz.topology_viz import TopologyViz
@@ -29,6 +38,13 @@ class StandardNode(Node):
     max_generate_tokens: int = 1024,
     topology_viz: Optional[TopologyViz] = None,
     shard_downloader: Optional[HFShardDownloader] = None,
+    gossip_fanout: int = 2,
+    link_prober: Optional[LinkProber] = None,
+    link_probe_interval: float = 30.0,
+    max_replicas: int = 1,
+    tensor_parallel_size: int = 1,
+    expert_placement: Optional[Dict[str, Placement]] = None,
+    kv_cache_quantize: Optional[str] = None,
   ):
     self.id = _id
     self.inference_engine = inference_engine
@@ -47,14 +63,35 @@ class StandardNode(Node):
     self.node_download_progress: Dict[str, RepoProgressEvent] = {}
     self.topology_inference_engines_pool: List[List[str]] = []
     self.shard_downloader = shard_downloader
+    self.topology_gossip = TopologyGossip(self.id)
+    self.gossip_fanout = gossip_fanout
+    self.link_prober = link_prober
+    self.link_probe_interval = link_probe_interval
+    self.layer_sizes: Dict[str, List[int]] = {}
+    # models whose layer sizes couldn't be read, tried again when the next request for them comes in
+    self.layer_sizes_failed: Set[str] = set()
+    self.max_replicas = max_replicas
+    self.replica_router = ReplicaRouter()
+    self._on_token.register("replica_router").on_next(self.on_replica_token)
+    self.tensor_parallel_size = tensor_parallel_size
+    self.tensor_parallel_exchange = TensorParallelExchange(self.id, self.get_peer)
+    self.expert_placement = expert_placement or {}
+    self.expert_routing: Dict[str, Dict[str, List[int]]] = {}
+    self._on_token.register("expert_routing").on_next(self.on_expert_routing_token)
+    self.kv_cache_usage: Dict[str, Dict[str, int]] = {}
+    # kept for engines chosen once peers are known, which raise if they can't quantize rather than dropping it
+    self.kv_cache_quantize = kv_cache_quantize
+    self._on_token.register("kv_cache").on_next(self.on_kv_cache_token)
 
   async def start(self, wait_for_peers: int = 0) -> None:
+    self.load_layer_costs()
     await self.server.start()
     await self.discovery.start()
     await self.update_peers(wait_for_peers)
     await self.collect_topology()
     if DEBUG >= 2: print(f"Collected topology: {self.topology}")
     asyncio.create_task(self.periodic_topology_collection(1.0))
+    if self.link_prober: asyncio.create_task(self.periodic_link_probing(self.link_probe_interval))
 
   async def stop(self) -> None:
     await self.discovery.stop()
@@ -73,6 +110,12 @@ class StandardNode(Node):
         elif status_data.get("status", "").startswith("end_"):
           if status_data.get("node_id") == self.current_topology.active_node_id:
             self.current_topology.active_node_id = None
+      if status_data.get("type", "") == "replica_assignment":
+        self.replica_router.assign(request_id, status_data.get("replica"))
+      if status_data.get("type", "") == "expert_routing":
+        self.expert_routing.setdefault(status_data.get("model_id"), {}).update(status_data.get("layers", {}))
+      if status_data.get("type", "") == "kv_cache":
+        self.kv_cache_usage[status_data.get("node_id")] = status_data.get("usage", {})
       download_progress = None
       if status_data.get("type", "") == "download_progress":
         if DEBUG >= 8: print(f"Download progress from {status_data.get('node_id')}: {status_data.get('progress')}")
@@ -84,6 +127,34 @@ class StandardNode(Node):
       if DEBUG >= 1: print(f"Error updating visualization: {e}")
       if DEBUG >= 1: traceback.print_exc()
 
+  def on_replica_token(self, request_id: str, tokens: List[int], is_finished: bool) -> None:
+    if is_finished:
+      self.replica_router.finish(request_id)
+      self.tensor_parallel_exchange.finish(request_id)
+      asyncio.create_task(self.inference_engine.finish_request(request_id))
+
+  def on_expert_routing_token(self, request_id: str, tokens: List[int], is_finished: bool) -> None:
+    # every node shares the routing counts of its MoE layers once a request is done, see /v1/experts
+    routing_stats = self.inference_engine.routing_stats
+    if is_finished and routing_stats is not None and routing_stats.counts:
+      status = {"type": "expert_routing", "node_id": self.id, "model_id": self.inference_engine.shard.model_id, "layers": routing_stats.to_dict()}
+      asyncio.create_task(self.broadcast_opaque_status(request_id, json.dumps(status)))
+
+  def on_kv_cache_token(self, request_id: str, tokens: List[int], is_finished: bool) -> None:
+    # how much of each node's kv cache budget is in use, see /v1/kv_cache
+    kv_blocks = self.inference_engine.kv_blocks
+    if is_finished and kv_blocks is not None:
+      status = {"type": "kv_cache", "node_id": self.id, "usage": kv_blocks.to_dict()}
+      asyncio.create_task(self.broadcast_opaque_status(request_id, json.dumps(status)))
+
+  def load_layer_costs(self) -> Dict[str, List[float]]:
+    # decode latencies from `exo profile` runs on this device are gossiped so that partitioning can use them
+    profiles = load_profiles(device_key(self.device_capabilities), self.inference_engine.__class__.__name__) if self.inference_engine else {}
+    layer_costs = {model_id: profile.layer_latencies(1) for model_id, profile in profiles.items() if all(1 in layer.latency for layer in profile.layers)}
+    if DEBUG >= 1 and layer_costs: print(f"Loaded layer profiles for {list(layer_costs.keys())}")
+    self.topology_gossip.update_local(self.device_capabilities, {peer.id() for peer in self.peers}, layer_costs=layer_costs)
+    return layer_costs
+
   def get_supported_inference_engines(self):
     supported_engine_names = []
     if self.inference_engine.__class__.__name__ == 'MLXDynamicShardInferenceEngine':
@@ -105,7 +176,11 @@ class StandardNode(Node):
     return self.topology_inference_engines_pool
 
   async def process_prompt(self, base_shard: Shard, prompt: str, image_str: Optional[str] = None, request_id: Optional[str] = None, inference_state: Optional[str] = None) -> Optional[np.ndarray]:
-    shard = self.get_current_shard(base_shard)
+    if request_id is None:
+      request_id = str(uuid.uuid4())
+    await self.ensure_layer_sizes(base_shard, retry=True)
+    await self.route_request(base_shard, request_id)
+    shard = self.get_current_shard(base_shard, request_id) if self.id in {p.node_id for p in self.get_partitions(base_shard, request_id)} else base_shard
     asyncio.create_task(
       self.broadcast_opaque_status(
         request_id,
@@ -151,15 +226,31 @@ class StandardNode(Node):
       request_id = str(uuid.uuid4())
     if request_id not in self.buffered_token_output:
       self.buffered_token_output[request_id] = ([], False)
-    shard = self.get_current_shard(base_shard)
+    if self.id not in {p.node_id for p in self.get_partitions(base_shard, request_id)}:
+      if DEBUG >= 2: print(f"[{request_id}] no partition on this node, forwarding prompt: {base_shard=} {prompt=} {image_str=}")
+      await self.forward_to_next_shard(base_shard, prompt, request_id, image_str=image_str, inference_state=inference_state)
+      return
+    shard = self.get_current_shard(base_shard, request_id)
+    members = self.get_stage_members(base_shard, request_id)
+    rank = members.index(self.id)
 
     if DEBUG >= 2: print(f"[{request_id}] process prompt: {base_shard=} {shard=} {prompt=} {image_str=}")
     if shard.start_layer != 0:
-      if DEBUG >= 2: print(f"[{request_id}] forwarding to next shard: {base_shard=} {shard=} {prompt=} {image_str=}")
-      await self.forward_to_next_shard(shard, prompt, request_id, image_str=image_str, inference_state=inference_state)
+      # all members of a stage get the prompt on its way round the ring, one of them passes it on
+      if rank == 0 or base_shard != shard:
+        if DEBUG >= 2: print(f"[{request_id}] forwarding to next shard: {base_shard=} {shard=} {prompt=} {image_str=}")
+        await self.forward_to_next_shard(shard, prompt, request_id, image_str=image_str, inference_state=inference_state)
       return
 
-    result, inference_state, is_finished = await self.inference_engine.infer_prompt(request_id, shard, prompt, image_str, inference_state=inference_state)
+    if base_shard != shard and len(members) > 1:
+      # the prompt entered the ring here rather than being sent to this stage, so the rest of the stage needs it too
+      asyncio.create_task(self.send_to_stage([m for m in members if m != self.id], shard, prompt, request_id, image_str=image_str, inference_state=inference_state))
+    async with self.tensor_parallel_exchange.turn(request_id, members):
+      tensor_parallel = self.get_tensor_parallel(members)
+      result, inference_state, is_finished = await self.inference_engine.infer_prompt(request_id, shard, prompt, image_str, inference_state=inference_state, tensor_parallel=tensor_parallel)
+    if rank > 0:
+      # the stage's first node reports and forwards the result, the others hold the same one
+      return None
     is_finished = is_finished or len(self.buffered_token_output[request_id][0]) >= self.max_generate_tokens
     if is_finished:
       self.buffered_token_output[request_id] = (self.buffered_token_output[request_id][0], True)
@@ -183,7 +274,8 @@ class StandardNode(Node):
     request_id: Optional[str] = None,
     inference_state: Optional[str] = None,
   ) -> Optional[np.ndarray]:
-    shard = self.get_current_shard(base_shard)
+    await self.ensure_layer_sizes(base_shard)
+    shard = self.get_current_shard(base_shard, request_id)
     asyncio.create_task(
       self.broadcast_opaque_status(
         request_id,
@@ -232,11 +324,16 @@ class StandardNode(Node):
       request_id = str(uuid.uuid4())
     if request_id not in self.buffered_token_output:
       self.buffered_token_output[request_id] = ([], False)
-    shard = self.get_current_shard(base_shard)
+    shard = self.get_current_shard(base_shard, request_id)
+    members = self.get_stage_members(base_shard, request_id)
 
     try:
       if DEBUG >= 1: print(f"[{request_id}] process_tensor: {tensor.size=} {tensor.shape=}")
-      result, inference_state, is_finished = await self.inference_engine.infer_tensor(request_id, shard, tensor, inference_state=inference_state)
+      async with self.tensor_parallel_exchange.turn(request_id, members):
+        tensor_parallel = self.get_tensor_parallel(members)
+        result, inference_state, is_finished = await self.inference_engine.infer_tensor(request_id, shard, tensor, inference_state=inference_state, tensor_parallel=tensor_parallel)
+      if members.index(self.id) > 0:
+        return None
       is_finished = is_finished or len(self.buffered_token_output[request_id][0]) >= self.max_generate_tokens
       if is_finished:
         self.buffered_token_output[request_id] = (self.buffered_token_output[request_id][0], True)
@@ -251,6 +348,13 @@ class StandardNode(Node):
         asyncio.create_task(self.forward_to_next_shard(shard, result, request_id, inference_state=inference_state))
 
       return np.array(self.buffered_token_output[request_id][0]) if len(self.buffered_token_output[request_id][0]) > 0 else None
+    except KVCacheFullError as e:
+      # this shard turned the request away, so it ends here rather than leaving the api waiting for a timeout
+      print(f"Request {request_id} rejected by shard {shard}: {e}")
+      self.buffered_token_output[request_id] = (self.buffered_token_output[request_id][0], True)
+      self.trigger_on_token_callbacks(request_id, self.buffered_token_output[request_id][0], True)
+      asyncio.create_task(self.broadcast_result(request_id, self.buffered_token_output[request_id][0], True))
+      return None
     except Exception as e:
       print(f"Error processing tensor for shard {shard}: {e}")
       traceback.print_exc()
@@ -267,43 +371,131 @@ class StandardNode(Node):
     if not self.partitioning_strategy:
       if DEBUG >= 1: print("No partitioning strategy found. Skipping forward.")
       return
-    shard = self.get_current_shard(base_shard)
-
-    partitions = self.partitioning_strategy.partition(self.topology)
-    shards = map_partitions_to_shards(self.partitioning_strategy.partition(self.topology), base_shard.n_layers, base_shard.model_id)
-    current_partition_index = next((i for i, p in enumerate(partitions) if p.node_id == self.id), None)
-    if DEBUG >= 1: print(f"Current partition index: {current_partition_index}")
-    if current_partition_index is not None:
-      next_partition_index = (current_partition_index+1) % len(partitions)
-      next_partition: Partition = partitions[next_partition_index]
-      next_shard = shards[next_partition_index]
-      if DEBUG >= 2: print(f"Computed next from: {shard}, {self.topology}. Next partition: {next_partition}")
-
-      if next_partition.node_id == self.id:
+    stages = self.get_stages(base_shard, request_id)
+    current_stage_index = next((i for i, (members, _) in enumerate(stages) if self.id in members), None)
+    if DEBUG >= 1: print(f"Current stage index: {current_stage_index}")
+    if stages:
+      # a node without a partition only ever forwards prompts to the start of the ring
+      next_stage_index = (current_stage_index+1) % len(stages) if current_stage_index is not None else 0
+      next_members, next_shard = stages[next_stage_index]
+      if DEBUG >= 2: print(f"Computed next from: {base_shard}, {self.topology}. Next stage: {next_members} {next_shard}")
+      await self.send_to_stage(next_members, next_shard, tensor_or_prompt, request_id, image_str=image_str, inference_state=inference_state)
+
+  async def send_to_stage(
+    self,
+    members: List[str],
+    shard: Shard,
+    tensor_or_prompt: Union[np.ndarray, str],
+    request_id: str,
+    image_str: Optional[str] = None,
+    inference_state: Optional[str] = None,
+  ) -> None:
+    async def send_to(node_id: str) -> None:
+      if node_id == self.id:
         if isinstance(tensor_or_prompt, np.ndarray):
           await self.process_tensor(shard, tensor_or_prompt, request_id, inference_state=inference_state)
         else:
           await self.process_prompt(shard, tensor_or_prompt, image_str, request_id, inference_state=inference_state)
         return
 
-      target_peer = next((p for p in self.peers if p.id() == next_partition.node_id), None)
+      target_peer = next((p for p in self.peers if p.id() == node_id), None)
       if not target_peer:
-        raise ValueError(f"Peer for {next_partition} not found")
+        raise ValueError(f"Peer for {node_id} not found")
 
       if DEBUG >= 1: print(f"Sending tensor_or_prompt to {target_peer.id()}: {tensor_or_prompt}")
 
       if isinstance(tensor_or_prompt, np.ndarray):
-        await target_peer.send_tensor(next_shard, tensor_or_prompt, request_id=request_id, inference_state=inference_state)
+        await target_peer.send_tensor(shard, tensor_or_prompt, request_id=request_id, inference_state=inference_state)
       else:
-        await target_peer.send_prompt(next_shard, tensor_or_prompt, image_str=image_str, request_id=request_id, inference_state=inference_state)
+        await target_peer.send_prompt(shard, tensor_or_prompt, image_str=image_str, request_id=request_id, inference_state=inference_state)
+
+    # every member of a tensor parallel stage needs the input, and they only make progress together
+    await asyncio.gather(*(send_to(node_id) for node_id in members))
+
+  async def ensure_layer_sizes(self, base_shard: Shard, retry: bool = False) -> None:
+    # Every node reads the same sizes from the model's safetensors headers, so memory-aware partitions agree. A failed
+    # read isn't kept: a node without sizes would split the model differently from its peers, so each new request tries
+    # again rather than every tensor that passes through.
+    if base_shard.model_id in self.layer_sizes or self.shard_downloader is None:
+      return
+    if base_shard.model_id in self.layer_sizes_failed and not retry:
+      return
+    layer_sizes = await self.shard_downloader.get_layer_sizes(base_shard)
+    if layer_sizes is None or len(layer_sizes) != base_shard.n_layers:
+      if DEBUG >= 1: print(f"No layer sizes for {base_shard.model_id}, trying again on its next request")
+      self.layer_sizes_failed.add(base_shard.model_id)
+      return
+    self.layer_sizes_failed.discard(base_shard.model_id)
+    self.layer_sizes[base_shard.model_id] = layer_sizes
+    if DEBUG >= 1: print(f"{base_shard.model_id} needs {sum(layer_sizes)/2**30:.2f}GB across {len(layer_sizes)} layers")
+
+  def get_replicas(self, base_shard: Shard) -> List[List[str]]:
+    layer_sizes = self.layer_sizes.get(base_shard.model_id)
+    return plan_replicas(self.topology, model_size_bytes(base_shard, layer_sizes), self.max_replicas, layer_sizes=layer_sizes)
+
+  async def route_request(self, base_shard: Shard, request_id: str) -> None:
+    # The node a request enters at picks the least loaded replica and tells every node before the prompt moves on, so
+    # the replica's first node knows the request is already routed.
+    replicas = self.get_replicas(base_shard)
+    if len(replicas) < 2 or self.replica_router.get_replica(request_id) in {tuple(replica) for replica in replicas}:
+      return
+    replica = self.replica_router.choose(replicas, self.id)
+    if DEBUG >= 2: print(f"[{request_id}] routing to replica {replica} of {len(replicas)}")
+    self.replica_router.assign(request_id, replica)
+    await self.broadcast_opaque_status(request_id, json.dumps({"type": "replica_assignment", "node_id": self.id, "replica": replica}))
+
+  def get_replica_topology(self, base_shard: Shard, request_id: Optional[str] = None) -> Topology:
+    replicas = self.get_replicas(base_shard)
+    if len(replicas) == 1:
+      return self.topology
+    # the ring the request was routed to, otherwise the one this node is part of
+    replica = self.replica_router.get_replica(request_id)
+    if replica not in {tuple(r) for r in replicas}:
+      replica = next((r for r in replicas if self.id in r), replicas[0])
+    return self.topology.subtopology(set(replica))
+
+  def get_partitions(self, base_shard: Shard, request_id: Optional[str] = None, topology: Optional[Topology] = None) -> List[Partition]:
+    topology = topology or self.get_replica_topology(base_shard, request_id)
+    return self.partitioning_strategy.partition(topology, base_shard, self.layer_sizes.get(base_shard.model_id))
+
+  def get_stages(self, base_shard: Shard, request_id: Optional[str] = None) -> List[Tuple[List[str], Shard]]:
+    # Pipeline stages in ring order. With tensor parallelism every tensor_parallel_size consecutive nodes form one
+    # stage: each of them holds its slice of all layers in the stage, which together take the memory their partitions
+    # would have. Shards come from the same replica's layer costs the partitions were fitted with.
+    topology = self.get_replica_topology(base_shard, request_id)
+    partitions = self.get_partitions(base_shard, request_id, topology)
+    groups = [partitions[i:i + self.tensor_parallel_size] for i in range(0, len(partitions), self.tensor_parallel_size)]
+    merged = [Partition(group[0].node_id, group[0].start, group[-1].end) for group in groups]
+    shards = map_partitions_to_shards(merged, base_shard.n_layers, base_shard.model_id, topology.relative_layer_costs(base_shard.model_id, base_shard.n_layers))
+    return [([p.node_id for p in group], shard) for group, shard in zip(groups, shards)]
+
+  def get_stage_members(self, base_shard: Shard, request_id: Optional[str] = None) -> List[str]:
+    members = next((members for members, _ in self.get_stages(base_shard, request_id) if self.id in members), None)
+    if members is None:
+      raise ValueError(f"No current partition found for node: {self.id}")
+    return members
 
-  def get_current_shard(self, base_shard: Shard) -> Shard:
-    partitions = self.partitioning_strategy.partition(self.topology)
-    shards = map_partitions_to_shards(partitions, base_shard.n_layers, base_shard.model_id)
-    current_partition_index = next((i for i, p in enumerate(partitions) if p.node_id == self.id), None)
-    if current_partition_index is None:
+  def get_current_shard(self, base_shard: Shard, request_id: Optional[str] = None) -> Shard:
+    shard = next((shard for members, shard in self.get_stages(base_shard, request_id) if self.id in members), None)
+    if shard is None:
       raise ValueError(f"No current partition found for node: {self.id}")
-    return shards[current_partition_index]
+    return shard
+
+  def get_tensor_parallel(self, members: List[str]) -> Optional[TensorParallelContext]:
+    if len(members) == 1:
+      return None
+    if not self.inference_engine.supports_tensor_parallel:
+      raise ValueError(f"{self.inference_engine.__class__.__name__} does not support tensor parallelism")
+    return TensorParallelContext(members.index(self.id), len(members), self.tensor_parallel_exchange.bridge(members), self.expert_placement)
+
+  def get_peer(self, node_id: str) -> Optional[PeerHandle]:
+    return next((p for p in self.peers if p.id() == node_id), None)
+
+  def handle_partial(self, request_id: str, step: int, node_id: str, tensor: np.ndarray) -> None:
+    self.tensor_parallel_exchange.receive(request_id, step, node_id, tensor)
+
+  def handle_turn(self, request_id: str, call: int, turn: int) -> None:
+    self.tensor_parallel_exchange.receive_turn(request_id, call, turn)
 
   async def update_peers(self, wait_for_peers: int = 0) -> bool:
     next_peers = await self.discovery.discover_peers(wait_for_peers)
@@ -372,10 +564,11 @@ class StandardNode(Node):
     if len(self.get_topology_inference_engines()):
       if any(len(engines) == 1 and "tinygrad" in engines for engines in self.get_topology_inference_engines()):
         if DEBUG >= 1: print("Found node with only tinygrad, using tinygrad on all nodes")
-        self.inference_engine = get_inference_engine("tinygrad", self.shard_downloader)
+        self.inference_engine = get_inference_engine("tinygrad", self.shard_downloader, kv_cache_quantize=self.kv_cache_quantize)
       else:
         if DEBUG >= 1: print("All nodes can use mlx, using mlx for inference")
-        self.inference_engine = get_inference_engine("mlx", self.shard_downloader) 
+        self.inference_engine = get_inference_engine("mlx", self.shard_downloader, kv_cache_quantize=self.kv_cache_quantize)
+    self.load_layer_costs()
 
   async def periodic_topology_collection(self, interval: int):
     while True:
@@ -383,46 +576,72 @@ class StandardNode(Node):
       try:
         did_peers_change = await self.update_peers()
         if DEBUG >= 2: print(f"{did_peers_change=}")
+        await self.collect_topology()
         if did_peers_change:
-          await self.collect_topology()
           await self.select_best_inference_engine()
       except Exception as e:
         print(f"Error collecting topology: {e}")
         traceback.print_exc()
 
+  async def periodic_link_probing(self, interval: float):
+    while True:
+      try:
+        await self.probe_links()
+      except Exception as e:
+        print(f"Error probing links: {e}")
+        traceback.print_exc()
+      await asyncio.sleep(interval)
+
+  async def probe_links(self) -> Dict[str, LinkStats]:
+    peers = list(self.peers)
+    link_stats = dict(await self.link_prober.probe_peers(peers))
+    if self.topology_gossip.update_local(self.device_capabilities, {peer.id() for peer in peers}, link_stats):
+      self._update_topology_from_gossip()
+    for peer_id, link in link_stats.items():
+      if DEBUG >= 2: print(f"Link {self.id} -> {peer_id}: rtt={link.rtt*1000:.2f}ms jitter={link.jitter*1000:.2f}ms throughput={link.throughput/1e6:.2f}MB/s")
+      # local only, peers learn about our links through topology gossip
+      self.on_opaque_status.trigger_all("", json.dumps({"type": "link_stats", "node_id": self.id, "peer_id": peer_id, **link.to_dict()}))
+    return link_stats
+
   async def get_inference_result(self, request_id: str) -> Tuple[Optional[np.ndarray], bool]:
     if request_id not in self.buffered_token_output:
       return None, False
     return np.array(self.buffered_token_output[request_id][0]), self.buffered_token_output[request_id][1]
 
-  async def collect_topology(self, visited: set[str] = set(), max_depth: int = 4) -> Topology:
-    next_topology = Topology()
-    next_topology.update_node(self.id, self.device_capabilities)
-
-    if DEBUG >= 2: print(f"Collecting topology {max_depth=} {visited=}")
-
-    prev_visited = visited.copy()
-    visited.add(self.id)
-    visited.update(p.id() for p in self.peers)
-
+  async def collect_topology(self) -> Topology:
+    changed = self.topology_gossip.update_local(self.device_capabilities, {peer.id() for peer in self.peers})
     for peer in self.peers:
-      next_topology.update_node(peer.id(), peer.device_capabilities())
-      next_topology.add_edge(self.id, peer.id())
-
-      if peer.id() in prev_visited:
-        continue
-
-      if max_depth <= 0:
-        if DEBUG >= 2: print("Max depth reached. Skipping...")
-        continue
+      changed = self.topology_gossip.seed(peer.id(), peer.device_capabilities()) or changed
 
+    async def gossip_with_peer(peer: PeerHandle) -> bool:
       try:
-        other_topology = await asyncio.wait_for(peer.collect_topology(visited, max_depth=max_depth - 1), timeout=5.0)
-        if DEBUG >= 2: print(f"Collected topology from: {peer.id()}: {other_topology}")
-        self.topology.merge(other_topology)
+        # pull: send our digest only, receive what we are missing along with the peer's digest
+        digest, entries = await asyncio.wait_for(peer.gossip_topology(self.id, self.topology_gossip.digest(), []), timeout=5.0)
+        changed = self.topology_gossip.merge(entries)
+        # push: only if the peer's digest shows it is behind us
+        missing = self.topology_gossip.deltas(digest)
+        if missing:
+          await asyncio.wait_for(peer.gossip_topology(self.id, self.topology_gossip.digest(), missing), timeout=5.0)
+        if DEBUG >= 2: print(f"Gossiped topology with {peer.id()}: received {len(entries)} entries, sent {len(missing)} entries")
+        return changed
       except Exception as e:
-        print(f"Error collecting topology from {peer.id()}: {e}")
+        print(f"Error gossiping topology with {peer.id()}: {e}")
+        return False
+
+    peers_by_id = {peer.id(): peer for peer in self.peers}
+    selected_peer_ids = self.topology_gossip.select_peers(list(peers_by_id.keys()), self.gossip_fanout)
+    results = await asyncio.gather(*[gossip_with_peer(peers_by_id[peer_id]) for peer_id in selected_peer_ids])
+    if changed or any(results) or not self.topology.nodes:
+      return self._update_topology_from_gossip()
+    return self.topology
+
+  async def handle_topology_gossip(self, node_id: str, digest: Dict[str, int], entries: List[TopologyEntry]) -> Tuple[Dict[str, int], List[TopologyEntry]]:
+    if self.topology_gossip.merge(entries):
+      self._update_topology_from_gossip()
+    return self.topology_gossip.digest(), self.topology_gossip.deltas(digest)
 
+  def _update_topology_from_gossip(self) -> Topology:
+    next_topology = self.topology_gossip.to_topology()
     next_topology.active_node_id = self.topology.active_node_id  # this is not so clean.
     self.topology = next_topology
     if self.topology_viz:
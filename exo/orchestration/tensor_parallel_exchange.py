@@ -0,0 +1,124 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from exo.networking import PeerHandle
+from exo.inference.tensor_parallel import sum_partials
+from exo import DEBUG
+
+
+class TensorParallelExchange:
+  """
+  All-reduce over the nodes of a tensor parallel group. Every member sends its partial sum to the others and sums
+  what it receives in member order. Members run the same layers on the same inputs, so the n-th all-reduce of a
+  request lines up across nodes and is matched by (request_id, step, node_id).
+
+  Members also take stage work in the same order, see turn().
+  """
+  def __init__(self, node_id: str, get_peer: Callable[[str], Optional[PeerHandle]], timeout: float = 30.0):
+    self.node_id = node_id
+    self.get_peer = get_peer
+    self.timeout = timeout
+    self.steps: Dict[str, int] = {}
+    self.received: Dict[Tuple[str, int, str], asyncio.Future] = {}
+    # per request count of stage work taken in, the turn the group's first member gave each one, and per group the
+    # next turn to hand out and the first turn not yet run
+    self.calls: Dict[str, int] = {}
+    self.turns: Dict[Tuple[str, int], asyncio.Future] = {}
+    self.next_turn: Dict[Tuple[str, ...], int] = {}
+    self.ran: Dict[Tuple[str, ...], int] = {}
+    self.turn_done: Dict[Tuple[str, ...], asyncio.Condition] = {}
+
+  def _future(self, key: Tuple[str, int, str]) -> asyncio.Future:
+    if key not in self.received:
+      self.received[key] = asyncio.get_running_loop().create_future()
+    return self.received[key]
+
+  def receive(self, request_id: str, step: int, node_id: str, partial: np.ndarray) -> None:
+    future = self._future((request_id, step, node_id))
+    if not future.done(): future.set_result(partial)
+
+  async def all_reduce(self, request_id: str, members: List[str], partial: np.ndarray) -> np.ndarray:
+    step = self.steps.get(request_id, 0)
+    self.steps[request_id] = step + 1
+    others = [node_id for node_id in members if node_id != self.node_id]
+    peers = {node_id: self.get_peer(node_id) for node_id in others}
+    missing = [node_id for node_id, peer in peers.items() if peer is None]
+    if missing:
+      raise ValueError(f"Tensor parallel peers {missing} not found")
+    await asyncio.gather(*(peer.send_partial(request_id, step, self.node_id, partial) for peer in peers.values()))
+    partials = {self.node_id: partial}
+    for node_id in others:
+      key = (request_id, step, node_id)
+      try:
+        partials[node_id] = await asyncio.wait_for(self._future(key), self.timeout)
+      finally:
+        self.received.pop(key, None)
+    if DEBUG >= 8: print(f"[{request_id}] all-reduce {step=} over {members}")
+    return sum_partials([partials[node_id] for node_id in members])
+
+  def bridge(self, members: List[str]) -> Callable[[str, np.ndarray], np.ndarray]:
+    # inference engines run their models on worker threads, the exchange lives on the event loop
+    loop = asyncio.get_running_loop()
+
+    def all_reduce(request_id: str, partial: np.ndarray) -> np.ndarray:
+      return asyncio.run_coroutine_threadsafe(self.all_reduce(request_id, members, partial), loop).result()
+
+    return all_reduce
+
+  def receive_turn(self, request_id: str, call: int, turn: int) -> None:
+    future = self.turns.setdefault((request_id, call), asyncio.get_running_loop().create_future())
+    if not future.done(): future.set_result(turn)
+
+  @asynccontextmanager
+  async def turn(self, request_id: str, members: List[str]) -> AsyncIterator[None]:
+    """
+    Waits for this piece of a request's stage work to be next. Engines run on a single compute thread that blocks in
+    all-reduces, so two members taking two requests in opposite orders would each wait for a partial the other never
+    sends. The group's first member numbers the work as it comes in and the others run it in that order. Work that
+    hasn't reached this member within the timeout is skipped rather than holding up the stage.
+    """
+    if len(members) < 2:
+      yield
+      return
+    group = tuple(members)
+    call = self.calls.get(request_id, 0)
+    self.calls[request_id] = call + 1
+    if members[0] == self.node_id:
+      turn = self.next_turn.get(group, 0)
+      self.next_turn[group] = turn + 1
+      self.receive_turn(request_id, call, turn)
+      peers = [self.get_peer(node_id) for node_id in members[1:]]
+      try:
+        if None in peers: raise ValueError(f"Tensor parallel peers of {members} not found")
+        await asyncio.gather(*(peer.send_turn(request_id, call, turn) for peer in peers))
+      except Exception:
+        await self._ran(group, turn)
+        raise
+    try:
+      turn = await asyncio.wait_for(self.turns.setdefault((request_id, call), asyncio.get_running_loop().create_future()), self.timeout)
+    finally:
+      self.turns.pop((request_id, call), None)
+
+    turn_done = self.turn_done.setdefault(group, asyncio.Condition())
+    async with turn_done:
+      try:
+        await asyncio.wait_for(turn_done.wait_for(lambda: self.ran.get(group, 0) >= turn), self.timeout)
+      except asyncio.TimeoutError:
+        if DEBUG >= 1: print(f"[{request_id}] turns {self.ran.get(group, 0)} to {turn - 1} of {members} never came, skipping them")
+    try:
+      yield
+    finally:
+      await self._ran(group, turn)
+
+  async def _ran(self, group: Tuple[str, ...], turn: int) -> None:
+    turn_done = self.turn_done.setdefault(group, asyncio.Condition())
+    async with turn_done:
+      self.ran[group] = max(self.ran.get(group, 0), turn + 1)
+      turn_done.notify_all()
+
+  def finish(self, request_id: str) -> None:
+    # partials are dropped as they are consumed; one may still be in flight here, so only the counters go
+    self.steps.pop(request_id, None)
+    self.calls.pop(request_id, None)
+    for key in [key for key in self.turns if key[0] == request_id]: self.turns.pop(key)
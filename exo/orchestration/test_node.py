@@ -1,5 +1,5 @@
 import unittest
-from unittest.mock import Mock, AsyncMock
+from unittest.mock import Mock, AsyncMock, patch
 import numpy as np
 
 from .standard_node import StandardNode
@@ -55,3 +55,27 @@ class TestNode(unittest.IsolatedAsyncioTestCase):
     await self.node.process_tensor(input_tensor, None)
 
     self.node.inference_engine.process_shard.assert_called_once_with(input_tensor)
+
+
+class TestSelectInferenceEngine(unittest.IsolatedAsyncioTestCase):
+  def create_node(self, kv_cache_quantize):
+    node = StandardNode("test_node", None, Mock(), Mock(), kv_cache_quantize=kv_cache_quantize)
+    node.broadcast_supported_engines = AsyncMock()
+    node.load_layer_costs = Mock()
+    return node
+
+  async def test_kv_cache_quantize_survives_engine_selection(self):
+    node = self.create_node("int8")
+    node.topology_inference_engines_pool = [["tinygrad"], ["mlx", "tinygrad"]]
+    with patch("exo.orchestration.standard_node.get_inference_engine") as get_inference_engine:
+      await node.select_best_inference_engine()
+    get_inference_engine.assert_called_once_with("tinygrad", None, kv_cache_quantize="int8")
+
+  async def test_engine_that_cannot_quantize_raises(self):
+    node = self.create_node("int8")
+    engine = node.inference_engine
+    node.topology_inference_engines_pool = [["mlx", "tinygrad"]]
+    with self.assertRaises(ValueError):
+      await node.select_best_inference_engine()
+    self.assertIs(node.inference_engine, engine)
+
@@ -0,0 +1,36 @@
+import unittest
+from unittest.mock import patch
+from exo.orchestration.replica_router import ReplicaRouter
+
+
+class TestReplicaRouter(unittest.TestCase):
+  def test_routes_by_queue_depth(self):
+    router = ReplicaRouter()
+    replicas = [["a", "b"], ["c"], ["d", "e"]]
+    self.assertEqual(router.choose(replicas, "d"), ["d", "e"])
+    router.assign("r1", ["d", "e"])
+    self.assertEqual(router.choose(replicas, "d"), ["a", "b"])
+    router.assign("r2", ["a", "b"])
+    router.assign("r3", ["c"])
+    router.assign("r4", ["a", "b"])
+    self.assertEqual(router.queue_depth(["a", "b"]), 2)
+    self.assertEqual(router.choose(replicas, "a"), ["c"])
+    self.assertEqual(router.choose(replicas, "e"), ["d", "e"])
+    router.finish("r2")
+    router.finish("r4")
+    self.assertEqual(router.choose(replicas, "c"), ["a", "b"])
+    self.assertEqual(router.get_replica("r3"), ("c",))
+    self.assertIsNone(router.get_replica("r2"))
+
+  def test_stale_requests_expire(self):
+    router = ReplicaRouter(max_request_age=60)
+    with patch("exo.orchestration.replica_router.time.time", return_value=1000.0):
+      router.assign("r1", ["a"])
+    with patch("exo.orchestration.replica_router.time.time", return_value=1030.0):
+      self.assertEqual(router.queue_depth(["a"]), 1)
+    with patch("exo.orchestration.replica_router.time.time", return_value=1061.0):
+      self.assertEqual(router.queue_depth(["a"]), 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+from unittest import mock
+import numpy as np
+from exo.networking.peer_handle import PeerHandle
+from exo.orchestration.tensor_parallel_exchange import TensorParallelExchange
+
+
+def connect(node_ids, timeout: float = 30.0):
+  exchanges = {}
+  peers = {}
+  for node_id in node_ids:
+    peer = mock.AsyncMock(spec=PeerHandle)
+    peer.send_partial.side_effect = lambda request_id, step, sender, tensor, node_id=node_id: exchanges[node_id].receive(request_id, step, sender, tensor)
+    peer.send_turn.side_effect = lambda request_id, call, turn, node_id=node_id: exchanges[node_id].receive_turn(request_id, call, turn)
+    peers[node_id] = peer
+  for node_id in node_ids:
+    exchanges[node_id] = TensorParallelExchange(node_id, peers.get, timeout)
+  return exchanges
+
+
+class TestTensorParallelExchange(unittest.IsolatedAsyncioTestCase):
+  async def test_all_reduce_sums_in_member_order(self):
+    exchanges = connect(["a", "b", "c"])
+    members = ["b", "a", "c"]
+    partials = {"a": np.array([1.0, 2.0], dtype=np.float16), "b": np.array([10.0, 20.0], dtype=np.float16), "c": np.array([100.0, 200.0], dtype=np.float16)}
+    results = await asyncio.gather(*(exchanges[node_id].all_reduce("r", members, partials[node_id]) for node_id in members))
+    for result in results:
+      np.testing.assert_array_equal(result, np.array([111.0, 222.0], dtype=np.float16))
+      self.assertEqual(result.dtype, np.float16)
+    self.assertEqual(exchanges["a"].received, {})
+
+  async def test_steps_match_partials_sent_ahead(self):
+    # "a" runs two steps ahead of "b"; its partials wait for "b" to reach the same step
+    exchanges = connect(["a", "b"])
+    a = asyncio.create_task(exchanges["a"].all_reduce("r", ["a", "b"], np.ones(2)))
+    await asyncio.sleep(0)
+    b_first = await exchanges["b"].all_reduce("r", ["a", "b"], np.full(2, 2.0))
+    a_second = asyncio.create_task(exchanges["a"].all_reduce("r", ["a", "b"], np.full(2, 3.0)))
+    b_second = await exchanges["b"].all_reduce("r", ["a", "b"], np.full(2, 4.0))
+    np.testing.assert_array_equal(b_first, await a)
+    np.testing.assert_array_equal(b_second, await a_second)
+    np.testing.assert_array_equal(b_second, np.full(2, 7.0))
+    exchanges["a"].finish("r")
+    self.assertNotIn("r", exchanges["a"].steps)
+
+  async def test_bridge_from_worker_thread(self):
+    exchanges = connect(["a", "b"])
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(loop.run_in_executor(None, exchanges[node_id].bridge(["a", "b"]), "r", np.full(3, i + 1.0)) for i, node_id in enumerate(["a", "b"])))
+    for result in results:
+      np.testing.assert_array_equal(result, np.full(3, 3.0))
+
+  async def test_members_take_work_in_the_first_members_order(self):
+    # "b" gets r2 before r1; running r2 first would leave each member blocked in a different request's all-reduce
+    exchanges = connect(["a", "b"], timeout=1.0)
+    ran = {"a": [], "b": []}
+
+    async def run(node_id, request_id):
+      async with exchanges[node_id].turn(request_id, ["a", "b"]):
+        ran[node_id].append(request_id)
+        await exchanges[node_id].all_reduce(request_id, ["a", "b"], np.ones(2))
+
+    b_r2 = asyncio.create_task(run("b", "r2"))
+    await asyncio.sleep(0)
+    await asyncio.gather(run("a", "r1"), run("a", "r2"), run("b", "r1"), b_r2)
+    self.assertEqual(ran, {"a": ["r1", "r2"], "b": ["r1", "r2"]})
+    self.assertEqual(exchanges["b"].turns, {})
+
+  async def test_missing_turn_is_skipped(self):
+    exchanges = connect(["a", "b"], timeout=0.05)
+    exchanges["b"].receive_turn("r2", 0, 1)
+    async with exchanges["b"].turn("r2", ["a", "b"]):
+      pass
+    self.assertEqual(exchanges["b"].ran[("a", "b")], 2)
+
+  async def test_missing_partial_times_out(self):
+    exchanges = connect(["a", "b"], timeout=0.05)
+    with self.assertRaises(asyncio.TimeoutError):
+      await exchanges["a"].all_reduce("r", ["a", "b"], np.ones(2))
+    self.assertEqual(exchanges["a"].received, {})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,88 @@
+import json
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+from exo.helpers import get_exo_home, DEBUG
+from exo.topology.device_capabilities import DeviceCapabilities
+
+
+@dataclass
+class LayerProfile:
+  layer: int
+  latency: Dict[int, float] = field(default_factory=dict)  # sequence length -> seconds per forward pass
+  memory: int = 0  # bytes resident after loading the layer, approximate
+
+  def to_dict(self):
+    return {"layer": self.layer, "latency": {str(seq_len): latency for seq_len, latency in self.latency.items()}, "memory": self.memory}
+
+  @classmethod
+  def from_dict(cls, data: dict) -> "LayerProfile":
+    return cls(layer=data["layer"], latency={int(seq_len): latency for seq_len, latency in data["latency"].items()}, memory=data.get("memory", 0))
+
+
+@dataclass
+class ModelProfile:
+  device: str
+  engine: str
+  model_id: str
+  n_layers: int
+  layers: List[LayerProfile] = field(default_factory=list)
+
+  def layer_latencies(self, seq_len: int = 1) -> List[float]:
+    return [layer.latency[seq_len] for layer in sorted(self.layers, key=lambda layer: layer.layer)]
+
+  def to_dict(self):
+    return {"device": self.device, "engine": self.engine, "model_id": self.model_id, "n_layers": self.n_layers, "layers": [layer.to_dict() for layer in self.layers]}
+
+  @classmethod
+  def from_dict(cls, data: dict) -> "ModelProfile":
+    return cls(device=data["device"], engine=data["engine"], model_id=data["model_id"], n_layers=data["n_layers"], layers=[LayerProfile.from_dict(layer) for layer in data["layers"]])
+
+
+def device_key(device_capabilities: DeviceCapabilities) -> str:
+  return f"{device_capabilities.model} {device_capabilities.chip} {device_capabilities.memory}MB"
+
+
+def get_profiles_dir() -> Path:
+  return get_exo_home()/"profiles"
+
+
+def profile_path(device: str, engine: str, model_id: str) -> Path:
+  name = "--".join(re.sub(r"[^A-Za-z0-9._-]+", "_", part) for part in (device, engine, model_id))
+  return get_profiles_dir()/f"{name}.json"
+
+
+def save_profile(profile: ModelProfile) -> Path:
+  path = profile_path(profile.device, profile.engine, profile.model_id)
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp_path = path.with_suffix(".tmp")
+  tmp_path.write_text(json.dumps(profile.to_dict(), indent=2))
+  tmp_path.replace(path)
+  return path
+
+
+def load_profile(device: str, engine: str, model_id: str) -> Optional[ModelProfile]:
+  path = profile_path(device, engine, model_id)
+  if not path.exists():
+    return None
+  try:
+    return ModelProfile.from_dict(json.loads(path.read_text()))
+  except Exception as e:
+    if DEBUG >= 1: print(f"Ignoring unreadable profile {path}: {e}")
+    return None
+
+
+def load_profiles(device: str, engine: str) -> Dict[str, ModelProfile]:
+  profiles = {}
+  if not get_profiles_dir().exists():
+    return profiles
+  for path in get_profiles_dir().glob("*.json"):
+    try:
+      profile = ModelProfile.from_dict(json.loads(path.read_text()))
+    except Exception as e:
+      if DEBUG >= 1: print(f"Ignoring unreadable profile {path}: {e}")
+      continue
+    if profile.device == device and profile.engine == engine:
+      profiles[profile.model_id] = profile
+  return profiles
@@ -0,0 +1,48 @@
+import asyncio
+import statistics
+import time
+import uuid
+from typing import List, Sequence, Union
+import numpy as np
+import psutil
+from exo.inference.inference_engine import InferenceEngine
+from exo.inference.shard import Shard
+from exo.profiling.layer_profile import LayerProfile, ModelProfile
+from exo.helpers import DEBUG
+
+
+def representative_prompt(seq_len: int) -> str:
+  return " ".join(["the"]*seq_len)
+
+
+async def run_layer(engine: InferenceEngine, shard: Shard, input_data: Union[str, np.ndarray]) -> np.ndarray:
+  if isinstance(input_data, str):
+    output, _, _ = await engine.infer_prompt(str(uuid.uuid4()), shard, input_data)
+  else:
+    output, _, _ = await engine.infer_tensor(str(uuid.uuid4()), shard, input_data)
+  return output
+
+
+async def profile_model(engine: InferenceEngine, engine_name: str, base_shard: Shard, device: str, seq_lens: Sequence[int] = (1, 128), repeats: int = 3) -> ModelProfile:
+  # Layers are run one at a time as single layer shards, each fed the real output of the previous layer so every
+  # layer sees activations of the right shape. The first layer runs on a prompt of roughly seq_len tokens.
+  inputs: List[Union[str, np.ndarray]] = [representative_prompt(seq_len) for seq_len in seq_lens]
+  process = psutil.Process()
+  layers = []
+  for layer in range(base_shard.n_layers):
+    shard = Shard(base_shard.model_id, layer, layer, base_shard.n_layers)
+    rss_before = process.memory_info().rss
+    latency = {}
+    for i, seq_len in enumerate(seq_lens):
+      output = await run_layer(engine, shard, inputs[i])  # warm up: loads the shard and compiles kernels
+      times = []
+      for _ in range(repeats):
+        start = time.perf_counter()
+        await run_layer(engine, shard, inputs[i])
+        times.append(time.perf_counter() - start)
+      latency[seq_len] = statistics.median(times)
+      inputs[i] = output
+    layers.append(LayerProfile(layer=layer, latency=latency, memory=max(0, process.memory_info().rss - rss_before)))
+    if DEBUG >= 1: print(f"Profiled layer {layer}/{base_shard.n_layers - 1}: " + ", ".join(f"seq_len={seq_len} {t*1000:.2f}ms" for seq_len, t in latency.items()))
+    await asyncio.sleep(0)
+  return ModelProfile(device=device, engine=engine_name, model_id=base_shard.model_id, n_layers=base_shard.n_layers, layers=layers)
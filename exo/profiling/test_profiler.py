@@ -0,0 +1,64 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Optional, Tuple
+from unittest import mock
+import numpy as np
+from exo.inference.inference_engine import InferenceEngine
+from exo.inference.shard import Shard
+from exo.profiling.layer_profile import load_profile, load_profiles, save_profile
+from exo.profiling.profiler import profile_model
+
+
+class LayerCostEngine(InferenceEngine):
+  # every layer sleeps proportionally to its index and the number of positions it processes
+  def __init__(self):
+    self.inputs = []
+
+  async def forward(self, shard: Shard, seq_len: int) -> np.ndarray:
+    await asyncio.sleep(0.001*(shard.start_layer + 1)*(1 + seq_len/8))
+    return np.zeros((1, seq_len, 4), dtype=np.float32)
+
+  async def infer_prompt(self, request_id: str, shard: Shard, prompt: str, image_str: Optional[str] = None, inference_state: Optional[str] = None) -> Tuple[np.ndarray, str, bool]:
+    self.inputs.append((shard.start_layer, "prompt"))
+    return await self.forward(shard, len(prompt.split())), "", False
+
+  async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[str] = None) -> Tuple[np.ndarray, str, bool]:
+    self.inputs.append((shard.start_layer, input_data.shape))
+    return await self.forward(shard, input_data.shape[1]), "", False
+
+
+class TestProfiler(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.env = mock.patch.dict(os.environ, {"EXO_HOME": self.tmp_dir.name})
+    self.env.start()
+
+  async def asyncTearDown(self):
+    self.env.stop()
+    self.tmp_dir.cleanup()
+
+  async def test_profile_model(self):
+    engine = LayerCostEngine()
+    profile = await profile_model(engine, "LayerCostEngine", Shard("model", 0, 0, 3), "device", seq_lens=(1, 16), repeats=2)
+
+    self.assertEqual([layer.layer for layer in profile.layers], [0, 1, 2])
+    decode = profile.layer_latencies(1)
+    prefill = profile.layer_latencies(16)
+    self.assertLess(decode[0], decode[2])
+    self.assertTrue(all(p > d for p, d in zip(prefill, decode)))
+    # layers after the first are fed the previous layer's activations
+    self.assertIn((1, (1, 16, 4)), engine.inputs)
+    self.assertNotIn((1, "prompt"), engine.inputs)
+
+  async def test_profile_cache(self):
+    profile = await profile_model(LayerCostEngine(), "LayerCostEngine", Shard("org/model", 0, 0, 2), "Mac Studio Apple M2 Ultra", seq_lens=(1,), repeats=1)
+    save_profile(profile)
+    self.assertEqual(load_profile("Mac Studio Apple M2 Ultra", "LayerCostEngine", "org/model"), profile)
+    self.assertIsNone(load_profile("Mac Studio Apple M2 Ultra", "OtherEngine", "org/model"))
+    self.assertEqual(list(load_profiles("Mac Studio Apple M2 Ultra", "LayerCostEngine").keys()), ["org/model"])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,11 +1,14 @@
 from exo.orchestration import Node
-from prometheus_client import start_http_server, Counter, Histogram
+from prometheus_client import start_http_server, Counter, Histogram, Gauge
 import json
 
 # Create metrics to track time spent and requests made.
 PROCESS_PROMPT_COUNTER = Counter("process_prompt_total", "Total number of prompts processed", ["node_id"])
 PROCESS_TENSOR_COUNTER = Counter("process_tensor_total", "Total number of tensors processed", ["node_id"])
 PROCESS_TENSOR_TIME = Histogram("process_tensor_seconds", "Time spent processing tensor", ["node_id"])
+LINK_RTT = Gauge("link_rtt_seconds", "Round trip time to a peer", ["node_id", "peer_id"])
+LINK_JITTER = Gauge("link_jitter_seconds", "Round trip time jitter to a peer", ["node_id", "peer_id"])
+LINK_THROUGHPUT = Gauge("link_throughput_bytes_per_second", "Achievable throughput to a peer", ["node_id", "peer_id"])
 
 
 def start_metrics_server(node: Node, port: int):
@@ -15,6 +18,12 @@ def start_metrics_server(node: Node, port: int):
     status_data = json.loads(opaque_status)
     _type = status_data.get("type", "")
     node_id = status_data.get("node_id", "")
+    if _type == "link_stats":
+      peer_id = status_data.get("peer_id", "")
+      LINK_RTT.labels(node_id=node_id, peer_id=peer_id).set(status_data.get("rtt", 0))
+      LINK_JITTER.labels(node_id=node_id, peer_id=peer_id).set(status_data.get("jitter", 0))
+      LINK_THROUGHPUT.labels(node_id=node_id, peer_id=peer_id).set(status_data.get("throughput", 0))
+      return
     if _type != "node_status":
       return
     status = status_data.get("status", "")
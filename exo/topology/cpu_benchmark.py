@@ -0,0 +1,95 @@
+import json
+import platform
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+import numpy as np
+from exo.helpers import get_exo_home, DEBUG
+from .device_capabilities import DeviceFlops, TFLOPS
+
+# Sustained throughput of this host's CPU as seen through NumPy: GEMM for compute in each dtype and GEMV, which is
+# what decoding a token mostly is, for memory bandwidth. Measured once per host and cached on disk.
+
+
+def cpu_model_name() -> str:
+  try:
+    for line in Path("/proc/cpuinfo").read_text().splitlines():
+      if line.startswith("model name"):
+        return line.split(":", 1)[1].strip()
+  except OSError:
+    pass
+  return platform.processor() or platform.machine()
+
+
+def measure(fn: Callable[[], object], min_time: float) -> float:
+  # seconds per call, after a warm up call
+  fn()
+  runs = 0
+  start = time.perf_counter()
+  while True:
+    fn()
+    runs += 1
+    elapsed = time.perf_counter() - start
+    if elapsed >= min_time and runs >= 2:
+      return elapsed/runs
+
+
+def gemm_tflops(dtype, n: int, min_time: float) -> float:
+  rng = np.random.default_rng(0)
+  if np.issubdtype(dtype, np.integer):
+    a, b = rng.integers(-128, 127, (n, n), dtype=dtype), rng.integers(-128, 127, (n, n), dtype=dtype)
+    seconds = measure(lambda: np.matmul(a, b, dtype=np.int32), min_time)
+  else:
+    a, b = rng.standard_normal((n, n)).astype(dtype), rng.standard_normal((n, n)).astype(dtype)
+    seconds = measure(lambda: a @ b, min_time)
+  return 2*n**3/seconds/1e12*TFLOPS
+
+
+def gemv_bandwidth(rows: int, cols: int, min_time: float) -> float:
+  # GB/s streaming a float32 matrix that doesn't fit in cache
+  matrix = np.ones((rows, cols), dtype=np.float32)
+  vector = np.ones(cols, dtype=np.float32)
+  seconds = measure(lambda: matrix @ vector, min_time)
+  return matrix.nbytes/seconds/1e9
+
+
+def run_cpu_benchmark(min_time: float = 0.25) -> Tuple[DeviceFlops, float]:
+  # fp16 and int8 have no BLAS path in NumPy and are orders of magnitude slower, so they get smaller problems
+  flops = DeviceFlops(
+    fp32=gemm_tflops(np.float32, 1024, min_time),
+    fp16=gemm_tflops(np.float16, 128, min_time),
+    int8=gemm_tflops(np.int8, 128, min_time),
+  )
+  return flops, gemv_bandwidth(8192, 4096, min_time)
+
+
+def get_benchmark_path() -> Path:
+  return get_exo_home()/"benchmarks"/f"{platform.node() or 'localhost'}.json"
+
+
+@lru_cache(maxsize=1)
+def cpu_benchmark() -> Optional[Tuple[DeviceFlops, float]]:
+  # (flops, memory bandwidth in GB/s), re-measured when the cpu or numpy changes
+  path = get_benchmark_path()
+  key = {"host": platform.node(), "cpu": cpu_model_name(), "numpy": np.__version__}
+  try:
+    cached = json.loads(path.read_text()) if path.exists() else None
+    if cached is not None and all(cached.get(k) == v for k, v in key.items()):
+      return DeviceFlops(**cached["flops"]), cached["memory_bandwidth"]
+  except Exception as e:
+    if DEBUG >= 1: print(f"Ignoring unreadable cpu benchmark {path}: {e}")
+
+  if DEBUG >= 1: print(f"Benchmarking {key['cpu']}...")
+  try:
+    flops, memory_bandwidth = run_cpu_benchmark()
+  except Exception as e:
+    print(f"CPU benchmark failed: {e}")
+    return None
+  if DEBUG >= 1: print(f"CPU benchmark: {flops}, memory bandwidth: {memory_bandwidth:.1f}GB/s")
+  try:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({**key, "flops": flops.to_dict(), "memory_bandwidth": memory_bandwidth}))
+  except OSError as e:
+    if DEBUG >= 1: print(f"Failed to cache cpu benchmark at {path}: {e}")
+  return flops, memory_bandwidth
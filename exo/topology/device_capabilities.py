@@ -1,6 +1,7 @@
 from typing import Any
 from pydantic import BaseModel
 from exo import DEBUG
+import os
 import subprocess
 import psutil
 
@@ -25,16 +26,17 @@ class DeviceCapabilities(BaseModel):
   chip: str
   memory: int
   flops: DeviceFlops
+  memory_bandwidth: float = 0.0  # GB/s, 0 if unknown
 
   def __str__(self):
-    return f"Model: {self.model}. Chip: {self.chip}. Memory: {self.memory}MB. Flops: {self.flops}"
+    return f"Model: {self.model}. Chip: {self.chip}. Memory: {self.memory}MB. Flops: {self.flops}. Memory bandwidth: {self.memory_bandwidth:.1f}GB/s"
 
   def model_post_init(self, __context: Any) -> None:
     if isinstance(self.flops, dict):
       self.flops = DeviceFlops(**self.flops)
 
   def to_dict(self):
-    return {"model": self.model, "chip": self.chip, "memory": self.memory, "flops": self.flops.to_dict()}
+    return {"model": self.model, "chip": self.chip, "memory": self.memory, "flops": self.flops.to_dict(), "memory_bandwidth": self.memory_bandwidth}
 
 
 UNKNOWN_DEVICE_CAPABILITIES = DeviceCapabilities(model="Unknown Model", chip="Unknown Chip", memory=0, flops=DeviceFlops(fp32=0, fp16=0, int8=0))
@@ -208,9 +210,23 @@ def linux_device_capabilities() -> DeviceCapabilities:
       flops=DeviceFlops(fp32=0, fp16=0, int8=0),
     )
   else:
+    # CPU only: there is no table to look the chip up in, so measure it when asked to (--cpu-benchmark or EXO_CPU_BENCHMARK=1)
+    benchmark = None
+    if int(os.getenv("EXO_CPU_BENCHMARK", default="0")):
+      from exo.topology.cpu_benchmark import cpu_benchmark, cpu_model_name
+      benchmark = cpu_benchmark()
+    if benchmark is None:
+      return DeviceCapabilities(
+        model=f"Linux Box (Device: {Device.DEFAULT})",
+        chip=f"Unknown Chip (Device: {Device.DEFAULT})",
+        memory=psutil.virtual_memory().total // 2**20,
+        flops=DeviceFlops(fp32=0, fp16=0, int8=0),
+      )
+    flops, memory_bandwidth = benchmark
     return DeviceCapabilities(
       model=f"Linux Box (Device: {Device.DEFAULT})",
-      chip=f"Unknown Chip (Device: {Device.DEFAULT})",
+      chip=cpu_model_name(),
       memory=psutil.virtual_memory().total // 2**20,
-      flops=DeviceFlops(fp32=0, fp16=0, int8=0),
+      flops=flops,
+      memory_bandwidth=memory_bandwidth,
     )
@@ -0,0 +1,112 @@
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+from .device_capabilities import DeviceCapabilities
+from .topology import Topology, LinkStats
+
+
+@dataclass
+class TopologyEntry:
+  node_id: str
+  version: int
+  device_capabilities: DeviceCapabilities
+  peer_ids: Set[str] = field(default_factory=set)
+  links: Dict[str, LinkStats] = field(default_factory=dict)
+  layer_costs: Dict[str, List[float]] = field(default_factory=dict)  # model id -> profiled seconds per layer
+
+
+# Push-pull anti-entropy over versioned topology entries. Every node owns exactly one entry (its own capabilities and
+# direct peers) and is the only one allowed to bump its version. Nodes exchange digests ({node_id: version}) and only
+# send entries the other side is missing or has an older version of, so a converged cluster only exchanges digests.
+# With every node contacting a random peer each round, an update reaches all n nodes in O(log n) rounds.
+class TopologyGossip:
+  def __init__(self, node_id: str):
+    self.node_id = node_id
+    self.entries: Dict[str, TopologyEntry] = {}
+
+  def _next_version(self, current: int) -> int:
+    # Wall-clock based so that a restarted node supersedes the entry it gossiped before restarting.
+    return max(time.time_ns(), current + 1)
+
+  def update_local(
+    self,
+    device_capabilities: DeviceCapabilities,
+    peer_ids: Set[str],
+    links: Optional[Dict[str, LinkStats]] = None,
+    layer_costs: Optional[Dict[str, List[float]]] = None,
+  ) -> bool:
+    entry = self.entries.get(self.node_id)
+    if links is None: links = entry.links if entry else {}
+    if layer_costs is None: layer_costs = entry.layer_costs if entry else {}
+    links = {peer_id: link for peer_id, link in links.items() if peer_id in peer_ids}
+    if entry is not None and (entry.device_capabilities, entry.peer_ids, entry.links, entry.layer_costs) == (device_capabilities, set(peer_ids), links, layer_costs):
+      return False
+    version = self._next_version(entry.version if entry else 0)
+    self.entries[self.node_id] = TopologyEntry(self.node_id, version, device_capabilities, set(peer_ids), links, layer_costs)
+    self.prune()
+    return True
+
+  def seed(self, node_id: str, device_capabilities: DeviceCapabilities) -> bool:
+    # Version 0 placeholders let directly discovered peers show up before their own entry has been gossiped to us.
+    if node_id in self.entries:
+      return False
+    self.entries[node_id] = TopologyEntry(node_id, 0, device_capabilities, set())
+    return True
+
+  def digest(self) -> Dict[str, int]:
+    return {node_id: entry.version for node_id, entry in self.entries.items()}
+
+  def deltas(self, digest: Dict[str, int]) -> List[TopologyEntry]:
+    return [entry for node_id, entry in self.entries.items() if entry.version > digest.get(node_id, -1)]
+
+  def merge(self, entries: List[TopologyEntry]) -> bool:
+    changed = False
+    for entry in entries:
+      if entry.node_id == self.node_id:
+        local = self.entries.get(self.node_id)
+        if local is not None and entry.version >= local.version:
+          # Someone holds a newer copy of our own entry (e.g. from before a restart), re-assert ours above it.
+          local.version = self._next_version(entry.version)
+          changed = True
+        continue
+      existing = self.entries.get(entry.node_id)
+      if existing is None or entry.version > existing.version:
+        self.entries[entry.node_id] = entry
+        changed = True
+    if changed: self.prune()
+    return changed
+
+  def prune(self) -> None:
+    # Drop entries that are no longer reachable from us through the peer lists nodes advertise about themselves.
+    # A node that leaves disappears from its neighbours' entries and therefore falls out here.
+    if self.node_id not in self.entries:
+      return
+    reachable = {self.node_id}
+    frontier = [self.node_id]
+    while frontier:
+      entry = self.entries.get(frontier.pop())
+      if entry is None: continue
+      for peer_id in entry.peer_ids:
+        if peer_id not in reachable and peer_id in self.entries:
+          reachable.add(peer_id)
+          frontier.append(peer_id)
+    for node_id in [node_id for node_id in self.entries if node_id not in reachable]:
+      del self.entries[node_id]
+
+  def select_peers(self, peer_ids: List[str], fanout: int, rng: Optional[random.Random] = None) -> List[str]:
+    rng = rng or random
+    return rng.sample(peer_ids, min(fanout, len(peer_ids)))
+
+  def to_topology(self) -> Topology:
+    topology = Topology()
+    for node_id, entry in self.entries.items():
+      topology.update_node(node_id, entry.device_capabilities)
+      for model_id, latencies in entry.layer_costs.items():
+        topology.update_layer_costs(node_id, model_id, latencies)
+    for node_id, entry in self.entries.items():
+      for peer_id in entry.peer_ids:
+        if peer_id in self.entries: topology.add_edge(node_id, peer_id)
+      for peer_id, link in entry.links.items():
+        if peer_id in self.entries: topology.update_link(node_id, peer_id, link)
+    return topology
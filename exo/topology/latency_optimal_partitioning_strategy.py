@@ -0,0 +1,165 @@
+import functools
+import itertools
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from .partitioning_strategy import PartitioningStrategy, Partition, InfeasiblePartitionError, memory_budgets, memory_shortfall, fit_partitions_to_memory
+from .topology import Topology, LinkStats
+from .ring_order import DEFAULT_LINK, f32, hop_latency, ring_latency, optimal_ring_order
+from .device_capabilities import TFLOPS
+from exo.inference.shard import Shard
+
+
+def estimate_model_size(model_id: str) -> Tuple[Optional[float], Optional[float]]:
+  # (parameters, bytes) from names like "Meta-Llama-3.1-8B-Instruct-4bit". Used until the partitioner knows real sizes.
+  params = re.search(r"(?:^|[-_/])(\d+(?:\.\d+)?)[bB](?=$|[-_])", model_id)
+  if params is None:
+    return None, None
+  bits = re.search(r"(\d+)bit", model_id)
+  n_params = float(params.group(1))*1e9
+  return n_params, n_params*(int(bits.group(1)) if bits else 16)/8
+
+
+# Minimises per-token pipeline latency: the sum over the ring of each node's compute time for its layers plus the
+# latency of every hop (including the hop back to the first node for the next token). Compute time is linear in the
+# share of layers, so for a fixed set of nodes it is optimal to fill the fastest nodes up to their memory limit. The
+# strategy searches over which nodes take part, trading compute speed against extra hops, and orders each candidate
+# set into its lowest latency ring. Nodes that are not needed get no partition at all. A node's compute speed comes
+# from its profiled layer latencies (exo profile) when it has them and from its flops otherwise; shares are then
+# fractions of the model's profiled compute rather than of layers.
+# When the real layer sizes are known, every candidate placement is snapped to layer edges and checked against each
+# node's memory budget, and a model that fits nowhere raises InfeasiblePartitionError.
+class LatencyOptimalPartitioningStrategy(PartitioningStrategy):
+  def __init__(
+    self,
+    memory_headroom: float = 0.9,
+    activation_bytes: int = 16*1024,
+    default_link: LinkStats = DEFAULT_LINK,
+    max_exhaustive_nodes: int = 8,
+  ):
+    self.memory_headroom = memory_headroom
+    self.activation_bytes = activation_bytes
+    self.default_link = default_link
+    self.max_exhaustive_nodes = max_exhaustive_nodes
+    self._cache: Dict[tuple, List[Partition]] = {}
+
+  def partition(self, topology: Topology, base_shard: Optional[Shard] = None, layer_sizes: Optional[List[int]] = None) -> List[Partition]:
+    node_ids = sorted(topology.nodes.keys())
+    if not node_ids:
+      return []
+    n_params, model_bytes = estimate_model_size(base_shard.model_id) if base_shard else (None, None)
+    fit, layer_costs = None, None
+    if layer_sizes and base_shard:
+      model_bytes = sum(layer_sizes)
+      layer_costs = topology.relative_layer_costs(base_shard.model_id, base_shard.n_layers)
+      budgets = memory_budgets(topology, node_ids, self.memory_headroom)
+      fit = functools.partial(fit_partitions_to_memory, layer_sizes=layer_sizes, budgets=budgets, layer_costs=layer_costs)
+    model_time = self.node_model_time(topology, node_ids, base_shard, 2*(n_params or 8e9), model_bytes)
+    capacity = self.node_capacity(topology, node_ids, model_bytes)
+    hop = {(a, b): self.hop_latency(topology, a, b) for a in node_ids for b in node_ids if a != b}
+
+    key = (tuple(model_time.items()), tuple(capacity.items()), tuple(sorted(hop.items())), tuple(layer_sizes or ()), tuple(layer_costs or ()))
+    if key not in self._cache:
+      partitions = self._solve(node_ids, model_time, capacity, hop, fit)
+      if not partitions and fit is not None:
+        raise InfeasiblePartitionError(base_shard.model_id, model_bytes, int(sum(budgets.values())), memory_shortfall(layer_sizes, list(budgets.values())))
+      if not partitions:
+        # without layer sizes nothing can rule a placement out, so share the layers by memory
+        partitions = self.to_partitions(node_ids, self.node_capacity(topology, node_ids, None))
+      if len(self._cache) > 64: self._cache.clear()
+      self._cache[key] = partitions
+    return self._cache[key]
+
+  def node_model_time(self, topology: Topology, node_ids: List[str], base_shard: Optional[Shard], flops_per_token: float, model_bytes: Optional[float]) -> Dict[str, float]:
+    # seconds for one token through the whole model on each node, from its layer profile if it has one. Otherwise a
+    # roofline estimate: decoding reads every weight once per token, so memory bandwidth bounds it as well as flops.
+    flops = self.node_flops(topology, node_ids)
+    model_time = {}
+    for node_id in node_ids:
+      latencies = topology.get_layer_costs(node_id, base_shard.model_id, base_shard.n_layers) if base_shard else None
+      if latencies:
+        model_time[node_id] = float(np.sum(np.array(latencies, dtype=np.float32), dtype=np.float32))
+        continue
+      model_time[node_id] = flops_per_token/flops[node_id]
+      memory_bandwidth = f32(topology.nodes[node_id].memory_bandwidth)*1e9
+      if model_bytes and memory_bandwidth > 0:
+        model_time[node_id] = max(model_time[node_id], model_bytes/memory_bandwidth)
+    return model_time
+
+  def node_flops(self, topology: Topology, node_ids: List[str]) -> Dict[str, float]:
+    # engines run in whichever precision the device is fastest at, e.g. fp32 on CPUs
+    flops = {node_id: max(f32(topology.nodes[node_id].flops.fp16), f32(topology.nodes[node_id].flops.fp32))*1e12/TFLOPS for node_id in node_ids}
+    known = [f for f in flops.values() if f > 0]
+    # devices we have no numbers for are assumed to be at least as slow as the slowest known one
+    fallback = min(known)/2 if known else 1e12
+    return {node_id: f if f > 0 else fallback for node_id, f in flops.items()}
+
+  def node_capacity(self, topology: Topology, node_ids: List[str], model_bytes: Optional[float]) -> Dict[str, float]:
+    # fraction of the model each node can hold
+    memory = {node_id: topology.nodes[node_id].memory*1024*1024 for node_id in node_ids}
+    if model_bytes:
+      capacity = {node_id: memory[node_id]*self.memory_headroom/model_bytes for node_id in node_ids}
+      if sum(capacity.values()) >= 1:
+        return capacity
+    # unknown model size or it doesn't fit: the only safe assumption is that everyone is full, proportional to memory
+    total_memory = sum(memory.values()) or len(node_ids)
+    return {node_id: (memory[node_id] or 1)/total_memory for node_id in node_ids}
+
+  def hop_latency(self, topology: Topology, from_id: str, to_id: str) -> float:
+    return hop_latency(topology, from_id, to_id, self.activation_bytes, self.default_link)
+
+  def fill(self, node_ids: Sequence[str], model_time: Dict[str, float], capacity: Dict[str, float]) -> Optional[Dict[str, float]]:
+    shares = {}
+    remaining = 1.0
+    for node_id in sorted(node_ids, key=lambda node_id: (model_time[node_id], node_id)):
+      shares[node_id] = min(capacity[node_id], remaining)
+      remaining -= shares[node_id]
+    if remaining > 1e-9:
+      return None
+    return {node_id: share for node_id, share in shares.items() if share > 0}
+
+  def candidate_sets(self, node_ids: List[str], model_time: Dict[str, float]):
+    if len(node_ids) <= self.max_exhaustive_nodes:
+      for size in range(1, len(node_ids) + 1):
+        yield from itertools.combinations(node_ids, size)
+    else:
+      by_speed = sorted(node_ids, key=lambda node_id: (model_time[node_id], node_id))
+      for size in range(1, len(node_ids) + 1):
+        yield tuple(by_speed[:size])
+
+  def to_partitions(self, order: List[str], shares: Dict[str, float]) -> List[Partition]:
+    partitions = []
+    start = 0
+    for node_id in order:
+      end = round(start + shares[node_id], 5)
+      partitions.append(Partition(node_id, start, end))
+      start = end
+    partitions[-1].end = 1.0
+    return partitions
+
+  def _solve(
+    self,
+    node_ids: List[str],
+    model_time: Dict[str, float],
+    capacity: Dict[str, float],
+    hop: Dict[Tuple[str, str], float],
+    fit: Optional[Callable[[List[Partition]], Optional[List[Partition]]]] = None,
+  ) -> List[Partition]:
+    # `fit` snaps a candidate to whole layers within memory budgets, or rejects it
+    best = None
+    for candidate in self.candidate_sets(node_ids, model_time):
+      shares = self.fill(candidate, model_time, capacity)
+      if shares is None:
+        continue
+      order = optimal_ring_order(sorted(shares), hop)
+      partitions = self.to_partitions(order, shares)
+      if fit is not None:
+        partitions = fit(partitions)
+        if partitions is None:
+          continue
+        order = [partition.node_id for partition in partitions]
+        shares = {partition.node_id: partition.end - partition.start for partition in partitions}
+      latency = sum(share*model_time[node_id] for node_id, share in shares.items()) + ring_latency(order, hop)
+      if best is None or latency < best[0] - 1e-12:
+        best = (latency, partitions)
+    return best[1] if best else []
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, List, Optional, Sequence
 from dataclasses import dataclass
 from .topology import Topology
 from exo.inference.shard import Shard
@@ -13,17 +13,52 @@ class Partition:
   end: float
 
 
+class InfeasiblePartitionError(ValueError):
+  def __init__(self, model_id: str, required: int, available: int, shortfall: int):
+    self.model_id = model_id
+    self.required = required
+    self.available = available
+    self.shortfall = shortfall
+    super().__init__(
+      f"Model {model_id} does not fit in the cluster's memory: needs {required/2**30:.2f}GB, {available/2**30:.2f}GB available, short by {shortfall/2**30:.2f}GB. "
+      "Add nodes or use a smaller model."
+    )
+
+
 class PartitioningStrategy(ABC):
   @abstractmethod
-  def partition(self, topology: Topology) -> List[Partition]:
+  def partition(self, topology: Topology, base_shard: Optional[Shard] = None, layer_sizes: Optional[List[int]] = None) -> List[Partition]:
+    """
+    layer_sizes, when known, are the bytes each layer of base_shard needs on the node that runs it (weights plus KV
+    cache). Partitions must then keep every node within its memory budget or raise InfeasiblePartitionError.
+    """
     pass
 
 
-def map_partitions_to_shards(partitions: List[Partition], num_layers: int, model_id: str) -> List[Shard]:
+def layer_boundaries(num_layers: int, layer_costs: Optional[List[float]] = None) -> List[float]:
+  # position of each layer edge in partition space
+  if layer_costs is None:
+    return [k/num_layers for k in range(num_layers + 1)]
+  cumulative = [0.0]
+  for cost in layer_costs:
+    cumulative.append(cumulative[-1] + cost)
+  return [c/(cumulative[-1] or 1) for c in cumulative]
+
+
+def map_partitions_to_shards(partitions: List[Partition], num_layers: int, model_id: str, layer_costs: Optional[List[float]] = None) -> List[Shard]:
+  # With profiled layer costs, partitions are fractions of the model's compute rather than of its layer count.
+  # Boundaries go to the layer edge closest to the partition edge.
+  if layer_costs is not None:
+    cumulative = layer_boundaries(num_layers, layer_costs)
   shards = []
   for i, partition in enumerate(partitions):
-    start_layer = int(partition.start*num_layers)
-    end_layer = int(partition.end*num_layers) - 1
+    if layer_costs is None:
+      # the epsilon keeps exact layer edges (k/num_layers) from rounding down to the previous layer
+      start_layer = int(partition.start*num_layers + 1e-9)
+      end_layer = int(partition.end*num_layers + 1e-9) - 1
+    else:
+      start_layer = min(range(num_layers + 1), key=lambda k: abs(cumulative[k] - partition.start))
+      end_layer = min(range(num_layers + 1), key=lambda k: abs(cumulative[k] - partition.end)) - 1
 
     # Ensure the last partition covers up to num_layers - 1
     if i == len(partitions) - 1:
@@ -38,3 +73,60 @@ def map_partitions_to_shards(partitions: List[Partition], num_layers: int, model
     shards[-1] = Shard(model_id, shards[-1].start_layer, num_layers - 1, num_layers)
 
   return shards
+
+
+def memory_budgets(topology: Topology, node_ids: Sequence[str], memory_headroom: float) -> Dict[str, float]:
+  # bytes of model each node may hold; the headroom leaves room for the OS, the engine and activations
+  return {node_id: topology.nodes[node_id].memory*1024*1024*memory_headroom for node_id in node_ids}
+
+
+def greedy_fill_end(layer_sizes: List[int], start: int, budgets: List[float]) -> int:
+  # first layer that does not fit when each node in turn takes as many layers as it can hold, starting at `start`.
+  # No contiguous placement covers more of the model than this.
+  layer = start
+  for budget in budgets:
+    used = 0
+    while layer < len(layer_sizes) and used + layer_sizes[layer] <= budget:
+      used += layer_sizes[layer]
+      layer += 1
+  return layer
+
+
+def memory_shortfall(layer_sizes: List[int], budgets: List[float]) -> int:
+  return max(int(sum(layer_sizes) - sum(budgets)), sum(layer_sizes[greedy_fill_end(layer_sizes, 0, budgets):]))
+
+
+def fit_partitions_to_memory(partitions: List[Partition], layer_sizes: List[int], budgets: Dict[str, float], layer_costs: Optional[List[float]] = None) -> Optional[List[Partition]]:
+  """
+  Snaps partitions to layer edges and moves the edges as little as possible so that every node's layers fit in its
+  budget, keeping the ring order. Nodes left without layers are dropped. Returns None if no placement in this order fits.
+  """
+  n_layers = len(layer_sizes)
+  boundaries = layer_boundaries(n_layers, layer_costs)
+  order = [partition.node_id for partition in partitions]
+  ends = []
+  start = 0
+  for i, partition in enumerate(partitions):
+    rest = [budgets[node_id] for node_id in order[i + 1:]]
+    used, hi = 0, start
+    while hi < n_layers and used + layer_sizes[hi] <= budgets[partition.node_id]:
+      used += layer_sizes[hi]
+      hi += 1
+    end = n_layers if i == len(partitions) - 1 else min(range(n_layers + 1), key=lambda k: abs(boundaries[k] - partition.end))
+    end = min(max(end, start), hi)
+    # take more layers than asked for while the nodes after this one could not hold the rest
+    while end < hi and greedy_fill_end(layer_sizes, end, rest) < n_layers:
+      end += 1
+    if greedy_fill_end(layer_sizes, end, rest) < n_layers:
+      return None
+    ends.append(end)
+    start = end
+
+  fitted = []
+  start = 0
+  for node_id, end in zip(order, ends):
+    if end > start:
+      fitted.append(Partition(node_id, boundaries[start], boundaries[end]))
+    start = end
+  fitted[-1].end = 1.0
+  return fitted
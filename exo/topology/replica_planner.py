@@ -0,0 +1,47 @@
+from typing import List, Optional
+from .topology import Topology
+from .partitioning_strategy import Partition, fit_partitions_to_memory, memory_budgets
+from .latency_optimal_partitioning_strategy import estimate_model_size
+from exo.inference.shard import Shard
+
+
+def model_size_bytes(base_shard: Shard, layer_sizes: Optional[List[int]] = None) -> Optional[float]:
+  if layer_sizes:
+    return sum(layer_sizes)
+  return estimate_model_size(base_shard.model_id)[1]
+
+
+def fits_layers(topology: Topology, replica: List[str], layer_sizes: List[int], memory_headroom: float = 0.9) -> bool:
+  # whether the replica's nodes, largest first, can split the model along layer edges within their budgets
+  budgets = memory_budgets(topology, replica, memory_headroom)
+  total, start, partitions = sum(budgets.values()), 0.0, []
+  for node_id in replica:
+    partitions.append(Partition(node_id, start, start + budgets[node_id]/total))
+    start = partitions[-1].end
+  return fit_partitions_to_memory(partitions, layer_sizes, budgets) is not None
+
+
+def plan_replicas(
+  topology: Topology, model_bytes: Optional[float], max_replicas: int = 1, memory_headroom: float = 0.9, layer_sizes: Optional[List[int]] = None
+) -> List[List[str]]:
+  """
+  Splits the cluster into as many independent rings as can each hold the whole model, up to max_replicas. Every ring
+  serves requests on its own, so throughput scales with the number of rings while each request only crosses the
+  hops of its own ring. Nodes go largest first to the ring with the least memory so far, which keeps the rings
+  balanced. With an unknown model size, or a model only the whole cluster can hold, there is a single ring. With
+  layer_sizes, every ring also has to hold whole layers, not just enough bytes in total.
+  """
+  node_ids = sorted(topology.nodes, key=lambda node_id: (-topology.nodes[node_id].memory, node_id))
+  if not node_ids or not model_bytes or max_replicas <= 1:
+    return [node_ids]
+  budgets = memory_budgets(topology, node_ids, memory_headroom)
+  for n_replicas in range(min(max_replicas, int(sum(budgets.values())//model_bytes), len(node_ids)), 1, -1):
+    replicas = [[] for _ in range(n_replicas)]
+    replica_budgets = [0.0]*n_replicas
+    for node_id in node_ids:
+      i = min(range(n_replicas), key=lambda i: (replica_budgets[i], i))
+      replicas[i].append(node_id)
+      replica_budgets[i] += budgets[node_id]
+    if all(budget >= model_bytes for budget in replica_budgets) and (not layer_sizes or all(fits_layers(topology, replica, layer_sizes, memory_headroom) for replica in replicas)):
+      return replicas
+  return [node_ids]
@@ -1,13 +1,26 @@
-from typing import List
-from .partitioning_strategy import PartitioningStrategy
-from .topology import Topology
+from typing import List, Optional
+from .partitioning_strategy import PartitioningStrategy, InfeasiblePartitionError, memory_budgets, memory_shortfall, fit_partitions_to_memory
+from .topology import Topology, LinkStats
+from .ring_order import DEFAULT_LINK, hop_latency, optimal_ring_order
 from .partitioning_strategy import Partition
+from exo.inference.shard import Shard
 
 
+# Layers are split in proportion to memory. Once links have been probed, the nodes are arranged into the ring with the
+# lowest total hop latency (starting from the node with the most memory), since every token goes around the whole ring.
 class RingMemoryWeightedPartitioningStrategy(PartitioningStrategy):
-  def partition(self, topology: Topology) -> List[Partition]:
+  def __init__(self, memory_headroom: float = 0.9, activation_bytes: int = 16*1024, default_link: LinkStats = DEFAULT_LINK):
+    self.memory_headroom = memory_headroom
+    self.activation_bytes = activation_bytes
+    self.default_link = default_link
+
+  def partition(self, topology: Topology, base_shard: Optional[Shard] = None, layer_sizes: Optional[List[int]] = None) -> List[Partition]:
     nodes = list(topology.all_nodes())
     nodes.sort(key=lambda x: (x[1].memory, x[0]), reverse=True)
+    if topology.links:
+      hop = {(a, b): hop_latency(topology, a, b, self.activation_bytes, self.default_link) for a, _ in nodes for b, _ in nodes if a != b}
+      order = optimal_ring_order([node_id for node_id, _ in nodes], hop)
+      nodes = [(node_id, topology.nodes[node_id]) for node_id in order]
     total_memory = sum(node[1].memory for node in nodes)
     partitions = []
     start = 0
@@ -15,4 +28,11 @@ class RingMemoryWeightedPartitioningStrategy(PartitioningStrategy):
       end = round(start + (node[1].memory/total_memory), 5)
       partitions.append(Partition(node[0], start, end))
       start = end
-    return partitions
+    if not layer_sizes or not partitions:
+      return partitions
+
+    budgets = memory_budgets(topology, [node[0] for node in nodes], self.memory_headroom)
+    fitted = fit_partitions_to_memory(partitions, layer_sizes, budgets, topology.relative_layer_costs(base_shard.model_id, base_shard.n_layers))
+    if fitted is None:
+      raise InfeasiblePartitionError(base_shard.model_id, sum(layer_sizes), int(sum(budgets.values())), memory_shortfall(layer_sizes, list(budgets.values())))
+    return fitted
@@ -0,0 +1,83 @@
+import functools
+import itertools
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from .topology import Topology, LinkStats
+
+DEFAULT_LINK = LinkStats(rtt=0.005, jitter=0.0, throughput=100*1024*1024)
+
+
+def f32(x: float) -> float:
+  # Values that travel through gossip are float32 on the wire but full precision locally. Every node has to compute
+  # the same partitions, so compare at the precision all nodes share.
+  return float(np.float32(x))
+
+
+def hop_latency(topology: Topology, from_id: str, to_id: str, activation_bytes: int = 16*1024, default_link: LinkStats = DEFAULT_LINK) -> float:
+  # seconds to hand one token's activations from one node to the next; links that were never probed get default_link
+  link = topology.get_link(from_id, to_id) or default_link
+  throughput = f32(link.throughput) or default_link.throughput
+  return f32(link.rtt)/2 + f32(link.jitter) + activation_bytes/throughput
+
+
+def ring_latency(order: Sequence[str], hop: Dict[Tuple[str, str], float]) -> float:
+  if len(order) < 2:
+    return 0.0
+  return sum(hop[(order[i], order[(i + 1) % len(order)])] for i in range(len(order)))
+
+
+def optimal_ring_order(node_ids: Sequence[str], hop: Dict[Tuple[str, str], float], max_exact_nodes: int = 9) -> List[str]:
+  """
+  Orders nodes into the ring with the lowest total hop latency, starting from node_ids[0]. Exact (Held-Karp) up to
+  max_exact_nodes, nearest neighbour improved with 2-opt beyond that. Ties are broken by node order, so every node
+  computes the same ring from the same inputs.
+  """
+  if len(node_ids) <= 2:
+    return list(node_ids)
+  costs = tuple(tuple(hop[(a, b)] if a != b else 0.0 for b in node_ids) for a in node_ids)
+  solve = _held_karp if len(node_ids) <= max_exact_nodes else _two_opt
+  return [node_ids[i] for i in solve(costs)]
+
+
+@functools.lru_cache(maxsize=64)
+def _held_karp(costs: Tuple[Tuple[float, ...], ...]) -> Tuple[int, ...]:
+  n = len(costs)
+  # best[(visited, last)] = (latency of the cheapest path from node 0 through visited ending at last, previous node)
+  best = {(1 | 1 << k, k): (costs[0][k], 0) for k in range(1, n)}
+  for size in range(3, n + 1):
+    for subset in itertools.combinations(range(1, n), size - 1):
+      visited = 1 | sum(1 << k for k in subset)
+      for last in subset:
+        prev_visited = visited & ~(1 << last)
+        best[(visited, last)] = min((best[(prev_visited, prev)][0] + costs[prev][last], prev) for prev in subset if prev != last)
+  full = (1 << n) - 1
+  _, last = min((best[(full, last)][0] + costs[last][0], last) for last in range(1, n))
+  order, visited = [], full
+  while last != 0:
+    order.append(last)
+    visited, last = visited & ~(1 << last), best[(visited, last)][1]
+  return (0, *reversed(order))
+
+
+@functools.lru_cache(maxsize=64)
+def _two_opt(costs: Tuple[Tuple[float, ...], ...]) -> Tuple[int, ...]:
+  n = len(costs)
+
+  def length(order: List[int]) -> float:
+    return sum(costs[order[i]][order[(i + 1) % n]] for i in range(n))
+
+  order = [0]
+  remaining = list(range(1, n))
+  while remaining:
+    nearest = min(remaining, key=lambda k: (costs[order[-1]][k], k))
+    order.append(nearest)
+    remaining.remove(nearest)
+  # links may be asymmetric, so each reversal is scored on the whole ring
+  improved = True
+  while improved:
+    improved = False
+    for i, j in itertools.combinations(range(1, n), 2):
+      candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+      if length(candidate) < length(order) - 1e-12:
+        order, improved = candidate, True
+  return tuple(order)
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from exo.topology import cpu_benchmark
+from exo.topology.device_capabilities import DeviceFlops
+
+
+class TestCpuBenchmark(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.env = mock.patch.dict(os.environ, {"EXO_HOME": self.tmp_dir.name})
+    self.env.start()
+    cpu_benchmark.cpu_benchmark.cache_clear()
+
+  def tearDown(self):
+    cpu_benchmark.cpu_benchmark.cache_clear()
+    self.env.stop()
+    self.tmp_dir.cleanup()
+
+  def test_run_cpu_benchmark(self):
+    flops, memory_bandwidth = cpu_benchmark.run_cpu_benchmark(min_time=0.01)
+    self.assertGreater(flops.fp32, 0)
+    self.assertGreater(flops.fp16, 0)
+    self.assertGreater(flops.int8, 0)
+    self.assertGreater(memory_bandwidth, 0)
+
+  def test_benchmark_is_cached_per_host(self):
+    result = (DeviceFlops(fp32=1.5, fp16=0.1, int8=0.2), 42.0)
+    with mock.patch.object(cpu_benchmark, "run_cpu_benchmark", return_value=result) as run:
+      self.assertEqual(cpu_benchmark.cpu_benchmark(), result)
+      cpu_benchmark.cpu_benchmark.cache_clear()
+      self.assertEqual(cpu_benchmark.cpu_benchmark(), result)
+      self.assertEqual(run.call_count, 1)
+      self.assertTrue(cpu_benchmark.get_benchmark_path().exists())
+
+      cpu_benchmark.cpu_benchmark.cache_clear()
+      with mock.patch.object(cpu_benchmark, "cpu_model_name", return_value="another cpu"):
+        cpu_benchmark.cpu_benchmark()
+      self.assertEqual(run.call_count, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,108 @@
+import math
+import random
+import unittest
+from exo.topology.gossip import TopologyGossip
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+from exo.topology.topology import LinkStats
+
+
+def create_capabilities(memory: int) -> DeviceCapabilities:
+  return DeviceCapabilities(model="test", chip="test", memory=memory, flops=DeviceFlops(fp32=0, fp16=0, int8=0))
+
+
+def exchange(a: TopologyGossip, b: TopologyGossip) -> int:
+  # pull then push, as done by StandardNode over GossipTopology
+  pulled = b.deltas(a.digest())
+  a.merge(pulled)
+  pushed = a.deltas(b.digest())
+  b.merge(pushed)
+  return len(pulled) + len(pushed)
+
+
+def create_cluster(n: int):
+  node_ids = [f"node{i}" for i in range(n)]
+  nodes = {node_id: TopologyGossip(node_id) for node_id in node_ids}
+  for i, node_id in enumerate(node_ids):
+    nodes[node_id].update_local(create_capabilities(1000 + i), set(node_ids) - {node_id})
+  return nodes
+
+
+def run_round(nodes, rng: random.Random):
+  for node_id, gossip in nodes.items():
+    for peer_id in gossip.select_peers([p for p in nodes if p != node_id], 1, rng):
+      exchange(gossip, nodes[peer_id])
+
+
+class TestTopologyGossip(unittest.TestCase):
+  def test_converges_in_logarithmic_rounds(self):
+    rng = random.Random(0)
+    n = 64
+    nodes = create_cluster(n)
+    rounds = 0
+    while any(len(gossip.entries) < n for gossip in nodes.values()):
+      run_round(nodes, rng)
+      rounds += 1
+      self.assertLessEqual(rounds, 3*math.ceil(math.log2(n)))
+
+    topology = nodes["node0"].to_topology()
+    self.assertEqual(len(topology.nodes), n)
+    self.assertEqual(topology.get_node("node5").memory, 1005)
+    self.assertEqual(topology.get_neighbors("node5"), set(nodes) - {"node5"})
+
+  def test_converged_exchange_sends_no_entries(self):
+    rng = random.Random(1)
+    nodes = create_cluster(8)
+    for _ in range(10):
+      run_round(nodes, rng)
+    self.assertEqual(exchange(nodes["node0"], nodes["node1"]), 0)
+
+  def test_only_newer_versions_are_applied(self):
+    nodes = create_cluster(2)
+    exchange(nodes["node0"], nodes["node1"])
+    stale = nodes["node0"].entries["node1"]
+    nodes["node1"].update_local(create_capabilities(4242), {"node0"})
+    exchange(nodes["node0"], nodes["node1"])
+    self.assertEqual(nodes["node0"].entries["node1"].device_capabilities.memory, 4242)
+    self.assertFalse(nodes["node0"].merge([stale]))
+    self.assertEqual(nodes["node0"].entries["node1"].device_capabilities.memory, 4242)
+
+  def test_departed_node_is_pruned(self):
+    rng = random.Random(2)
+    nodes = create_cluster(6)
+    for _ in range(10):
+      run_round(nodes, rng)
+    del nodes["node5"]
+    for node_id, gossip in nodes.items():
+      gossip.update_local(gossip.entries[node_id].device_capabilities, set(nodes) - {node_id})
+    for _ in range(10):
+      run_round(nodes, rng)
+    for gossip in nodes.values():
+      self.assertNotIn("node5", gossip.entries)
+      self.assertNotIn("node5", gossip.to_topology().nodes)
+
+  def test_restarted_node_reasserts_its_own_entry(self):
+    nodes = create_cluster(2)
+    exchange(nodes["node0"], nodes["node1"])
+    old_version = nodes["node0"].entries["node1"].version
+    restarted = TopologyGossip("node1")
+    restarted.entries["node1"] = type(nodes["node1"].entries["node1"])("node1", old_version - 1, create_capabilities(7), {"node0"})
+    nodes["node1"] = restarted
+    exchange(nodes["node1"], nodes["node0"])
+    exchange(nodes["node0"], nodes["node1"])
+    self.assertEqual(nodes["node0"].entries["node1"].device_capabilities.memory, 7)
+
+  def test_link_stats_are_gossiped(self):
+    nodes = create_cluster(3)
+    link = LinkStats(rtt=0.002, jitter=0.0001, throughput=1e9)
+    nodes["node0"].update_local(nodes["node0"].entries["node0"].device_capabilities, {"node1", "node2"}, {"node1": link, "node3": link})
+    self.assertEqual(set(nodes["node0"].entries["node0"].links), {"node1"})
+    exchange(nodes["node0"], nodes["node2"])
+    exchange(nodes["node2"], nodes["node1"])
+    topology = nodes["node1"].to_topology()
+    self.assertEqual(topology.get_link("node0", "node1"), link)
+    self.assertEqual(topology.get_link("node1", "node0"), link)
+    self.assertIsNone(topology.get_link("node0", "node2"))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+import numpy as np
+from exo.inference.shard import Shard
+from exo.topology.latency_optimal_partitioning_strategy import LatencyOptimalPartitioningStrategy, estimate_model_size
+from exo.topology.partitioning_strategy import Partition, InfeasiblePartitionError, map_partitions_to_shards
+from exo.topology.topology import Topology, LinkStats
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+
+GB = 1024  # DeviceCapabilities.memory is in MB
+
+
+def create_topology(nodes, link: LinkStats = LinkStats(rtt=0.001, jitter=0.0, throughput=1e9)) -> Topology:
+  topology = Topology()
+  for node_id, (memory, fp16) in nodes.items():
+    topology.update_node(node_id, DeviceCapabilities(model=node_id, chip=node_id, memory=memory, flops=DeviceFlops(fp32=fp16/2, fp16=fp16, int8=fp16*2)))
+  for a in nodes:
+    for b in nodes:
+      if a != b: topology.update_link(a, b, link)
+  return topology
+
+
+def shares(partitions):
+  return {p.node_id: round(p.end - p.start, 5) for p in partitions}
+
+
+class TestLatencyOptimalPartitioningStrategy(unittest.TestCase):
+  def test_estimate_model_size(self):
+    self.assertEqual(estimate_model_size("mlx-community/Meta-Llama-3.1-8B-Instruct-4bit"), (8e9, 4e9))
+    self.assertEqual(estimate_model_size("unsloth/Llama-3.2-1B-Instruct"), (1e9, 2e9))
+    self.assertEqual(estimate_model_size("mlx-community/DeepSeek-Coder-V2-Lite-Instruct-4bit-mlx"), (None, None))
+
+  def test_fast_node_with_less_memory_gets_more_layers(self):
+    # 70B fp16 (140GB) needs both nodes; the GPU box is filled up to its memory before the slow laptop gets any layers
+    topology = create_topology({"gpu": (96*GB, 100.0), "laptop": (128*GB, 5.0)})
+    partitions = LatencyOptimalPartitioningStrategy().partition(topology, Shard("NousResearch/Meta-Llama-3.1-70B-Instruct", 0, 0, 80))
+    self.assertGreater(shares(partitions)["gpu"], shares(partitions)["laptop"])
+    self.assertAlmostEqual(shares(partitions)["gpu"], 96*1024**3*0.9/140e9, places=4)
+    self.assertEqual(partitions[-1].end, 1.0)
+    self.assertEqual(len(map_partitions_to_shards(partitions, 80, "model")), 2)
+
+  def test_model_that_fits_stays_on_fastest_node(self):
+    topology = create_topology({"gpu": (64*GB, 100.0), "laptop": (128*GB, 5.0), "phone": (8*GB, 1.0)})
+    partitions = LatencyOptimalPartitioningStrategy().partition(topology, Shard("unsloth/Meta-Llama-3.1-8B-Instruct", 0, 0, 32))
+    self.assertEqual(partitions, [Partition("gpu", 0, 1.0)])
+
+  def test_helper_node_trades_compute_against_link_latency(self):
+    # the gpu can hold ~59% of a 70B fp16 model, the rest goes to either a slow node on a fast link or a fast node on a
+    # slow link: 41% of 140 GFLOP is ~11.4ms on "near" and ~1.1ms on "far"
+    def run(far_rtt: float):
+      topology = create_topology({"gpu": (96*GB, 100.0), "near": (128*GB, 5.0), "far": (128*GB, 50.0)}, LinkStats(rtt=0.1, jitter=0.0, throughput=1e8))
+      for peer_id, rtt in [("near", 0.0002), ("far", far_rtt)]:
+        topology.update_link("gpu", peer_id, LinkStats(rtt=rtt, jitter=0.0, throughput=1e10))
+        topology.update_link(peer_id, "gpu", LinkStats(rtt=rtt, jitter=0.0, throughput=1e10))
+      partitions = LatencyOptimalPartitioningStrategy().partition(topology, Shard("NousResearch/Meta-Llama-3.1-70B-Instruct", 0, 0, 80))
+      return sorted(p.node_id for p in partitions)
+
+    self.assertEqual(run(far_rtt=0.04), ["gpu", "near"])
+    self.assertEqual(run(far_rtt=0.002), ["far", "gpu"])
+
+  def test_unknown_model_size_falls_back_to_memory_shares(self):
+    topology = create_topology({"node1": (3000, 10.0), "node2": (1000, 20.0), "node3": (6000, 5.0)})
+    partitions = LatencyOptimalPartitioningStrategy().partition(topology)
+    self.assertEqual(shares(partitions), {"node1": 0.3, "node2": 0.1, "node3": 0.6})
+
+  def test_no_placement_without_layer_sizes_falls_back_to_memory_shares(self):
+    topology = create_topology({"node1": (1*GB, 10.0), "node2": (3*GB, 20.0)})
+    strategy = LatencyOptimalPartitioningStrategy()
+    strategy._solve = lambda *args: []
+    partitions = strategy.partition(topology, Shard("NousResearch/Meta-Llama-3.1-70B-Instruct", 0, 0, 80))
+    self.assertEqual(shares(partitions), {"node1": 0.25, "node2": 0.75})
+
+  def test_ring_follows_fast_links(self):
+    nodes = {n: (48*GB, 10.0) for n in ["a", "b", "c", "d"]}
+    topology = create_topology(nodes, LinkStats(rtt=0.02, jitter=0.0, throughput=1e8))
+    fast = LinkStats(rtt=0.0002, jitter=0.0, throughput=4e9)
+    for a, b in [("a", "c"), ("c", "b"), ("b", "d"), ("d", "a")]:
+      topology.update_link(a, b, fast)
+      topology.update_link(b, a, fast)
+    partitions = LatencyOptimalPartitioningStrategy().partition(topology, Shard("NousResearch/Meta-Llama-3.1-70B-Instruct", 0, 0, 80))
+    order = [p.node_id for p in partitions]
+    self.assertEqual(len(order), 4)
+    for i in range(len(order)):
+      self.assertIs(topology.get_link(order[i], order[(i + 1) % len(order)]), fast)
+
+  def test_layer_profiles_override_flops(self):
+    # "a" claims more flops but its profile shows it is slower than "b" on this model
+    topology = create_topology({"a": (64*GB, 100.0), "b": (64*GB, 10.0)})
+    shard = Shard("unsloth/Meta-Llama-3.1-8B-Instruct", 0, 0, 4)
+    self.assertEqual(LatencyOptimalPartitioningStrategy().partition(topology, shard), [Partition("a", 0, 1.0)])
+    topology.update_layer_costs("a", shard.model_id, [0.004]*4)
+    topology.update_layer_costs("b", shard.model_id, [0.001]*4)
+    self.assertEqual(LatencyOptimalPartitioningStrategy().partition(topology, shard), [Partition("b", 0, 1.0)])
+    self.assertEqual(topology.relative_layer_costs(shard.model_id, 4), [0.25]*4)
+    self.assertIsNone(topology.relative_layer_costs(shard.model_id, 8))
+
+  def test_memory_bandwidth_bounds_decode(self):
+    # cpu nodes with the same fp32 flops, decode time is set by how fast each can stream the 16GB of weights
+    topology = create_topology({"ddr4": (64*GB, 0.0), "ddr5": (64*GB, 0.0)})
+    for node_id, memory_bandwidth in [("ddr4", 20.0), ("ddr5", 60.0)]:
+      topology.nodes[node_id] = topology.nodes[node_id].model_copy(update={"flops": DeviceFlops(fp32=1.0, fp16=0.001, int8=0.002), "memory_bandwidth": memory_bandwidth})
+    shard = Shard("unsloth/Meta-Llama-3.1-8B-Instruct", 0, 0, 32)
+    self.assertEqual(LatencyOptimalPartitioningStrategy().partition(topology, shard), [Partition("ddr5", 0, 1.0)])
+
+  def test_same_result_from_gossiped_float32_values(self):
+    link = LinkStats(rtt=0.0013, jitter=0.0002, throughput=123456789.123)
+    local = create_topology({"a": (16*GB, 14.2), "b": (16*GB, 28.4)}, link)
+    remote = create_topology({"a": (16*GB, float(np.float32(14.2))), "b": (16*GB, float(np.float32(28.4)))}, LinkStats(*(float(np.float32(v)) for v in link.to_dict().values())))
+    shard = Shard("unsloth/Meta-Llama-3.1-8B-Instruct", 0, 0, 32)
+    self.assertEqual(LatencyOptimalPartitioningStrategy().partition(local, shard), LatencyOptimalPartitioningStrategy().partition(remote, shard))
+
+  def test_layer_sizes_keep_every_node_within_memory(self):
+    # name says 8B but the real weights are 20 layers of 1GB plus a 4GB embedding: too big for the fast node alone
+    topology = create_topology({"gpu": (16*GB, 100.0), "laptop": (32*GB, 5.0)})
+    shard = Shard("unsloth/Meta-Llama-3.1-8B-Instruct", 0, 0, 20)
+    layer_sizes = [5*2**30] + [2**30]*19
+    partitions = LatencyOptimalPartitioningStrategy().partition(topology, shard, layer_sizes)
+    shards = map_partitions_to_shards(partitions, 20, shard.model_id)
+    self.assertEqual({p.node_id for p in partitions}, {"gpu", "laptop"})
+    for partition, s in zip(partitions, shards):
+      self.assertLessEqual(sum(layer_sizes[s.start_layer:s.end_layer + 1]), topology.nodes[partition.node_id].memory*1024*1024*0.9)
+    self.assertEqual(sum(s.get_layer_count() for s in shards), 20)
+    gpu_shard = shards[[p.node_id for p in partitions].index("gpu")]
+    self.assertEqual(gpu_shard.get_layer_count(), 10)
+
+  def test_layer_sizes_that_fit_nowhere_raise(self):
+    topology = create_topology({"a": (16*GB, 10.0), "b": (16*GB, 10.0)})
+    with self.assertRaises(InfeasiblePartitionError) as e:
+      LatencyOptimalPartitioningStrategy(memory_headroom=1.0).partition(topology, Shard("model", 0, 0, 40), [2**30]*40)
+    self.assertEqual(e.exception.shortfall, 8*2**30)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -76,6 +76,18 @@ class TestRingMemoryWeightedPartitioningStrategy(unittest.TestCase):
       ],
     )
 
+  def test_map_partitions_to_shards_with_layer_costs(self):
+    # first and last layers carry the embedding and lm_head and cost as much as three regular layers
+    layer_costs = [3.0] + [1.0]*6 + [3.0]
+    partitions = [Partition("node1", 0.0, 0.5), Partition("node2", 0.5, 1.0)]
+    self.assertEqual(map_partitions_to_shards(partitions, 8, "model", layer_costs), [Shard("model", 0, 3, 8), Shard("model", 4, 7, 8)])
+
+    partitions = [Partition("node1", 0.0, 0.25), Partition("node2", 0.25, 0.75), Partition("node3", 0.75, 1.0)]
+    self.assertEqual(
+      map_partitions_to_shards(partitions, 8, "model", layer_costs),
+      [Shard("model", 0, 0, 8), Shard("model", 1, 6, 8), Shard("model", 7, 7, 8)],
+    )
+
 
 if __name__ == "__main__":
   unittest.main()
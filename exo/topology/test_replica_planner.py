@@ -0,0 +1,60 @@
+import unittest
+from exo.inference.shard import Shard
+from exo.topology.replica_planner import plan_replicas, model_size_bytes
+from exo.topology.topology import Topology, LinkStats
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+
+
+def create_topology(memories) -> Topology:
+  topology = Topology()
+  for node_id, memory in memories.items():
+    topology.update_node(node_id, DeviceCapabilities(model=node_id, chip=node_id, memory=memory, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+  return topology
+
+
+class TestReplicaPlanner(unittest.TestCase):
+  def test_model_size_bytes(self):
+    self.assertEqual(model_size_bytes(Shard("unsloth/Meta-Llama-3.1-8B-Instruct", 0, 0, 32)), 16e9)
+    self.assertEqual(model_size_bytes(Shard("unsloth/Meta-Llama-3.1-8B-Instruct", 0, 0, 2), [3, 4]), 7)
+    self.assertIsNone(model_size_bytes(Shard("mlx-community/DeepSeek-Coder-V2-Lite-Instruct-4bit-mlx", 0, 0, 27)))
+
+  def test_single_ring_by_default(self):
+    topology = create_topology({"a": 64*1024, "b": 64*1024})
+    self.assertEqual(plan_replicas(topology, 16e9), [["a", "b"]])
+
+  def test_balanced_replicas(self):
+    # 8B fp16 (16GB) on 64, 32, 16, 16, 16 and 8GB: two rings of ~76GB, or three with 24GB+ each
+    topology = create_topology({"a": 64*1024, "b": 32*1024, "c": 16*1024, "d": 16*1024, "e": 16*1024, "f": 8*1024})
+    replicas = plan_replicas(topology, 16e9, max_replicas=3)
+    self.assertEqual(len(replicas), 3)
+    self.assertEqual(sorted(node_id for replica in replicas for node_id in replica), ["a", "b", "c", "d", "e", "f"])
+    for replica in replicas:
+      self.assertGreaterEqual(sum(topology.nodes[node_id].memory for node_id in replica)*1024*1024*0.9, 16e9)
+    self.assertEqual(len(plan_replicas(topology, 16e9, max_replicas=2)), 2)
+
+  def test_model_that_needs_whole_cluster(self):
+    topology = create_topology({"a": 24*1024, "b": 24*1024, "c": 24*1024})
+    self.assertEqual(plan_replicas(topology, 40e9, max_replicas=8), [["a", "b", "c"]])
+    self.assertEqual(plan_replicas(topology, None, max_replicas=8), [["a", "b", "c"]])
+
+  def test_replicas_hold_whole_layers(self):
+    # 9GB budgets hold one 6GB layer each: two rings of two nodes have the bytes for 18GB but not the three layers
+    topology = create_topology({"a": 10*1024, "b": 10*1024, "c": 10*1024, "d": 10*1024})
+    self.assertEqual(len(plan_replicas(topology, 18e9, max_replicas=2)), 2)
+    self.assertEqual(plan_replicas(topology, 18e9, max_replicas=2, layer_sizes=[6*10**9]*3), [["a", "b", "c", "d"]])
+    self.assertEqual(len(plan_replicas(topology, 16e9, max_replicas=2, layer_sizes=[4*10**9]*4)), 2)
+
+  def test_subtopology(self):
+    topology = create_topology({"a": 1024, "b": 1024, "c": 1024})
+    topology.update_link("a", "b", LinkStats(rtt=0.001, jitter=0.0, throughput=1e9))
+    topology.update_link("b", "c", LinkStats(rtt=0.001, jitter=0.0, throughput=1e9))
+    topology.update_layer_costs("c", "model", [0.1])
+    sub = topology.subtopology({"a", "b"})
+    self.assertEqual(set(sub.nodes), {"a", "b"})
+    self.assertEqual(list(sub.links), [("a", "b")])
+    self.assertEqual(sub.get_neighbors("b"), {"a"})
+    self.assertEqual(sub.layer_costs, {})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -2,7 +2,8 @@ import unittest
 from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
 from exo.topology.topology import Topology
 from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
-from exo.topology.partitioning_strategy import Partition
+from exo.topology.partitioning_strategy import Partition, InfeasiblePartitionError, map_partitions_to_shards
+from exo.inference.shard import Shard
 
 
 class TestRingMemoryWeightedPartitioningStrategy(unittest.TestCase):
@@ -85,6 +86,44 @@ class TestRingMemoryWeightedPartitioningStrategy(unittest.TestCase):
       ],
     )
 
+  def test_partition_fits_layer_sizes(self):
+    # 10 layers of 1GB, plus a 2GB embedding on the first. Memory shares would give the 4GB node 4.8GB of layers.
+    topology = Topology()
+    topology.update_node("big", DeviceCapabilities(model="big", chip="big", memory=8*1024, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+    topology.update_node("small", DeviceCapabilities(model="small", chip="small", memory=4*1024, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+    layer_sizes = [3*2**30] + [2**30]*9
+
+    partitions = RingMemoryWeightedPartitioningStrategy(memory_headroom=1.0).partition(topology, Shard("model", 0, 0, 10), layer_sizes)
+
+    shards = map_partitions_to_shards(partitions, 10, "model")
+    self.assertEqual([p.node_id for p in partitions], ["big", "small"])
+    self.assertEqual(shards, [Shard("model", 0, 5, 10), Shard("model", 6, 9, 10)])
+    for partition, shard in zip(partitions, shards):
+      memory = topology.nodes[partition.node_id].memory*1024*1024
+      self.assertLessEqual(sum(layer_sizes[shard.start_layer:shard.end_layer + 1]), memory)
+
+  def test_partition_reports_shortfall(self):
+    topology = Topology()
+    topology.update_node("node1", DeviceCapabilities(model="node1", chip="node1", memory=4*1024, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+    topology.update_node("node2", DeviceCapabilities(model="node2", chip="node2", memory=4*1024, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+
+    with self.assertRaises(InfeasiblePartitionError) as e:
+      RingMemoryWeightedPartitioningStrategy(memory_headroom=1.0).partition(topology, Shard("model", 0, 0, 10), [2**30]*10)
+    self.assertEqual(e.exception.required, 10*2**30)
+    self.assertEqual(e.exception.available, 8*2**30)
+    self.assertEqual(e.exception.shortfall, 2*2**30)
+    self.assertIn("short by 2.00GB", str(e.exception))
+
+  def test_partition_reports_shortfall_from_layer_granularity(self):
+    # 9GB of memory for 8GB of model, but 3GB layers can't be split across two 4.5GB nodes
+    topology = Topology()
+    topology.update_node("node1", DeviceCapabilities(model="node1", chip="node1", memory=4608, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+    topology.update_node("node2", DeviceCapabilities(model="node2", chip="node2", memory=4608, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+
+    with self.assertRaises(InfeasiblePartitionError) as e:
+      RingMemoryWeightedPartitioningStrategy(memory_headroom=1.0).partition(topology, Shard("model", 0, 0, 3), [3*2**30, 3*2**30, 2*2**30])
+    self.assertEqual(e.exception.shortfall, 2*2**30)
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,62 @@
+import itertools
+import random
+import unittest
+from exo.topology.ring_order import optimal_ring_order, ring_latency, hop_latency
+from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from exo.topology.topology import Topology, LinkStats
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+
+
+def random_hops(node_ids, seed):
+  rng = random.Random(seed)
+  return {(a, b): rng.uniform(0.0001, 0.01) for a in node_ids for b in node_ids if a != b}
+
+
+class TestRingOrder(unittest.TestCase):
+  def test_exact_matches_brute_force(self):
+    node_ids = [f"node{i}" for i in range(7)]
+    for seed in range(5):
+      hop = random_hops(node_ids, seed)
+      best = min(ring_latency([node_ids[0], *rest], hop) for rest in itertools.permutations(node_ids[1:]))
+      order = optimal_ring_order(node_ids, hop)
+      self.assertEqual(order[0], node_ids[0])
+      self.assertEqual(sorted(order), sorted(node_ids))
+      self.assertAlmostEqual(ring_latency(order, hop), best, places=12)
+
+  def test_heuristic_for_large_rings(self):
+    node_ids = [f"node{i:02d}" for i in range(24)]
+    hop = random_hops(node_ids, 0)
+    order = optimal_ring_order(node_ids, hop)
+    self.assertEqual(order[0], node_ids[0])
+    self.assertEqual(sorted(order), node_ids)
+    self.assertLess(ring_latency(order, hop), ring_latency(node_ids, hop))
+    self.assertEqual(order, optimal_ring_order(node_ids, dict(hop)))
+
+  def test_ring_avoids_slow_link(self):
+    # two thunderbolt-bridged macs and two linux boxes on ethernet, with wi-fi between everything else. Sorting by
+    # memory puts both macs next to each other but crosses wi-fi twice more than necessary.
+    topology = Topology()
+    for node_id, memory in [("mac1", 64000), ("linux1", 48000), ("mac2", 32000), ("linux2", 16000)]:
+      topology.update_node(node_id, DeviceCapabilities(model=node_id, chip=node_id, memory=memory, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+    wifi = LinkStats(rtt=0.008, jitter=0.002, throughput=30e6)
+    for a, b in itertools.permutations(topology.nodes, 2):
+      topology.update_link(a, b, wifi)
+    for a, b, link in [("mac1", "mac2", LinkStats(rtt=0.0002, jitter=0.0, throughput=3e9)), ("linux1", "linux2", LinkStats(rtt=0.0005, jitter=0.0, throughput=1e8))]:
+      topology.update_link(a, b, link)
+      topology.update_link(b, a, link)
+
+    partitions = RingMemoryWeightedPartitioningStrategy().partition(topology)
+
+    order = [p.node_id for p in partitions]
+    self.assertEqual(order[0], "mac1")
+    self.assertEqual(partitions[-1].end, 1.0)
+    wifi_hops = sum(topology.get_link(order[i], order[(i + 1) % 4]) is wifi for i in range(4))
+    self.assertEqual(wifi_hops, 2)
+
+  def test_unprobed_links_use_default(self):
+    topology = Topology()
+    self.assertAlmostEqual(hop_latency(topology, "a", "b", activation_bytes=1000, default_link=LinkStats(rtt=0.01, jitter=0.0, throughput=1e6)), 0.006)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,5 +1,17 @@
 from .device_capabilities import DeviceCapabilities
-from typing import Dict, Set, Optional
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Set, Optional, Tuple
+import numpy as np
+
+
+@dataclass
+class LinkStats:
+  rtt: float  # seconds
+  jitter: float  # seconds
+  throughput: float  # bytes per second
+
+  def to_dict(self):
+    return asdict(self)
 
 
 class Topology:
@@ -7,6 +19,8 @@ class Topology:
     self.nodes: Dict[str, DeviceCapabilities] = {}  # Maps node IDs to DeviceCapabilities
     self.peer_graph: Dict[str, Set[str]] = {}  # Adjacency list representing the graph
     self.active_node_id: Optional[str] = None
+    self.links: Dict[Tuple[str, str], LinkStats] = {}  # Maps (from_id, to_id) to link stats measured by from_id
+    self.layer_costs: Dict[str, Dict[str, List[float]]] = {}  # Maps node IDs to profiled seconds per layer for each model ID
 
   def update_node(self, node_id: str, device_capabilities: DeviceCapabilities):
     self.nodes[node_id] = device_capabilities
@@ -25,6 +39,29 @@ class Topology:
     self.peer_graph[node1_id].add(node2_id)
     self.peer_graph[node2_id].add(node1_id)
 
+  def update_link(self, from_id: str, to_id: str, link_stats: LinkStats):
+    self.add_edge(from_id, to_id)
+    self.links[(from_id, to_id)] = link_stats
+
+  def get_link(self, node1_id: str, node2_id: str) -> Optional[LinkStats]:
+    return self.links.get((node1_id, node2_id)) or self.links.get((node2_id, node1_id))
+
+  def update_layer_costs(self, node_id: str, model_id: str, latencies: List[float]):
+    self.layer_costs.setdefault(node_id, {})[model_id] = latencies
+
+  def get_layer_costs(self, node_id: str, model_id: str, n_layers: int) -> Optional[List[float]]:
+    latencies = self.layer_costs.get(node_id, {}).get(model_id)
+    return latencies if latencies is not None and len(latencies) == n_layers else None
+
+  def relative_layer_costs(self, model_id: str, n_layers: int) -> Optional[List[float]]:
+    # Share of the model's compute in each layer, averaged over every node that profiled it. Computed in float32 like
+    # the gossiped values so that all nodes derive the same layer boundaries.
+    profiles = [np.array(latencies, dtype=np.float32) for node_id in sorted(self.layer_costs) if (latencies := self.get_layer_costs(node_id, model_id, n_layers))]
+    profiles = [profile/profile.sum() for profile in profiles if profile.sum() > 0]
+    if not profiles:
+      return None
+    return [float(cost) for cost in np.mean(profiles, axis=0, dtype=np.float32)]
+
   def get_neighbors(self, node_id: str) -> Set[str]:
     return self.peer_graph.get(node_id, set())
 
@@ -42,6 +79,31 @@ class Topology:
     for node_id, neighbors in other.peer_graph.items():
       for neighbor in neighbors:
         self.add_edge(node_id, neighbor)
+    self.links.update(other.links)
+    for node_id, costs in other.layer_costs.items():
+      for model_id, latencies in costs.items():
+        self.update_layer_costs(node_id, model_id, latencies)
+
+  def subtopology(self, node_ids: Set[str]) -> "Topology":
+    # the same topology seen by a subset of the nodes, e.g. one replica
+    topology = Topology()
+    for node_id in node_ids:
+      topology.update_node(node_id, self.nodes[node_id])
+    for node_id in node_ids:
+      for neighbor in self.get_neighbors(node_id) & node_ids:
+        topology.add_edge(node_id, neighbor)
+    topology.links = {(a, b): link for (a, b), link in self.links.items() if a in node_ids and b in node_ids}
+    topology.layer_costs = {node_id: costs for node_id, costs in self.layer_costs.items() if node_id in node_ids}
+    topology.active_node_id = self.active_node_id if self.active_node_id in node_ids else None
+    return topology
+
+  def to_dict(self):
+    return {
+      "nodes": {node_id: capabilities.to_dict() for node_id, capabilities in self.nodes.items()},
+      "edges": [[node1_id, node2_id] for node1_id, node2_id in self.all_edges()],
+      "links": [{"source": from_id, "target": to_id, **link.to_dict()} for (from_id, to_id), link in self.links.items()],
+      "active_node_id": self.active_node_id,
+    }
 
   def __str__(self):
     nodes_str = ", ".join(f"{node_id}: {cap}" for node_id, cap in self.nodes.items())